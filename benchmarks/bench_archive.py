@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Range query latency of the day-ahead price archive.
+#
+# Fills a scratch warp.db with years of 15 minute prices for a few zones and
+# measures /v1/day_ahead_prices/<country>/15min/history for ranges from one
+# day to one year (the maximum a single request may span).
+#
+# Usage: ./benchmarks/bench_archive.py [--years N] [--zones N]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from services import price_archive
+
+DAY = 24 * 3600
+END = 1760392800  # 2025-10-13T22:00Z
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--zones', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    zones = [dap._zones_by_country['de'].eic, dap._zones_by_country['at'].eic]
+    zones += [f'10YBENCH-{i:07d}' for i in range(args.zones - len(zones))]
+    start = END - args.years * 365 * DAY
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'warp.db')
+        t0 = time.perf_counter()
+        for zone in zones:
+            # one append per day, like the updater
+            for day in range(start, END, DAY):
+                price_archive.append(db, zone, 900, day, [rng.randint(-5000, 30000) for _ in range(96)])
+        fill = time.perf_counter() - t0
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        days = (END - start) // DAY
+        print(f"{len(zones)} zones x {args.years} years of 15min prices: {days * len(zones)} blocks, "
+              f"{size / 1e6:.1f} MB, filled in {fill:.1f} s")
+
+        app = Flask(__name__)
+        app.register_blueprint(dap.day_ahead_prices_api)
+        client = app.test_client()
+
+        print(f"{'range':<10}{'prices':>8}{'median':>12}{'p99':>12}")
+        with patch.object(dap, 'WARP_DB_FILE', db):
+            for name, span in (('1 day', DAY), ('1 week', 7 * DAY), ('1 month', 31 * DAY), ('1 year', 366 * DAY)):
+                samples = []
+                for _ in range(args.queries):
+                    frm = rng.randrange(start, END - span)
+                    t0 = time.perf_counter()
+                    r = client.get(f'/v1/day_ahead_prices/de/15min/history?from={frm}&to={frm + span}')
+                    samples.append((time.perf_counter() - t0) * 1000)
+                    assert r.status_code == 200
+                samples.sort()
+                p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+                print(f"{name:<10}{span // 900:>8}{statistics.median(samples):>9.2f} ms{p99:>9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# One /v1/bundle request against the separate requests it replaces.
+#
+# A device with --planes PV planes fetches prices, temperatures and the solar
+# forecast of every plane. Upstream calls are mocked and take --upstream-ms.
+# "cold" is the first poll (forecast caches empty), "warm" a later one. The
+# table shows the requests (TLS round-trips of the device), the bytes sent
+# (gzip) and the time spent in the server.
+#
+# Usage: ./benchmarks/bench_bundle.py [--planes N] [--upstream-ms MS] [--runs N]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import bundle
+
+T0 = 1760392800
+PLANES = ((30, 180, 5000), (30, 90, 3000), (45, -90, 3000), (15, 0, 2000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--planes', type=int, default=2, choices=range(1, len(PLANES) + 1))
+    parser.add_argument('--upstream-ms', type=float, default=150)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    delay = args.upstream_ms / 1000
+
+    def fake_temperatures(lat, lon):
+        time.sleep(delay)
+        return {'hourly': {'time': [T0 + h * 3600 for h in range(48)],
+                           'temperature_2m': [10 + (h % 24) / 3 for h in range(48)]}}
+
+    def fake_irradiance(lat, lon, dec, az):
+        time.sleep(delay)
+        return {'first_date': T0, 'utc_offset': 7200, 'place': 'Europe/Berlin', 'etag': str((lat, lon, dec, az)),
+                'gti': [float(max(0, 700 - abs(h % 24 - 13) * 110)) for h in range(72)], 'responses': {}}
+
+    app = Flask(__name__)
+    for blueprint in (dap.day_ahead_prices_api, temps.temperatures_api, sf.solar_forecast_api, bundle.bundle_api):
+        app.register_blueprint(blueprint)
+    client = app.test_client()
+    client.environ_base['HTTP_ACCEPT_ENCODING'] = 'gzip'
+
+    planes = PLANES[:args.planes]
+    separate = ['/v1/day_ahead_prices/de/15min', '/v1/temperatures/51.90/8.60']
+    separate += ['/v1/solar_forecast/51.90/8.60/{0}/{1}/{2}'.format(*p) for p in planes]
+    combined = ['/v1/bundle/de/15min?lat=51.90&lon=8.60' + ''.join('&plane={0},{1},{2}'.format(*p) for p in planes)]
+
+    def poll(urls):
+        size = 0
+        start = time.perf_counter()
+        for url in urls:
+            r = client.get(url)
+            assert r.status_code == 200, (url, r.status_code)
+            size += len(r.data)
+        return time.perf_counter() - start, size
+
+    record = dap.make_record(T0, [8000 + (i * 37) % 5000 for i in range(96)], T0 + 13 * 3600)
+    print(f"{args.planes} planes, upstream calls take {args.upstream_ms:g} ms, median of {args.runs} runs")
+    print(f"{'':<10}{'requests':>10}{'bytes':>8}{'cold ms':>10}{'warm ms':>10}")
+    with patch.object(dap, 'dap_records', {'de_lu_15min': record}), \
+         patch.object(temps, 'fetch_temperature_forecast', side_effect=fake_temperatures), \
+         patch.object(sf, 'fetch_irradiance', side_effect=fake_irradiance):
+        for name, urls in (('separate', separate), ('bundle', combined)):
+            cold, warm = [], []
+            for _ in range(args.runs):
+                sf._cache.clear()
+                temps._cache.clear()
+                cold.append(poll(urls)[0])
+                t, size = poll(urls)
+                warm.append(t)
+            print(f"{name:<10}{len(urls):>10}{size:>8}"
+                  f"{statistics.median(cold) * 1000:>10.1f}{statistics.median(warm) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Solve time of the charging schedule optimizer.
+#
+# Measures
+#
+#   * solve() alone for horizons of 1 to 7 days of 15 minute slots
+#   * the whole /v1/charge_plan request (parsing, cached PV forecast, solve,
+#     JSON) through the Flask test client, single threaded
+#
+# and reports how many devices one core could serve if every device asked for
+# a new plan every --poll minutes.
+#
+# Usage: ./benchmarks/bench_charge_plan.py [--requests N] [--poll MINUTES]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from services.charge_plan import charge_plan_api, solve
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--poll', type=float, default=15, help='minutes between plans per device')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    print(f"{'solve()':<16}{'slots':>8}{'median':>12}{'p99':>12}")
+    for days in (1, 2, 7):
+        n = days * 96
+        prices = [rng.randint(-500, 30000) for _ in range(n)]
+        capacity = [2750] * n
+        pv = [rng.choice([0, 0, 500, 2000]) for _ in range(n)]
+        samples = []
+        for _ in range(args.requests // 5):
+            t0 = time.perf_counter()
+            solve(prices, capacity, pv, rng.uniform(5000, 60000))
+            samples.append((time.perf_counter() - t0) * 1e6)
+        print(f"{f'{days} day(s)':<16}{n:>8}{statistics.median(samples):>9.0f} us{percentile(samples, 0.99):>9.0f} us")
+
+    now = int(time.time())
+    first_date = now - now % 86400
+    record = dap.make_record(first_date, [rng.randint(-500, 30000) for _ in range(192)], first_date + 86400)
+    entry = {'first_date': first_date, 'utc_offset': 0, 'gti': [], 'place': 'bench'}
+    forecast = [max(0, 5000 - abs(h % 24 - 12) * 800) for h in range(48)]
+
+    app = Flask(__name__)
+    app.register_blueprint(charge_plan_api)
+    client = app.test_client()
+    samples = []
+    with patch.object(dap, 'dap_records', {'de_lu_15min': record}), \
+         patch('services.solar_forecast.get_cached_irradiance', return_value=entry), \
+         patch('services.solar_forecast.compute_forecast', return_value=forecast):
+        for _ in range(args.requests):
+            deadline = now + rng.randint(2, 36) * 3600
+            url = (f'/v1/charge_plan/de/15min?energy={rng.randint(5000, 60000)}&power=11000'
+                   f'&deadline={deadline}&lat=52.5&lon=13.4&dec=30&az=0&wp=10000')
+            t0 = time.perf_counter()
+            r = client.get(url)
+            samples.append((time.perf_counter() - t0) * 1e6)
+            assert r.status_code == 200, r.data
+
+    median = statistics.median(samples)
+    rps = 1e6 / statistics.mean(samples)
+    print()
+    print(f"{'request':<16}{'median':>10}{'p99':>12}{'req/s':>10}")
+    print(f"{'charge_plan+PV':<16}{median:>7.0f} us{percentile(samples, 0.99):>9.0f} us{rps:>10.0f}")
+    print(f"one core plans for ~{rps * args.poll * 60:,.0f} devices polling every {args.poll:g} min")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bytes on the wire per endpoint with the precompressed variants.
+#
+# For each endpoint the body is requested without Accept-Encoding, with gzip
+# and (if the brotli package is installed) with br, and in the binary format
+# where the endpoint has one. The table shows the body sizes and the request
+# time through the WSGI app for identity and gzip, next to what compressing
+# every response on the fly would cost.
+#
+# Usage: ./benchmarks/bench_compression.py [--requests N]
+
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+from services import http_cache
+
+ENDPOINTS = (
+    ('prices 15min', '/v1/day_ahead_prices/de/15min', True),
+    ('prices 60min', '/v1/day_ahead_prices/de/60min', True),
+    ('solar',        '/v1/solar_forecast/52.52/13.41/30/0/10000', True),
+    ('estimate',     '/estimate/52.52/13.41/30/0/10', False),
+)
+
+
+def request(app, url, accept_encoding, query_string=None):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    environ = EnvironBuilder(path=url, headers=headers, query_string=query_string).get_environ()
+    t0 = time.perf_counter()
+    body = b''.join(app(environ, lambda status, headers: None))
+    return body, (time.perf_counter() - t0) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    first_date = 1760392800
+    prices = [(i * 7919) % 20000 - 2000 for i in range(192)]
+    record = dap.make_record(first_date, prices, first_date + 86400)
+    record60 = dap.derive_day_ahead_prices(record, 'PT60M')
+    entry = {'first_date': first_date, 'utc_offset': 7200, 'place': 'Europe/Berlin', 'fetched': time.time(),
+             'gti': [float(max(0, 700 - abs(h % 24 - 13) * 110)) for h in range(72)], 'responses': {}}
+    entry['etag'] = http_cache.make_etag(entry['first_date'], entry['gti'])
+
+    app = Flask(__name__)
+    app.register_blueprint(dap.day_ahead_prices_api)
+    app.register_blueprint(sf.solar_forecast_api)
+
+    encodings = ['gzip'] + (['br'] if http_cache.brotli else [])
+    print(f"{'endpoint':<14}{'identity':>10}" + ''.join(f'{e:>8}' for e in encodings)
+          + f"{'binary':>8}{'us plain':>10}{'us gzip':>9}{'on the fly':>12}")
+    with patch.object(dap, 'dap_records', {'de_lu_15min': record, 'de_lu_60min': record60}), \
+         patch.object(sf, 'get_cached_irradiance', return_value=entry):
+        for name, url, has_binary in ENDPOINTS:
+            plain, _ = request(app, url, None)
+            sizes = [len(request(app, url, e)[0]) for e in encodings]
+            binary = len(request(app, url, None, 'format=binary')[0]) if has_binary else '-'
+            t_plain = statistics.median(request(app, url, None)[1] for _ in range(args.requests))
+            t_gzip = statistics.median(request(app, url, 'gzip')[1] for _ in range(args.requests))
+            t0 = time.perf_counter()
+            for _ in range(args.requests):
+                gzip.compress(plain, 9, mtime=0)
+            t_fly = (time.perf_counter() - t0) / args.requests * 1e6
+            print(f"{name:<14}{len(plain):>10}" + ''.join(f'{s:>8}' for s in sizes)
+                  + f"{binary:>8}{t_plain:>10.0f}{t_gzip:>9.0f}{t_plain + t_fly:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bandwidth and CPU of a polling fleet with and without conditional GET.
+#
+# Every simulated device polls the price, temperature and solar endpoints
+# --polls times. The served content changes every --change-every polls (for
+# prices that is once per day at a 15 minute poll interval). Without
+# conditional GET every poll downloads the full body; with it, a device sends
+# the ETag of its last response and gets an empty 304 until the content
+# changes.
+#
+# Upstream calls are mocked, the solar cache is warm. Bytes are body plus
+# status line and response headers, CPU is process time per request in the
+# WSGI app (what gunicorn calls).
+#
+# Usage: ./benchmarks/bench_conditional_get.py [--devices N] [--polls N] [--change-every N]
+
+import argparse
+import os
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+from services import temperatures
+
+
+def price_records(version):
+    first_date = 1760392800
+    prices = [8000 + (i * 37 + version) % 5000 for i in range(192)]
+    return {'de_lu_15min': dap.make_record(first_date, prices, first_date + 86400)}
+
+
+def temperature_data(version):
+    return {'hourly': {'time': [1760392800 + i * 3600 for i in range(48)],
+                       'temperature_2m': [10.0 + (i + version) % 7 for i in range(48)]}}
+
+
+def solar_entry(version):
+    entry = {'first_date': 1760392800, 'utc_offset': 7200, 'place': 'Europe/Berlin', 'fetched': time.time(),
+             'gti': [float(max(0, 600 - abs(h % 24 - 13) * 100) + version) for h in range(72)]}
+    entry['etag'] = sf.http_cache.make_etag(entry['first_date'], entry['utc_offset'], entry['place'], entry['gti'])
+    return entry
+
+
+ENDPOINTS = (
+    ('prices',   '/v1/day_ahead_prices/de/15min'),
+    ('temps',    '/v1/temperatures/52.52/13.41'),
+    ('solar',    '/v1/solar_forecast/52.52/13.41/30/0/10000'),
+    ('estimate', '/estimate/52.52/13.41/30/0/10'),
+)
+
+
+def run(app, url, devices, polls, change_every, conditional, set_version):
+    sent = 0
+    cpu = 0.0
+    etags = [None] * devices
+    for poll in range(polls):
+        set_version(poll // change_every)
+        for device in range(devices):
+            headers = {'If-None-Match': etags[device]} if (conditional and etags[device]) else {}
+            environ = EnvironBuilder(path=url, headers=headers).get_environ()
+            response = []
+            t0 = time.process_time()
+            body = b''.join(app(environ, lambda status, headers: response.extend((status, headers))))
+            cpu += time.process_time() - t0
+            status, headers = response
+            assert status[:3] in ('200', '304'), status
+            etags[device] = dict(headers).get('ETag')
+            sent += len(body) + len(status) + sum(len(k) + len(v) + 4 for k, v in headers)
+    n = devices * polls
+    return sent / n, cpu / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--polls', type=int, default=24)
+    parser.add_argument('--change-every', type=int, default=8)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(dap.day_ahead_prices_api)
+    app.register_blueprint(temperatures.temperatures_api)
+    app.register_blueprint(sf.solar_forecast_api)
+
+    state = {}
+    def set_version(version):
+        if state.get('version') != version:
+            state['version'] = version
+            state['records'] = price_records(version)
+            state['temps'] = temperature_data(version)
+            state['solar'] = solar_entry(version)
+
+    set_version(0)
+    with patch.object(dap, 'dap_records', state['records']), \
+         patch.object(temperatures, 'fetch_temperature_forecast', side_effect=lambda lat, lon: state['temps']), \
+         patch.object(sf, 'get_cached_irradiance', side_effect=lambda *a: state['solar']):
+        def set_all(version):
+            set_version(version)
+            dap.dap_records = state['records']
+
+        print(f"{args.devices} devices x {args.polls} polls, content changes every {args.change_every} polls")
+        print(f"{'endpoint':<10}{'bytes/poll':>12}{'cond.':>10}{'saved':>8}{'CPU us/poll':>14}{'cond.':>8}")
+        for name, url in ENDPOINTS:
+            full_bytes, full_cpu = run(app, url, args.devices, args.polls, args.change_every, False, set_all)
+            state.clear()
+            cond_bytes, cond_cpu = run(app, url, args.devices, args.polls, args.change_every, True, set_all)
+            state.clear()
+            print(f"{name:<10}{full_bytes:>12.0f}{cond_bytes:>10.0f}{1 - cond_bytes / full_bytes:>8.0%}"
+                  f"{full_cpu:>14.0f}{cond_cpu:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
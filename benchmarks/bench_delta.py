@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bytes per price poll with full bodies and with delta responses.
+#
+# Every simulated device polls the 15 minute prices every 15 minutes for
+# --days days. The served record changes like in production: today's prices
+# at midnight, today's and tomorrow's after the publication at 13:00. All
+# devices use conditional GET. With deltas they also send the ETag they hold
+# as ?known=..., and after a change get only the prices they are missing.
+#
+# Bytes are body plus status line and response headers. The table shows the
+# average per poll and per changed poll (one that is not a 304).
+#
+# Usage: ./benchmarks/bench_delta.py [--devices N] [--days N] [--gzip]
+
+import argparse
+import os
+import sys
+from unittest.mock import patch
+from urllib.parse import quote
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+import services.day_ahead_prices as dap
+
+T0 = 1760392800
+POLLS_PER_DAY = 96
+PUBLICATION_POLL = 52  # 13:00
+
+
+def price(ts):
+    slot = ts // 900
+    return 8000 + (slot * 7919) % 6000 - (slot % 96 - 48) ** 2
+
+
+_records = {}
+
+def record_at(poll):
+    day, slot = divmod(poll, POLLS_PER_DAY)
+    key = (day, slot >= PUBLICATION_POLL)
+    if key not in _records:
+        _records[key] = build_record(day, slot)
+    return _records[key]
+
+
+def build_record(day, slot):
+    first_date = T0 + day * 86400
+    days = 2 if slot >= PUBLICATION_POLL else 1
+    prices = [price(first_date + i * 900) for i in range(days * POLLS_PER_DAY)]
+    next_date = first_date + (86400 if days == 2 else 0) + 13 * 3600
+    return dap.make_record(first_date, prices, next_date)
+
+
+def run(app, devices, polls, delta, accept_encoding):
+    sent = 0
+    changed = 0
+    changed_sent = 0
+    etags = [None] * devices
+    record = None
+    for poll in range(polls):
+        new = record_at(poll)
+        if record is None or new.etag != record.etag:
+            record = new
+            dap._publish({'de_lu_15min': record})
+        for device in range(devices):
+            headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+            query = None
+            if etags[device]:
+                headers['If-None-Match'] = etags[device]
+                if delta:
+                    query = 'known=' + quote(etags[device])
+            environ = EnvironBuilder(path='/v1/day_ahead_prices/de/15min', headers=headers,
+                                     query_string=query).get_environ()
+            response = []
+            body = b''.join(app(environ, lambda status, headers: response.extend((status, headers))))
+            status, headers = response
+            assert status[:3] in ('200', '304'), status
+            n = len(body) + len(status) + sum(len(k) + len(v) + 4 for k, v in headers)
+            if status[:3] == '200':
+                changed += 1
+                changed_sent += n
+            etags[device] = dict(headers).get('ETag')
+            sent += n
+    return sent / (devices * polls), changed_sent / changed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--gzip', action='store_true', help='full bodies gzip compressed')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(dap.day_ahead_prices_api)
+    accept_encoding = 'gzip' if args.gzip else None
+
+    print(f"{args.devices} devices, {args.days} days of 15 minute polls, gzip: {args.gzip}")
+    print(f"{'mode':<8}{'bytes/poll':>12}{'bytes/change':>14}")
+    with patch.object(dap, 'dap_records', {}), patch.object(dap, 'dap_history', {}):
+        for name, delta in (('full', False), ('delta', True)):
+            per_poll, per_change = run(app, args.devices, args.days * POLLS_PER_DAY, delta, accept_encoding)
+            print(f"{name:<8}{per_poll:>12.0f}{per_change:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Cache hits with and without the WSGI fast path (services/fast_path.py).
+#
+# First in this process: --requests calls of the WSGI app per endpoint,
+# without HTTP, so the table shows what Flask adds per request. Then over
+# HTTP: --clients processes poll prices and a cached temperature forecast
+# over keep-alive connections for --seconds, against gunicorn (gthread, as in
+# start.sh, see tests/gunicorn_server.py) without and with the fast path.
+#
+# Usage: ./benchmarks/bench_fast_path.py [--requests N] [--clients N] [--seconds S]
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import fast_path
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+
+T0 = 1760392800
+HEADERS = {'Accept-Encoding': 'gzip', 'X-Poll-Bucket': '3'}
+ENDPOINTS = (('prices', '/v1/day_ahead_prices/de/15min'),
+             ('temps', '/v1/temperatures/51.9/8.6'),
+             ('solar', '/v1/solar_forecast/51.9/8.6/30/0/5000'))
+
+
+def percentile(latencies, q):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+
+def in_process(args):
+    dap.dap_records = {'de_lu_15min': dap.make_record(T0, list(range(96)), T0 + 13 * 3600)}
+    temps._store({(51.9, 8.6): temps._entry(T0, list(range(48)), time.time())}, shared=False)
+    sf._cache[sf._cache_key(51.9, 8.6, 30, 0)] = {
+        'first_date': T0, 'utc_offset': 7200, 'place': 'Europe/Berlin', 'gti': [float(h) for h in range(72)],
+        'etag': 'x', 'responses': {}, 'fetched': time.time()}
+    app = Flask(__name__)
+    for blueprint in (dap.day_ahead_prices_api, temps.temperatures_api, sf.solar_forecast_api):
+        app.register_blueprint(blueprint)
+    apps = (('flask', app.wsgi_app), ('fast path', fast_path.FastPath(app.wsgi_app)))
+
+    def start_response(status, headers):
+        pass
+
+    print(f"In process, {args.requests} requests per endpoint")
+    print(f"{'':<10}{'':<12}{'req/s':>10}{'p50 us':>10}{'p99 us':>10}")
+    for name, path in ENDPOINTS:
+        environ = EnvironBuilder(path=path, headers=HEADERS, environ_base={'REMOTE_ADDR': '10.1.2.3'}).get_environ()
+        for label, wsgi in apps:
+            latencies = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                b''.join(wsgi(dict(environ), start_response))
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f"{name:<10}{label:<12}{len(latencies) / sum(latencies):>10.0f}"
+                  f"{percentile(latencies, 0.5) * 1e6:>10.1f}{percentile(latencies, 0.99) * 1e6:>10.1f}")
+
+
+def poll(port, path, seconds, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.monotonic()
+        conn.request('GET', path, headers=HEADERS)
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        latencies.append(time.monotonic() - start)
+    conn.close()
+    results.put(latencies)
+
+
+def over_http(args):
+    print(f"gunicorn gthread, {args.clients} clients for {args.seconds:g} s per endpoint")
+    print(f"{'':<10}{'':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    ctx = multiprocessing.get_context('fork')
+    with OpenMeteoStandIn() as standin:
+        for name, path in ENDPOINTS[:2]:
+            for label, fast in (('flask', False), ('fast path', True)):
+                with GunicornServer('gthread', standin.url, fast_path=fast) as server:
+                    poll(server.port, path, 0.2, ctx.Queue())  # fills the temperature cache
+                    results = ctx.Queue()
+                    clients = [ctx.Process(target=poll, args=(server.port, path, args.seconds, results))
+                               for _ in range(args.clients)]
+                    for c in clients:
+                        c.start()
+                    latencies = sorted(l for _ in clients for l in results.get())
+                    for c in clients:
+                        c.join()
+                print(f"{name:<10}{label:<12}{len(latencies) / args.seconds:>10.0f}"
+                      f"{percentile(latencies, 0.5) * 1000:>10.2f}{percentile(latencies, 0.99) * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    in_process(args)
+    print()
+    over_http(args)
+
+
+if __name__ == '__main__':
+    main()
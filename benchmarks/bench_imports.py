@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Import time and memory budget of the web process.
+#
+# Every module is imported in a fresh interpreter, so the numbers include
+# everything the module pulls in. Reported per module:
+#
+#   * wall time of the import
+#   * RSS growth caused by the import
+#   * the heaviest packages it pulled in (cumulative time from -X importtime)
+#
+# main is imported from a scratch directory with the updater thread running,
+# like a gunicorn worker would. Exits with status 1 if a module exceeds its
+# budget.
+#
+# Usage: ./benchmarks/bench_imports.py [--runs N]
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# module -> (time budget in ms, RSS budget in MB)
+BUDGETS = {
+    'flask':                     (250, 25),
+    'services.day_ahead_prices': (300, 30),
+    'services.temperatures':     (300, 30),
+    'services.solar_forecast':   (300, 30),
+    'services.status':           (350, 35),
+    'main':                      (400, 40),
+}
+
+CHILD = r'''
+import json, os, sys, time
+sys.path.insert(0, {project_dir!r})
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+rss0 = rss_kb()
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+heavy = [m for m in ('pandas', 'numpy', 'sqlite3') if m in sys.modules]
+print(json.dumps({{'ms': (t1 - t0) * 1000, 'rss_mb': (rss_kb() - rss0) / 1024, 'heavy': heavy}}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)')
+
+
+def run(module, cwd):
+    code = CHILD.format(project_dir=PROJECT_DIR, module=module)
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       cwd=cwd, capture_output=True, text=True, check=True)
+    result = json.loads(p.stdout.strip().splitlines()[-1])
+
+    # Top level packages by import time spent in their own modules, without
+    # what the interpreter imported before our code ran.
+    code_start = p.stderr.find('import time:', p.stderr.find(' site\n'))
+    top = {}
+    for m in IMPORTTIME_RE.finditer(p.stderr, max(code_start, 0)):
+        pkg = m.group(2).split('.')[0]
+        top[pkg] = top.get(pkg, 0) + int(m.group(1))
+    result['top'] = sorted(top.items(), key=lambda kv: -kv[1])[:3]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    over = False
+    print(f"{'module':<28}{'import':>10}{'RSS':>10}  {'heavy deps':<16}top imports")
+    with tempfile.TemporaryDirectory() as cwd:  # main writes debug.log to cwd
+        for module, (budget_ms, budget_mb) in BUDGETS.items():
+            runs = [run(module, cwd) for _ in range(args.runs)]
+            ms = statistics.median(r['ms'] for r in runs)
+            mb = statistics.median(r['rss_mb'] for r in runs)
+            flag = ''
+            if ms > budget_ms or mb > budget_mb:
+                flag = f'  OVER BUDGET ({budget_ms} ms / {budget_mb} MB)'
+                over = True
+            top = ', '.join(f"{name} {us / 1000:.0f} ms" for name, us in runs[-1]['top'])
+            heavy = ','.join(runs[-1]['heavy']) or '-'
+            print(f"{module:<28}{ms:>7.0f} ms{mb:>7.1f} MB  {heavy:<16}{top}{flag}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Throughput and upstream calls with several gunicorn worker processes.
+#
+# For every --workers count the app runs under gunicorn (gthread, see
+# tests/gunicorn_server.py) against the Open-Meteo stand-in, once with and
+# once without the shared forecast cache (services/shared_cache.py). First
+# --locations temperature locations are requested --polls times each (every
+# request on a new connection, so gunicorn spreads them over the workers),
+# then --clients client processes send cached price and temperature requests
+# for --seconds. The table shows the upstream requests of the first part and
+# the requests per second of the second.
+#
+# Usage: ./benchmarks/bench_multiworker.py [--workers N ...] [--clients N] [--seconds S]
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+
+
+def get(port, url, conn=None):
+    own = conn is None
+    if own:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('GET', url)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 200, (url, response.status)
+    if own:
+        conn.close()
+
+
+def location_url(i):
+    return '/v1/temperatures/{0:.2f}/8.00'.format(47 + i / 100)
+
+
+def client(port, locations, end, counts):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    n = 0
+    while time.time() < end:
+        get(port, '/v1/day_ahead_prices/de/15min', conn)
+        get(port, location_url(n % locations), conn)
+        n += 2
+    counts.put(n)
+
+
+def run(workers, shared, args, standin):
+    with tempfile.TemporaryDirectory() as tmpdir, \
+         GunicornServer('gthread', standin.url, workers=workers,
+                        shared_cache=os.path.join(tmpdir, 'cache.db') if shared else None) as server:
+        requests = standin.requests
+        for _ in range(args.polls):
+            for i in range(args.locations):
+                get(server.port, location_url(i))
+        upstream = standin.requests - requests
+
+        counts = multiprocessing.Queue()
+        end = time.time() + args.seconds
+        clients = [multiprocessing.Process(target=client, args=(server.port, args.locations, end, counts))
+                   for _ in range(args.clients)]
+        for p in clients:
+            p.start()
+        total = sum(counts.get() for _ in clients)
+        for p in clients:
+            p.join()
+    print(f"{workers:>8}{'yes' if shared else 'no':>8}{upstream:>10}{total / args.seconds:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--polls', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.locations} locations polled {args.polls} times, "
+          f"{args.clients} clients for {args.seconds:g} s")
+    print(f"{'workers':>8}{'shared':>8}{'upstream':>10}{'req/s':>10}")
+    with OpenMeteoStandIn() as standin:
+        for workers in args.workers:
+            for shared in (False, True):
+                run(workers, shared, args, standin)
+
+
+if __name__ == '__main__':
+    main()
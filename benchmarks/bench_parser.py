@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Throughput benchmark of the ENTSO-E parser.
+#
+# Parses every document in tests/data/entsoe repeatedly with the streaming
+# parser (services.day_ahead_prices.parse_timeseries) and with the original
+# pandas implementation (tests/reference_parser.py) and reports documents/s,
+# MB/s and price points/s.
+#
+# Usage: ./benchmarks/bench_parser.py [--seconds S]
+
+import argparse
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from services.day_ahead_prices import parse_timeseries
+from tests.reference_parser import reference_parse_timeseries
+
+CORPUS_DIR = os.path.join(PROJECT_DIR, 'tests', 'data', 'entsoe')
+
+
+def measure(fn, docs, seconds):
+    n_docs = n_bytes = n_points = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        for doc in docs:
+            n_points += fn(doc)
+            n_docs += 1
+            n_bytes += len(doc)
+    dt = time.perf_counter() - t0
+    return n_docs / dt, n_bytes / dt / 1e6, n_points / dt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    docs = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith('.xml'):
+            with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as f:
+                docs.append(f.read())
+
+    print(f"{len(docs)} documents, {sum(len(d) for d in docs) / 1000:.0f} kB")
+    print(f"{'':<12}{'docs/s':>10}{'MB/s':>10}{'points/s':>12}")
+    results = {}
+    for name, fn in (('reference', lambda d: len(reference_parse_timeseries(d, 'PT15M'))),
+                     ('streaming', lambda d: len(parse_timeseries(d, 'PT15M')[1]))):
+        results[name] = measure(fn, docs, args.seconds)
+        docs_s, mb_s, points_s = results[name]
+        print(f"{name:<12}{docs_s:>10.0f}{mb_s:>10.1f}{points_s:>12.0f}")
+    print(f"speedup: {results['streaming'][0] / results['reference'][0]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
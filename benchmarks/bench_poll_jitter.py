@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Request peaks of a device fleet with and without poll jitter.
+#
+# Prices: --devices devices (random addresses) fetch the prices once and
+# poll again at the next_date they were given, plus a random delay of up to
+# --check-interval seconds (how often the firmware looks at the clock).
+# Without jitter they all got 13:30.
+#
+# Solar: --sites devices at different locations poll /estimate for --hours
+# hours, starting at random times, and poll again 2 * ratelimit.period
+# seconds after each response. Before, period was always 3600. The table
+# shows the request peak, the upstream fetches and how old the served
+# forecasts were.
+#
+# Requests go through the WSGI app with a simulated clock, upstream calls
+# are mocked.
+#
+# Usage: ./benchmarks/bench_poll_jitter.py [--devices N] [--sites N] [--hours N] [--check-interval S]
+
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+from collections import Counter
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+from services import http_cache, poll_jitter
+
+T0 = 1760392800  # midnight
+CLOCK = [T0]
+
+
+def get(app, url, remote_addr='127.0.0.1'):
+    environ = EnvironBuilder(path=url, environ_base={'REMOTE_ADDR': remote_addr}).get_environ()
+    response = []
+    body = b''.join(app(environ, lambda status, headers: response.append(status)))
+    assert response[0].startswith('200'), response[0]
+    return json.loads(body)
+
+
+def price_peaks(app, devices, check_interval, rng):
+    record = dap.make_record(T0, list(range(96)), T0 + 13 * 3600 + 1800)
+    dap._publish({'de_lu_15min': record})
+    per_second = Counter()
+    for _ in range(devices):
+        addr = '{0}.{1}.{2}.{3}'.format(*(rng.randrange(1, 255) for _ in range(4)))
+        next_date = get(app, '/v1/day_ahead_prices/de/15min', addr)['next_date']
+        per_second[int(next_date + rng.uniform(0, check_interval))] += 1
+    spread = max(per_second) - min(per_second) + 1
+    return max(per_second.values()), spread
+
+
+def fake_fetch(lat, lon, dec, az):
+    entry = {'first_date': T0, 'utc_offset': 7200, 'place': 'Europe/Berlin',
+             'gti': [float(max(0, 700 - abs(h % 24 - 13) * 110)) for h in range(72)]}
+    entry['etag'] = http_cache.make_etag(CLOCK[0], lat, lon)
+    entry['responses'] = {}
+    return entry
+
+
+def solar_peaks(app, sites, hours, rng):
+    sf._cache.clear()
+    end = T0 + hours * 3600
+    polls = [(T0 + rng.uniform(0, sf.CACHE_TTL_SECONDS), i) for i in range(sites)]
+    heapq.heapify(polls)
+    per_minute = Counter()
+    ages = []
+    fetches = 0
+    with patch.object(sf, 'fetch_irradiance', side_effect=fake_fetch) as fetch:
+        while polls and polls[0][0] < end:
+            now, site = heapq.heappop(polls)
+            CLOCK[0] = now
+            d = get(app, '/estimate/{0:.2f}/8.00/30/0/10'.format(48 + site * 0.01))
+            entry = sf._cache[sf._cache_key(48 + site * 0.01, 8.0, 30, 0)]
+            ages.append(now - entry['fetched'])
+            per_minute[int(now // 60)] += 1
+            heapq.heappush(polls, (now + 2 * d['message']['ratelimit']['period'], site))
+        fetches = fetch.call_count
+    return max(per_minute.values()), sum(per_minute.values()), fetches, statistics.mean(ages) / 60, max(ages) / 60
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=20000)
+    parser.add_argument('--sites', type=int, default=2000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--check-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(dap.day_ahead_prices_api)
+    app.register_blueprint(sf.solar_forecast_api)
+
+    print(f"prices: {args.devices} devices, firmware checks every {args.check_interval:g} s")
+    print(f"{'':<10}{'peak req/s':>12}{'spread s':>10}")
+    for name, window in (('before', 0), ('jitter', poll_jitter.JITTER_WINDOW)):
+        with patch.object(dap, 'dap_records', {}), patch.object(dap, 'dap_history', {}), \
+             patch.object(poll_jitter, 'JITTER_WINDOW', window):
+            peak, spread = price_peaks(app, args.devices, args.check_interval, random.Random(1))
+        print(f"{name:<10}{peak:>12}{spread:>10}")
+
+    print()
+    print(f"solar: {args.sites} sites, {args.hours} h")
+    print(f"{'':<10}{'peak req/min':>14}{'requests':>10}{'fetches':>9}{'age min':>9}{'max age':>9}")
+    with patch('services.solar_forecast.time.time', side_effect=lambda: CLOCK[0]), \
+         patch('services.http_cache.time.time', side_effect=lambda: CLOCK[0]):
+        for name, period in (('before', lambda *args: 3600), ('aligned', sf.ratelimit_period)):
+            with patch.object(sf, 'ratelimit_period', side_effect=period):
+                peak, total, fetches, age, max_age = solar_peaks(app, args.sites, args.hours, random.Random(2))
+            print(f"{name:<10}{peak:>14}{total:>10}{fetches:>9}{age:>9.0f}{max_age:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
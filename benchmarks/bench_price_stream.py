@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Memory per connection and broadcast latency of the price stream.
+#
+# Opens --connections idle SSE connections to a PriceStream from a separate
+# client process, so the server's RSS only contains its own side. Then
+# publishes --broadcasts new records and measures how long it takes until
+# every client has received each one (publish on the server to arrival at
+# the client, same machine).
+#
+# Usage: ./benchmarks/bench_price_stream.py [--connections N] [--broadcasts N]
+
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+import services.day_ahead_prices as dap
+from services import price_stream
+
+T0 = 1760392800
+REQUEST = b'GET /v1/day_ahead_prices/de/15min/stream HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+class Client(asyncio.Protocol):
+    def __init__(self):
+        self.buf = b''
+        self.received = {}  # event id -> arrival time
+
+    def connection_made(self, transport):
+        transport.write(REQUEST)
+
+    def data_received(self, data):
+        now = time.time()
+        self.buf += data
+        *events, self.buf = self.buf.split(b'\n\n')
+        for event in events:
+            for line in event.split(b'\n'):
+                if line.startswith(b'id: '):
+                    self.received[line[4:].decode()] = now
+
+
+async def run_clients(conn, port, n):
+    loop = asyncio.get_running_loop()
+    clients = []
+    for _ in range(n):
+        _, client = await loop.create_connection(Client, '127.0.0.1', port)
+        clients.append(client)
+    while not all(c.received for c in clients):
+        await asyncio.sleep(0.01)
+    conn.send('ready')
+    while True:
+        etag = await loop.run_in_executor(None, conn.recv)
+        if etag is None:
+            break
+        deadline = time.time() + 30
+        while not all(etag in c.received for c in clients) and time.time() < deadline:
+            await asyncio.sleep(0.001)
+        conn.send([c.received.get(etag) for c in clients])
+
+
+def client_process(conn):
+    port, n = conn.recv()
+    asyncio.run(run_clients(conn, port, n))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--broadcasts', type=int, default=5)
+    args = parser.parse_args()
+
+    # Started before the server thread, fork and threads don't mix.
+    conn, child_conn = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=client_process, args=(child_conn,), daemon=True)
+    child.start()
+
+    record = dap.make_record(T0, list(range(96)), T0 + 13 * 3600)
+    with patch.object(dap, 'dap_records', {'de_lu_15min': record}), patch.object(dap, 'dap_history', {}):
+        stream = price_stream.PriceStream().start(port=0)
+        gc.collect()
+        before = rss_kb()
+        conn.send((stream.port, args.connections))
+        assert conn.recv() == 'ready'
+        while stream.connections < args.connections:
+            time.sleep(0.01)
+        gc.collect()
+        after = rss_kb()
+
+        latencies = []
+        for i in range(args.broadcasts):
+            new = dap.make_record(T0, list(range(96 + i + 1)), T0 + 86400)
+            t0 = time.time()
+            dap._publish({'de_lu_15min': new})
+            conn.send(new.etag)
+            arrivals = conn.recv()
+            missing = arrivals.count(None)
+            assert missing == 0, '{0} clients did not get the update'.format(missing)
+            latencies.append(sorted(t - t0 for t in arrivals))
+        conn.send(None)
+        stream.stop()
+    child.join()
+
+    print(f"{args.connections} connections, {args.broadcasts} broadcasts of {len(new.body)} B")
+    print(f"server RSS {before / 1024:.1f} MB -> {after / 1024:.1f} MB, "
+          f"{(after - before) * 1024 / args.connections:.0f} B per connection")
+    print(f"{'broadcast':<10}{'first ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'last ms':>10}")
+    for i, l in enumerate(latencies):
+        print(f"{i:<10}{l[0] * 1000:>10.1f}{statistics.median(l) * 1000:>10.1f}"
+              f"{l[int(len(l) * 0.99) - 1] * 1000:>10.1f}{l[-1] * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Startup-time benchmark for the web process.
+#
+# Imports main.py (what gunicorn does when it boots a worker) in a fresh
+# interpreter while ENTSO-E is simulated as slow, and measures
+#
+#   * how long the import takes (time until gunicorn could accept traffic)
+#   * how long until /v1/day_ahead_prices/de/15min answers with 200
+#
+# once without and once with a persisted price snapshot.
+#
+# Usage: ./benchmarks/bench_startup.py [--entsoe-delay SECONDS]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+
+def child(snapshot_path, delay):
+    sys.path.insert(0, PROJECT_DIR)
+    t0 = time.perf_counter()
+
+    import services.day_ahead_prices as dap
+
+    def slow_urlopen(*args, **kwargs):
+        time.sleep(delay)
+        raise OSError("simulated ENTSO-E timeout")
+
+    dap.urlopen = slow_urlopen
+    dap.SNAPSHOT_FILE = snapshot_path
+    # Don't let the simulated outage wait through the real retry back-off.
+    dap.update_day_ahead_prices_with_retry.__defaults__ = (None, 1)
+
+    import main
+    t_import = time.perf_counter() - t0
+
+    client = main.app.test_client()
+    t_first = None
+    deadline = time.perf_counter() + delay + 30
+    while time.perf_counter() < deadline:
+        if client.get('/v1/day_ahead_prices/de/15min').status_code == 200:
+            t_first = time.perf_counter() - t0
+            break
+        time.sleep(0.01)
+
+    print(json.dumps({'import': t_import, 'first_200': t_first}))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run(snapshot_path, delay):
+    with tempfile.TemporaryDirectory() as cwd:  # keep debug.log out of the tree
+        out = subprocess.run([sys.executable, os.path.realpath(__file__), '--child', snapshot_path,
+                              '--entsoe-delay', str(delay)],
+                             cwd=cwd, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entsoe-delay', type=float, default=5.0)
+    parser.add_argument('--child', metavar='SNAPSHOT')
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.entsoe_delay)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        missing = os.path.join(tmp, 'missing.json')
+        snapshot = os.path.join(tmp, 'snapshot.json')
+        body = json.dumps({'first_date': int(time.time()) // 86400 * 86400,
+                           'prices': [10000] * 192,
+                           'next_date': int(time.time()) - 60}, separators=(',', ':'))
+        with open(snapshot, 'w') as f:
+            json.dump({'de_lu_15min': body, 'at_15min': body}, f)
+
+        print(f"Simulated ENTSO-E delay: {args.entsoe_delay:.1f} s per request")
+        print(f"{'':<16}{'import main':>14}{'first 200':>14}")
+        for name, path in (('no snapshot', missing), ('with snapshot', snapshot)):
+            r = run(path, args.entsoe_delay)
+            first = f"{r['first_200'] * 1000:.0f} ms" if r['first_200'] is not None else 'never'
+            print(f"{name:<16}{r['import'] * 1000:>11.0f} ms{first:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Day-ahead prices served by Flask versus the files written by
+# services/static_prices.py.
+#
+# First the cost of the publication: a record for every served zone and
+# resolution is written (as updater.py does on start), then one changed
+# record. Then --clients processes poll /v1/day_ahead_prices/de/15min over
+# keep-alive connections for --seconds, once against gunicorn (gthread, as in
+# start.sh, see tests/gunicorn_server.py) and once against nginx serving the
+# published files with the configuration from the README. nginx is only
+# measured if it is installed (or given with --nginx).
+#
+# Usage: ./benchmarks/bench_static_prices.py [--clients N] [--seconds S] [--nginx PATH]
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+import services.day_ahead_prices as dap
+from services import static_prices
+from tests.gunicorn_server import GunicornServer
+
+T0 = 1760392800
+
+NGINX_CONF = """
+worker_processes 1;
+error_log stderr error;
+pid {dir}/nginx.pid;
+events {{}}
+http {{
+    access_log off;
+    types {{ application/json json; }}
+    map $http_x_poll_bucket $poll_bucket {{ default 0; "~^[0-9]+$" $http_x_poll_bucket; }}
+    server {{
+        listen 127.0.0.1:{port};
+        location ~ ^/v1/day_ahead_prices/[^/]+/[^/]+$ {{
+            root {static}/$poll_bucket;
+            gzip_static on;
+            try_files $uri.json =404;
+        }}
+    }}
+}}
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def poll(port, seconds, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.monotonic()
+        conn.request('GET', '/v1/day_ahead_prices/de/15min', headers={'Accept-Encoding': 'gzip', 'X-Poll-Bucket': '3'})
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        latencies.append(time.monotonic() - start)
+    conn.close()
+    results.put(latencies)
+
+
+def measure(label, port, args):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    clients = [ctx.Process(target=poll, args=(port, args.seconds, results)) for _ in range(args.clients)]
+    for c in clients:
+        c.start()
+    latencies = sorted(l for _ in clients for l in results.get())
+    for c in clients:
+        c.join()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{label:<10}{len(latencies) / args.seconds:>10.0f}{p(0.5):>10.2f}{p(0.99):>10.2f}")
+
+
+def publication():
+    records = {}
+    for name, zone, resolution in dap.daps():
+        records[name] = dap.make_record(T0, [(i * 37) % 500 for i in range(96 * 900 // dap.RESOLUTION_SECONDS[resolution])],
+                                        T0 + 13 * 3600, resolution)
+    dap.dap_records = records
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.monotonic()
+        static_prices.enable(directory)
+        static_prices.flush()
+        full = time.monotonic() - start
+        files = sum(len(names) for _, _, names in os.walk(directory))
+        changed = dap.make_record(T0, list(range(96)), T0 + 13 * 3600)
+        start = time.monotonic()
+        dap._publish({'de_lu_15min': changed})
+        listener = time.monotonic() - start
+        static_prices.flush()
+        one = time.monotonic() - start
+        static_prices.disable()
+    print(f"publication: {len(records)} records, {files} files in {full:.2f} s; one changed record in {one * 1000:.0f} ms"
+          f" (publish returned after {listener * 1000:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--nginx', default=shutil.which('nginx'))
+    args = parser.parse_args()
+
+    publication()
+
+    print(f"{args.clients} clients polling /v1/day_ahead_prices/de/15min (gzip) for {args.seconds:g} s")
+    print(f"{'':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    with GunicornServer('gthread', 'http://127.0.0.1:9') as server:
+        measure('flask', server.port, args)
+
+    if not args.nginx:
+        print("nginx          not installed, static path not measured (--nginx PATH)")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        static = os.path.join(directory, 'static_prices')
+        dap.dap_records = {'de_lu_15min': dap.make_record(T0, list(range(96)), T0 + 13 * 3600)}
+        static_prices.enable(static)
+        static_prices.flush()
+        port = free_port()
+        with open(os.path.join(directory, 'nginx.conf'), 'w') as f:
+            f.write(NGINX_CONF.format(dir=directory, port=port, static=static))
+        nginx = subprocess.Popen([args.nginx, '-p', directory, '-c', 'nginx.conf', '-g', 'daemon off;'])
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            measure('nginx', port, args)
+        finally:
+            nginx.terminate()
+            nginx.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Throughput of POST /v1/temperatures for fleet-sized batches.
+#
+# Sites are random locations in Germany. The upstream is the local Open-Meteo
+# stand-in (tests/open_meteo_standin.py) with --latency-ms per request.
+# "single" is one GET /v1/temperatures per site (measured on --single sites,
+# cold cache), "batch" one POST with all sites, cold and then again warm
+# (all sites cached). The table shows sites per second, the upstream
+# requests and the time until the first bytes of the response were sent.
+#
+# Usage: ./benchmarks/bench_temperature_batch.py [--sites N ...] [--latency-ms MS] [--single N]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+import services.temperatures as temps
+from tests.open_meteo_standin import OpenMeteoStandIn
+
+
+def post(client, locations):
+    start = time.perf_counter()
+    response = client.post('/v1/temperatures', json={'locations': locations}, buffered=False)
+    assert response.status_code == 200
+    chunks = iter(response.response)
+    first = next(chunks)
+    first_byte = time.perf_counter() - start
+    body = first + b''.join(chunks)
+    elapsed = time.perf_counter() - start
+    results = json.loads(body)
+    assert len(results) == len(locations) and not any('error' in r for r in results)
+    return elapsed, first_byte
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sites', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--single', type=int, default=100)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.register_blueprint(temps.temperatures_api)
+    client = app.test_client()
+    rng = random.Random(1)
+
+    print(f"upstream latency {args.latency_ms:g} ms, {temps.UPSTREAM_BATCH} locations per upstream call, "
+          f"{temps.UPSTREAM_CONCURRENCY} in parallel")
+    print(f"{'sites':>7}{'cells':>7}  {'':<12}{'sites/s':>10}{'upstream':>10}{'first ms':>10}{'total s':>9}")
+    with OpenMeteoStandIn(latency=args.latency_ms / 1000, max_locations=temps.UPSTREAM_BATCH) as standin, \
+         patch.object(temps, 'OPEN_METEO_BASE_URL', standin.url):
+        sites = [[round(rng.uniform(47, 55), 4), round(rng.uniform(6, 15), 4)] for _ in range(args.single)]
+        temps._cache.clear()
+        start = time.perf_counter()
+        for lat, lon in sites:
+            assert client.get('/v1/temperatures/{0}/{1}'.format(lat, lon)).status_code == 200
+        elapsed = time.perf_counter() - start
+        print(f"{args.single:>7}{'':>7}  {'single':<12}{args.single / elapsed:>10.0f}"
+              f"{standin.requests:>10}{'':>10}{elapsed:>9.2f}")
+
+        for n in args.sites:
+            sites = [[round(rng.uniform(47, 55), 4), round(rng.uniform(6, 15), 4)] for _ in range(n)]
+            cells = len({temps._cache_key(lat, lon) for lat, lon in sites})
+            temps._cache.clear()
+            for name in ('batch cold', 'batch warm'):
+                requests = standin.requests
+                elapsed, first_byte = post(client, sites)
+                print(f"{n:>7}{cells:>7}  {name:<12}{n / elapsed:>10.0f}{standin.requests - requests:>10}"
+                      f"{first_byte * 1000:>10.1f}{elapsed:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
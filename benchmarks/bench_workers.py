@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Head-of-line blocking per gunicorn worker class.
+#
+# The app runs under gunicorn (one worker process, as in start.sh, see
+# tests/gunicorn_server.py). --slow clients keep requesting temperatures for
+# new locations, each waits --latency-ms for the Open-Meteo stand-in, while
+# one client polls day-ahead prices for --seconds. The table shows the price
+# requests answered and their latency, and the temperature requests answered.
+# gevent is only measured if it is installed.
+#
+# Usage: ./benchmarks/bench_workers.py [--slow N] [--latency-ms MS] [--seconds S] [--threads N]
+
+import argparse
+import http.client
+import importlib.util
+import itertools
+import os
+import statistics
+import sys
+import threading
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+
+
+def get(port, url):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', url)
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, (url, response.status)
+    finally:
+        conn.close()
+
+
+def run(worker_class, threads, args, standin):
+    locations = itertools.count()
+    stop = threading.Event()
+    slow_done = []
+
+    with GunicornServer(worker_class, standin.url, threads) as server:
+        def slow():
+            while not stop.is_set():
+                get(server.port, '/v1/temperatures/{0:.2f}/8.00'.format(47 + next(locations) / 100))
+                slow_done.append(1)
+
+        clients = [threading.Thread(target=slow) for _ in range(args.slow)]
+        for t in clients:
+            t.start()
+        time.sleep(0.2)
+        latencies = []
+        end = time.monotonic() + args.seconds
+        while time.monotonic() < end:
+            start = time.monotonic()
+            get(server.port, '/v1/day_ahead_prices/de/15min')
+            latencies.append(time.monotonic() - start)
+        stop.set()
+        for t in clients:
+            t.join()
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{worker_class:<10}{len(latencies) / args.seconds:>10.1f}{statistics.median(latencies) * 1000:>10.1f}"
+          f"{p99 * 1000:>10.1f}{latencies[-1] * 1000:>10.1f}{len(slow_done) / args.seconds:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slow', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=1000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    workers = [('sync', 1), ('gthread', args.threads)]
+    if importlib.util.find_spec('gevent'):
+        workers.append(('gevent', 1))
+
+    print(f"{args.slow} clients waiting {args.latency_ms:g} ms for the upstream, one polling prices, "
+          f"{args.seconds:g} s per worker class")
+    print(f"{'':<10}{'prices/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'temps/s':>10}")
+    with OpenMeteoStandIn(latency=args.latency_ms / 1000) as standin:
+        for worker_class, threads in workers:
+            run(worker_class, threads, args, standin)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Update and routing cost of many bidding zones.
+#
+# Registers N synthetic zones, runs one full update against a local ENTSO-E
+# stand-in (tests/entsoe_standin.py) with simulated latency, once with
+# concurrency 1 (the old sequential loop) and once with the configured
+# UPDATE_CONCURRENCY, and then measures request latency for the first and the
+# last registered zone (routing is a dict lookup, so both should match).
+#
+# Usage: ./benchmarks/bench_zones.py [--zones N] [--latency SECONDS]
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, PROJECT_DIR)
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from tests.entsoe_standin import EntsoeStandIn
+
+
+def run_update(concurrency, latency, tmp):
+    with EntsoeStandIn(latency=latency) as standin, \
+         patch.object(dap, 'ENTSOE_API_URL', standin.url), \
+         patch.object(dap, 'UPDATE_CONCURRENCY', concurrency), \
+         patch.object(dap, 'dap_records', {}):
+        t0 = time.perf_counter()
+        dap.update()
+        dt = time.perf_counter() - t0
+        return dt, standin.max_in_flight, len(dap.dap_records), dict(dap.dap_records)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zones', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    zones = [dap.Zone('z{0:03d}'.format(i), '10YBENCH-{0:06d}'.format(i), ('z{0:03d}'.format(i),))
+             for i in range(args.zones)]
+    dap.load_registry(zones)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(dap, 'ENTSOE_KEY', 'bench'), \
+         patch.object(dap, 'SNAPSHOT_FILE', os.path.join(tmp, 'snapshot.json')), \
+         patch.object(dap, 'WARP_DB_FILE', os.path.join(tmp, 'warp.db')):
+        print(f"{args.zones} zones, simulated ENTSO-E latency {args.latency:.2f} s")
+        print(f"{'concurrency':<14}{'update':>10}{'in flight':>11}{'records':>9}")
+        for concurrency in (1, dap.UPDATE_CONCURRENCY):
+            dt, in_flight, n, records = run_update(concurrency, args.latency, tmp)
+            print(f"{concurrency:<14}{dt:>8.2f} s{in_flight:>11}{n:>9}")
+
+        app = Flask(__name__)
+        app.register_blueprint(dap.day_ahead_prices_api)
+        client = app.test_client()
+        print(f"{'route':<24}{'median':>10}{'p99':>10}")
+        with patch.object(dap, 'dap_records', records):
+            for zone in (zones[0], zones[-1]):
+                url = f'/v1/day_ahead_prices/{zone.countries[0]}/15min'
+                samples = []
+                for _ in range(args.requests):
+                    t0 = time.perf_counter()
+                    client.get(url)
+                    samples.append((time.perf_counter() - t0) * 1e6)
+                samples.sort()
+                p99 = samples[int(len(samples) * 0.99)]
+                print(f"{zone.countries[0] + '/15min':<24}{statistics.median(samples):>7.0f} us{p99:>7.0f} us")
+
+
+if __name__ == '__main__':
+    main()
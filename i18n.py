@@ -88,11 +88,16 @@ TRANSLATIONS = {
         'status_col_source': 'Quelle',
         'status_col_prices': 'Preise',
         'status_col_entsoe_fallback': 'ENTSO-E / Fallback',
+        'status_col_download': 'Download',
+        'status_incremental': 'inkrementell',
+        'status_wins': 'schneller',
         'status_col_fails': 'Fehler',
         'status_yes': 'ja',
         'status_no': 'nein',
         'status_not_tried': 'nicht versucht',
         'status_fallback': 'Fallback',
+        'status_snapshot': 'Snapshot',
+        'status_derived': 'aus 15 min',
         'status_note': 'Zeiten in Serverzeit. Diagnosedaten werden im Speicher gehalten und beim Neustart zur\u00fcckgesetzt.',
 
         # --- errors ---
@@ -191,11 +196,16 @@ TRANSLATIONS = {
         'status_col_source': 'Source',
         'status_col_prices': 'Prices',
         'status_col_entsoe_fallback': 'ENTSO-E / fallback',
+        'status_col_download': 'Download',
+        'status_incremental': 'incremental',
+        'status_wins': 'faster',
         'status_col_fails': 'Fails',
         'status_yes': 'yes',
         'status_no': 'no',
         'status_not_tried': 'not tried',
         'status_fallback': 'fallback',
+        'status_snapshot': 'snapshot',
+        'status_derived': 'from 15 min',
         'status_note': 'Times are server-local. Diagnostics are kept in memory and reset when the service restarts.',
 
         # --- errors ---
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from services import day_ahead_prices, temperatures, solar_forecast, status
+from services import day_ahead_prices, temperatures, solar_forecast, charge_plan, status, price_stream, bundle, shared_cache, peers, fast_path
 from i18n import get_translations, SUPPORTED_LANGUAGES, DEFAULT_LANGUAGE
 from flask import Flask, Blueprint, render_template, request, redirect, abort
 import logging
@@ -47,19 +47,30 @@ def home(lang):
     if lang not in SUPPORTED_LANGUAGES:
         abort(404)
     t = get_translations(lang)
-    return render_template('index.html', t=t, lang=lang)
+    countries = [country for zone in day_ahead_prices.ZONES for country in zone.countries]
+    return render_template('index.html', t=t, lang=lang, countries=countries)
 
-def backend_tasks():
-    global running
-    day_ahead_prices.update()
-    running = True
+UPDATE_INTERVAL = 5*60
+SNAPSHOT_CHECK_INTERVAL = 10
+
+# PRICE_UPDATER=external: the prices are updated by updater.py, the workers
+# only load the snapshots it writes.
+EXTERNAL_UPDATER = os.environ.get('PRICE_UPDATER') == 'external'
 
+def backend_tasks():
+    # With several worker processes one of them updates the prices, the
+    # others load the snapshot it writes.
+    next_update = 0
     while running:
-        time.sleep(5*60)
         try:
-            day_ahead_prices.update()
+            if EXTERNAL_UPDATER or not day_ahead_prices.acquire_updater_lock():
+                day_ahead_prices.reload_snapshot()
+            elif time.time() >= next_update:
+                day_ahead_prices.update()
+                next_update = time.time() + UPDATE_INTERVAL
         except:
             logging.error("Exception during day ahead price update", exc_info=True)
+        time.sleep(SNAPSHOT_CHECK_INTERVAL)
 
 # Flask init
 app = Flask(__name__)
@@ -67,19 +78,46 @@ app.register_blueprint(main_api)
 app.register_blueprint(day_ahead_prices.day_ahead_prices_api)
 app.register_blueprint(temperatures.temperatures_api)
 app.register_blueprint(solar_forecast.solar_forecast_api)
+app.register_blueprint(charge_plan.charge_plan_api)
 app.register_blueprint(status.status_api)
+app.register_blueprint(bundle.bundle_api)
 app.config["JSON_SORT_KEYS"] = False
 
+# Polls for data this process holds are answered without Flask, see
+# services/fast_path.py.
+app.wsgi_app = fast_path.FastPath(app.wsgi_app)
+
 port = int(os.environ.get('PORT', DEFAULT_PORT))
-running = False
+running = True
 
-backend_thread = threading.Thread(target=backend_tasks)
 logging.basicConfig(filename='debug.log', level=logging.DEBUG, format="[%(asctime)s %(levelname)-8s%(filename)s:%(lineno)s] %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+
+# Forecasts fetched by one worker process are used by the others.
+shared_cache.enable(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache.db'))
+
+# Peer mode, e.g. PEERS=http://10.0.0.1:8080,http://10.0.0.2:8080 and
+# PEER_SELF=http://10.0.0.1:8080 (the same PEERS on every node).
+peers.configure(os.environ.get('PEER_SELF'), [url for url in os.environ.get('PEERS', '').split(',') if url])
+if peers.enabled():
+    app.register_blueprint(peers.peers_api)
+
+# Serve the last good prices right away, the first update (including its
+# retries, which can take ~10 minutes) runs in the background.
+if EXTERNAL_UPDATER:
+    day_ahead_prices.reload_snapshot()  # with the updater's health
+else:
+    day_ahead_prices.load_snapshot()
+backend_thread = threading.Thread(target=backend_tasks, daemon=True)
 backend_thread.start()
 
-# Wait for first data update
-while not running:
-    time.sleep(1)
+# The price update streams are served by their own asyncio server, the
+# reverse proxy routes /v1/day_ahead_prices/<country>/<resolution>/stream to it.
+stream_port = int(os.environ.get('STREAM_PORT', price_stream.DEFAULT_PORT))
+try:
+    price_stream.PriceStream().start('127.0.0.1', stream_port)
+except OSError as e:
+    # Expected with several worker processes, the first one serves the streams
+    logging.warning("Could not start the price stream on port {0}: {1}".format(stream_port, e))
 
 def _find_free_port(start):
     p = start
@@ -118,6 +156,7 @@ if __name__ == "__main__":
 
     print(f" * HTTP  on http://0.0.0.0:{port}/")
     print(f" * HTTPS on https://0.0.0.0:{https_port}/  (self-signed)")
+    print(f" * Price streams on http://127.0.0.1:{stream_port}/v1/day_ahead_prices/<country>/<resolution>/stream")
     if ips:
         for ip in ips:
             print(f"     reachable at  https://{ip}:{https_port}/")
@@ -138,4 +177,3 @@ if __name__ == "__main__":
         http_srv.shutdown()
 
     running = False
-    backend_thread.join()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Compact binary encoding of the integer series served to devices.
+#
+# Parsing JSON arrays of several hundred integers costs RAM and time on a
+# microcontroller. Price, temperature and solar forecast endpoints can answer
+# with this format instead, selected with ?format=binary or
+# "Accept: application/vnd.warp.series".
+#
+# Layout (little endian):
+#
+#   offset  size  field
+#   0       1     magic 'W' (0x57)
+#   1       1     version (1)
+#   2       1     kind: 1 day-ahead prices (centicent/MWh), 2 temperatures
+#                 (1/10 degree Celsius), 3 solar forecast (Wh)
+#   3       1     resolution in minutes
+#   4       4     first_date, unix timestamp (u32)
+#   8       4     next_date, unix timestamp (u32, 0 if the series has none)
+#   12      2     number of values (u16)
+#   14      ...   values: the difference to the previous value (to 0 for the
+#                 first one), zigzag encoded, as LEB128 varint
+#
+# Neighbouring values are close, so most take one or two bytes.
+
+import functools
+import struct
+from urllib.parse import parse_qsl
+
+from flask import request
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+MEDIA_TYPE = 'application/vnd.warp.series'
+
+MAGIC = b'W'
+VERSION = 1
+
+KIND_PRICES = 1
+KIND_TEMPERATURES = 2
+KIND_SOLAR_FORECAST = 3
+
+_HEADER = struct.Struct('<cBBBIIH')
+
+
+def encode_series(kind, first_date, resolution, values, next_date=0):
+    """Encode values (ints) as described above. resolution is in minutes."""
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, kind, resolution, first_date, next_date or 0, len(values)))
+    last = 0
+    for v in values:
+        delta = v - last
+        last = v
+        z = (delta << 1) ^ (delta >> 63)  # zigzag
+        while z >= 0x80:
+            out.append((z & 0x7f) | 0x80)
+            z >>= 7
+        out.append(z)
+    return bytes(out)
+
+
+def decode_series(data):
+    """Inverse of encode_series, returns a dict of the header fields and values."""
+    magic, version, kind, resolution, first_date, next_date, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version {0} series".format(VERSION))
+    values = []
+    pos = _HEADER.size
+    last = 0
+    for _ in range(count):
+        z = 0
+        shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            z |= (b & 0x7f) << shift
+            shift += 7
+            if b < 0x80:
+                break
+        last += (z >> 1) ^ -(z & 1)
+        values.append(last)
+    return {'kind': kind, 'resolution': resolution, 'first_date': first_date,
+            'next_date': next_date, 'values': values}
+
+
+@functools.lru_cache(maxsize=256)
+def _accepts_binary(header):
+    accept = parse_accept_header(header, MIMEAccept)
+    return accept[MEDIA_TYPE] > accept['application/json']
+
+
+def requested(environ=None):
+    """True if the client asked for the binary format (the Flask request's
+    unless the WSGI environ is given)."""
+    environ = request.environ if environ is None else environ
+    query = environ.get('QUERY_STRING')
+    if query:
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            if name == 'format':
+                if value == 'binary':
+                    return True
+                break
+    return _accepts_binary(environ.get('HTTP_ACCEPT'))
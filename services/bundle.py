@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# Everything a charger with PV and heating control polls, in one request.
+#
+#   GET /v1/bundle/<country>/<resolution>[?lat=<lat>&lon=<lon>[&plane=<dec>,<az>,<wp>...]]
+#
+# Returns the day-ahead prices of the zone and, if the coordinates are given,
+# the temperature forecast and the solar forecast of every plane (at most
+# MAX_PLANES). Each part is what its own endpoint returns, plus "updated"
+# (when the data was fetched from upstream) and its next_date (when it will
+# be refreshed, with the client's poll jitter). next_date of the bundle is the
+# earliest of them. A part that can't be served is {"error": ...} and the rest
+# of the bundle is sent anyway.
+#
+# Prices come from the served records, forecasts from the service caches.
+# The upstream calls of a bundle (forecasts missing in the caches) are made in
+# parallel.
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from flask import Blueprint, request
+
+from . import day_ahead_prices, temperatures, solar_forecast, http_cache, poll_jitter
+
+bundle_api = Blueprint('bundle_api', __name__)
+
+logger = logging.getLogger(__name__)
+
+MAX_PLANES = 4
+
+# A bundle with a failed part is retried after this many seconds.
+ERROR_RETRY_SECONDS = 5 * 60
+
+# Upstream calls of the bundles: the temperatures and every plane, for as
+# many bundles as the worker serves at once (--threads in start.sh), so one
+# bundle never waits for the upstream calls of another.
+_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('THREADS', 16)) * (1 + MAX_PLANES),
+                           thread_name_prefix='bundle')
+
+
+class ParamError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _coordinates():
+    """Return (lat, lon) from the query or None if they are not given."""
+    lat, lon = request.args.get('lat'), request.args.get('lon')
+    if lat is None and lon is None:
+        return None
+    if lat is None or lon is None:
+        raise ParamError("lat and lon are both required")
+    try:
+        lat, lon = float(lat), float(lon)
+    except ValueError:
+        raise ParamError("lat and lon must be numbers")
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        raise ParamError("lat or lon out of range")
+    return lat, lon
+
+
+def _planes(coordinates):
+    """Return the planes from the query as (dec, az, wp) tuples."""
+    args = request.args.getlist('plane')
+    if not args:
+        return []
+    if coordinates is None:
+        raise ParamError("plane requires lat and lon")
+    if len(args) > MAX_PLANES:
+        raise ParamError("At most {0} planes".format(MAX_PLANES))
+    planes = []
+    for arg in args:
+        values = arg.split(',')
+        if len(values) != 3:
+            raise ParamError("plane must be <dec>,<az>,<wp>")
+        try:
+            _, _, dec, az = solar_forecast._parse_common(*coordinates, values[0], values[1])
+            wp = solar_forecast._parse_power(values[2], 1)  # Wp
+        except solar_forecast.ParamError as e:
+            raise ParamError(e.message)
+        planes.append((dec, az, wp))
+    return planes
+
+
+def _prices_part(name, record, bucket):
+    record = day_ahead_prices.for_client(record, bucket)
+    h = day_ahead_prices._health.get(name, {})
+    od = OrderedDict()
+    od['first_date'] = record.first_date
+    od['prices']     = record.prices
+    od['next_date']  = record.next_date
+    od['updated']    = h.get('last_success')
+    return od
+
+
+def _temperatures_part(lat, lon, bucket):
+    try:
+        entry = temperatures.get_cached_temperatures(lat, lon)
+    except HTTPError as e:
+        logger.error(f"Open-Meteo HTTP error: {e.code} - {e.reason}")
+        return {"error": "Invalid coordinates" if e.code == 400 else "Weather service unavailable"}
+    except Exception:
+        logger.error("Exception during bundle temperatures", exc_info=True)
+        return {"error": "Weather service unavailable"}
+    od = OrderedDict()
+    od['first_date']   = entry['first_date']
+    od['temperatures'] = entry['temperatures']
+    od['next_date']    = int(entry['fetched'] + temperatures.CACHE_TTL_SECONDS + poll_jitter.offset(bucket))
+    od['updated']      = int(entry['fetched'])
+    return od
+
+
+def _solar_part(lat, lon, dec, az, wp):
+    try:
+        entry = solar_forecast.get_cached_irradiance(lat, lon, dec, az)
+    except Exception:
+        logger.error("Exception during bundle solar forecast", exc_info=True)
+        return {"error": "Forecast service unavailable"}
+    key = solar_forecast._cache_key(lat, lon, dec, az)
+    od = OrderedDict()
+    od['dec']        = dec
+    od['az']         = az
+    od['wp']         = wp
+    od['first_date'] = entry['first_date']
+    od['resolution'] = 60  # minutes
+    od['forecast']   = solar_forecast.compute_forecast(entry, wp)
+    # Same as the poll time /estimate gives, see solar_forecast.ratelimit_period()
+    od['next_date']  = int(entry['fetched'] + solar_forecast.CACHE_TTL_SECONDS
+                           + poll_jitter.offset(poll_jitter.bucket_of(key)))
+    od['updated']    = int(entry['fetched'])
+    return od
+
+
+def _run(calls):
+    """Return the results of the (fn, args) calls, made in parallel if there are several."""
+    if len(calls) <= 1:
+        return [fn(*args) for fn, args in calls]
+    futures = [_pool.submit(fn, *args) for fn, args in calls]
+    return [f.result() for f in futures]
+
+
+@bundle_api.route('/v1/bundle/<country>/<resolution>', methods=['GET'])
+def bundle(country, resolution):
+    def inner(country, resolution):
+        record = day_ahead_prices._lookup(country, resolution)
+        found = isinstance(record, day_ahead_prices.PriceRecord)
+        if not found and record != day_ahead_prices.DAY_AHEAD_PRICE_NOT_FOUND:
+            return record + ({},)  # zone or resolution not supported
+        try:
+            coordinates = _coordinates()
+            planes = _planes(coordinates)
+        except ParamError as e:
+            return json.dumps({"error": e.message}, separators=(',', ':')), e.status, {}
+
+        bucket = poll_jitter.client_bucket()
+        calls = []
+        if coordinates is not None:
+            calls.append((_temperatures_part, coordinates + (bucket,)))
+            calls += [(_solar_part, coordinates + plane) for plane in planes]
+        try:
+            results = _run(calls)
+        except Exception:
+            logger.error("Exception during bundle", exc_info=True)
+            return '{"error":"Internal server error"}', 500, {}
+
+        od = OrderedDict()
+        od['next_date'] = None
+        if found:
+            name = day_ahead_prices._routes[(country.lower(), resolution.lower())]
+            od['prices'] = _prices_part(name, record, bucket)
+        else:
+            od['prices'] = {"error": "Data not found"}
+        if coordinates is not None:
+            od['temperatures'] = results[0]
+        if planes:
+            od['solar_forecast'] = results[1:]
+
+        parts = [od['prices']] + results
+        next_dates = [p['next_date'] for p in parts if 'error' not in p]
+        if len(next_dates) < len(parts):
+            next_dates.append(int(time.time()) + ERROR_RETRY_SECONDS)
+        od['next_date'] = min(next_dates)
+
+        body = json.dumps(od, separators=(',', ':'))
+        encoding, headers, not_modified = http_cache.negotiate(http_cache.make_etag(body), od['next_date'],
+                                                               per_client=True)
+        if not_modified:
+            return '', 304, headers
+        if encoding is None:
+            return body, 200, headers
+        # Compressed per request, so not at the levels of the cached bodies
+        headers['Content-Encoding'] = encoding
+        return http_cache.compress(body, (encoding,), http_cache.FAST_LEVELS)[encoding], 200, headers
+
+    resp, status, headers = inner(country, resolution)
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Charging schedule optimizer.
+#
+#   GET /v1/charge_plan/<country>/<resolution>?energy=<Wh>&deadline=<ts>&power=<W>
+#       [&lat=<lat>&lon=<lon>&dec=<dec>&az=<az>&wp=<Wp>]
+#
+# Plans when to charge `energy` Wh before `deadline` with at most `power` W so
+# that the grid energy is as cheap as possible. The served day-ahead prices
+# of the zone give the cost per slot; if the PV parameters are given, the
+# (cached) solar forecast of the installation is used as free energy first.
+#
+# Every slot offers two tranches: the PV energy expected in it at cost 0 and
+# the remaining charger capacity at the slot's price. Charging is a fractional
+# knapsack over these tranches, so taking the cheapest ones until the energy
+# is reached is optimal. This is a sort and a cumulative sum over at most a
+# few hundred slots and is done with NumPy.
+#
+# The PV forecast is the whole production of the installation; house
+# consumption is not known here and is not subtracted.
+
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from flask import Blueprint, request
+
+from . import day_ahead_prices, solar_forecast
+
+charge_plan_api = Blueprint('charge_plan_api', __name__)
+
+logger = logging.getLogger(__name__)
+
+MAX_ENERGY_WH = 1_000_000  # 1 MWh
+MAX_POWER_W = 1_000_000    # 1 MW
+
+PV_PARAMS = ('lat', 'lon', 'dec', 'az', 'wp')
+
+
+def solve(prices, capacity, pv, energy):
+    """Distribute energy (Wh) over slots at minimal grid cost.
+
+    prices:   price per slot (any unit, per energy)
+    capacity: energy the charger can take per slot (Wh)
+    pv:       PV energy expected per slot (Wh), used before grid energy
+              unless the price of the slot is negative
+
+    Returns (charged, grid): Wh charged per slot and the part of it taken
+    from the grid. If the slots can't take all of energy, they are all full.
+    """
+    import numpy as np  # only needed when a plan is requested
+
+    prices = np.asarray(prices, dtype=np.float64)
+    capacity = np.asarray(capacity, dtype=np.float64)
+    pv = np.minimum(np.asarray(pv, dtype=np.float64), capacity)
+    n = len(prices)
+
+    # Tranche i < n is the PV energy of slot i, tranche n + i its grid energy.
+    # PV is free, but at a negative price grid energy pays: there the grid
+    # tranche is the whole capacity of the slot and PV is not used.
+    pv = np.where(prices < 0, 0, pv)
+    cost = np.concatenate((np.zeros(n), prices))
+    amount = np.concatenate((pv, capacity - pv))
+    # stable: of two equally cheap tranches the earlier slot is used first
+    order = np.argsort(cost, kind='stable')
+    sorted_amount = amount[order]
+    before = np.cumsum(sorted_amount) - sorted_amount
+    taken = np.empty_like(amount)
+    taken[order] = np.clip(energy - before, 0, sorted_amount)
+    return taken[:n] + taken[n:], taken[n:]
+
+
+def _slots(record, resolution, now, deadline):
+    """Return (first slot index, seconds available per slot) for [now, deadline)."""
+    import numpy as np
+
+    first = max(0, (now - record.first_date) // resolution)
+    last = min(len(record.prices), -(-(deadline - record.first_date) // resolution))
+    if last <= first:
+        return first, np.zeros(0)
+    starts = record.first_date + np.arange(first, last, dtype=np.int64) * resolution
+    available = np.clip(np.minimum(starts + resolution, deadline) - np.maximum(starts, now), 0, resolution)
+    return first, available
+
+
+def _pv_per_slot(entry, forecast, starts, resolution):
+    """Spread the hourly PV forecast (Wh) evenly over the price slots."""
+    import numpy as np
+
+    forecast = np.asarray(forecast, dtype=np.float64)
+    hours = (starts - entry['first_date']) // 3600
+    valid = (hours >= 0) & (hours < len(forecast))
+    pv = np.zeros(len(starts))
+    pv[valid] = forecast[hours[valid]] * resolution / 3600
+    return pv
+
+
+class ParamError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _number(name, maximum):
+    try:
+        value = float(request.args[name])
+    except KeyError:
+        raise ParamError("{0} is required".format(name))
+    except ValueError:
+        raise ParamError("{0} must be a number".format(name))
+    if not (0 < value <= maximum):
+        raise ParamError("{0} out of range".format(name))
+    return value
+
+
+def plan(record, resolution, now, energy, deadline, power, pv_forecast=None):
+    """Build the plan as OrderedDict (see module comment)."""
+    import numpy as np
+
+    first, available = _slots(record, resolution, now, deadline)
+    starts = record.first_date + (first + np.arange(len(available), dtype=np.int64)) * resolution
+    capacity = power * available / 3600  # Wh
+    if pv_forecast is not None:
+        pv = _pv_per_slot(pv_forecast[0], pv_forecast[1], starts, resolution) * available / resolution
+    else:
+        pv = np.zeros(len(available))
+    prices = np.asarray(record.prices[first:first + len(available)], dtype=np.float64)
+
+    charged, grid = solve(prices, capacity, pv, energy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        setpoints = np.where(available > 0, charged * 3600 / available, 0)
+
+    od = OrderedDict()
+    od['first_date'] = int(starts[0]) if len(starts) else record.first_date + first * resolution
+    od['resolution'] = resolution // 60  # minutes
+    od['power']      = np.rint(setpoints).astype(np.int64).tolist()  # W per slot
+    od['energy']     = int(round(charged.sum()))  # Wh that can be delivered
+    od['pv_energy']  = int(round((charged - grid).sum()))
+    # prices are ct/MWh, so ct/MWh * Wh / 1e4 is 1/100 ct
+    od['cost']       = int(round(float((prices * grid).sum()) / 1e4))
+    od['next_date']  = record.next_date
+    return od
+
+
+@charge_plan_api.route('/v1/charge_plan/<country>/<resolution>', methods=['GET'])
+def charge_plan(country, resolution):
+    def inner(country, resolution):
+        record = day_ahead_prices._lookup(country, resolution)
+        if not isinstance(record, day_ahead_prices.PriceRecord):
+            return record
+
+        now = int(time.time())
+        try:
+            energy = _number('energy', MAX_ENERGY_WH)
+            power = _number('power', MAX_POWER_W)
+            try:
+                deadline = int(request.args['deadline'])
+            except (KeyError, ValueError):
+                raise ParamError("deadline must be a unix timestamp")
+            if deadline <= now:
+                raise ParamError("deadline must be in the future")
+
+            pv_args = [request.args.get(p) for p in PV_PARAMS]
+            if any(a is not None for a in pv_args) and not all(a is not None for a in pv_args):
+                raise ParamError("PV parameters require lat, lon, dec, az and wp")
+            if pv_args[0] is not None:
+                try:
+                    lat, lon, dec, az = solar_forecast._parse_common(*pv_args[:4])
+                    wp = solar_forecast._parse_power(pv_args[4], 1)
+                except solar_forecast.ParamError as e:
+                    raise ParamError(e.message)
+        except ParamError as e:
+            return json.dumps({"error": e.message}, separators=(',', ':')), e.status
+
+        pv_forecast = None
+        if pv_args[0] is not None:
+            try:
+                entry = solar_forecast.get_cached_irradiance(lat, lon, dec, az)
+                pv_forecast = (entry, solar_forecast.compute_forecast(entry, wp))
+            except Exception:
+                logger.error("Solar forecast failed during charge plan", exc_info=True)
+                return '{"error":"Forecast service unavailable"}', 503
+
+        res = day_ahead_prices.RESOLUTION_SECONDS[day_ahead_prices.DAP_RESOLUTIONS[resolution.lower()]]
+        try:
+            od = plan(record, res, now, energy, deadline, power, pv_forecast)
+        except Exception:
+            logger.error("Exception during charge plan", exc_info=True)
+            return '{"error":"Internal server error"}', 500
+        return json.dumps(od, separators=(',', ':')), 200
+    resp, status = inner(country, resolution)
+    return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
@@ -1,239 +1,731 @@
 # -*- coding: utf-8 -*-
 
+import fcntl
 import logging
 import os
+import threading
 from urllib.request import urlopen
-from xml.etree import ElementTree
-import pandas as pd
-from flask import Blueprint
+from xml.etree.ElementTree import iterparse
+from array import array
+from io import BytesIO
+from flask import Blueprint, request
 from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import time
 import json
-from collections import OrderedDict
-import re
-try:
-    from .fallback import fallback_get_prices_de_lu
-except:
-    fallback_get_prices_de_lu = None
+from collections import OrderedDict, namedtuple
+from . import price_archive, http_cache, binary_format, poll_jitter
+from .health import Health
+
+# Only what request serving needs is imported here. The optional Tibber
+# fallback (and whatever it depends on) is imported by the updater on first
+# use, see _fallback().
+_NOT_LOADED = object()
+fallback_get_prices_de_lu = _NOT_LOADED
 
 day_ahead_prices_api = Blueprint('day_ahead_prices_api', __name__)
 
 FILE_DIR = os.path.dirname(os.path.realpath(__file__))
 PROJET_DIR = os.path.abspath(os.path.join(FILE_DIR, '..'))
 WARP_DB_FILE = os.path.join(PROJET_DIR, "warp.db")
-ENTSOE_KEY = open(os.path.join(PROJET_DIR, "entsoe.key")).read().strip()
+# Last good price data per zone, written after every successful update and
+# loaded synchronously at startup so that requests can be answered before the
+# first (potentially slow) ENTSO-E update has finished.
+SNAPSHOT_FILE = os.path.join(PROJET_DIR, "day_ahead_prices.json")
+UPDATER_LOCK_FILE = os.path.join(PROJET_DIR, "updater.lock")
+ENTSOE_KEY_FILE = os.path.join(PROJET_DIR, "entsoe.key")
+ENTSOE_KEY = None # read on first use, see _entsoe_key()
+ENTSOE_API_URL = 'https://web-api.tp.entsoe.eu/api'
+ENTSOE_TIMEOUT = 60 # seconds
+
+BERLIN = ZoneInfo('Europe/Berlin')
 
 logger = logging.getLogger(__name__)
 
-DAY_AHEAD_PRICE_NOT_FOUND   = '{"error":"Data not found"}', 404
-DAY_AHEAD_PRICE_DE_LU_15MIN = 0
-DAY_AHEAD_PRICE_DE_LU_60MIN = 1
-DAY_AHEAD_PRICE_AT_15MIN    = 2
-DAY_AHEAD_PRICE_AT_60MIN    = 3
-
-DAP_NAMES = {
-    DAY_AHEAD_PRICE_DE_LU_15MIN: "de_lu_15min",
-    DAY_AHEAD_PRICE_DE_LU_60MIN: "de_lu_60min",
-    DAY_AHEAD_PRICE_AT_15MIN:    "at_15min",
-    DAY_AHEAD_PRICE_AT_60MIN:    "at_60min",
+DAY_AHEAD_PRICE_NOT_FOUND = '{"error":"Data not found"}', 404
+
+# Zones are fetched in parallel, but never more than this many at once to
+# stay well within the ENTSO-E rate limit (400 requests/min per key).
+UPDATE_CONCURRENCY = 8
+
+# Successful fetch times kept per source and zone, and how many are needed
+# before ENTSO-E being slower than its p95 starts the fallback in parallel.
+LATENCY_SAMPLES = 50
+HEDGE_MIN_SAMPLES = 10
+# Tomorrow's prices are published around 13:00. From this hour on a series
+# without them is incomplete and the fallback is always raced against ENTSO-E.
+TOMORROW_EXPECTED_HOUR = 15
+
+DAP_RESOLUTIONS = {
+    '15min': 'PT15M',
+    '30min': 'PT30M',
+    '60min': 'PT60M',
 }
+RESOLUTION_NAMES = {v: k for k, v in DAP_RESOLUTIONS.items()}
+
+# Longest range a single history request may span.
+MAX_HISTORY_SECONDS = 366*24*60*60
+
+# Bidding zone registry.
+#
+# name:       used in served record names ("<name>_<resolution>") and /v1/status
+# eic:        ENTSO-E area code
+# countries:  URL path segments routed to this zone
+# resolution: resolution fetched from ENTSO-E
+# derived:    coarser resolutions computed from the fetched one
+# fallback:   the Tibber fallback may be used for this zone
+Zone = namedtuple('Zone', ['name', 'eic', 'countries', 'resolution', 'derived', 'fallback'],
+                  defaults=('PT15M', ('PT30M', 'PT60M'), False))
+
+ZONES = (
+    Zone('de_lu',    '10Y1001A1001A82H', ('de', 'lu'), fallback=True),
+    Zone('at',       '10YAT-APG------L', ('at',)),
+    Zone('be',       '10YBE----------2', ('be',)),
+    Zone('nl',       '10YNL----------L', ('nl',)),
+    # CH is not part of the SDAC market coupling and still trades hourly.
+    Zone('ch',       '10YCH-SWISSGRIDZ', ('ch',), 'PT60M', ()),
+    Zone('dk1',      '10YDK-1--------W', ('dk1',)),
+    Zone('dk2',      '10YDK-2--------M', ('dk2',)),
+    Zone('fi',       '10YFI-1--------U', ('fi',)),
+    Zone('no1',      '10YNO-1--------2', ('no1',)),
+    Zone('no2',      '10YNO-2--------T', ('no2',)),
+    Zone('no3',      '10YNO-3--------J', ('no3',)),
+    Zone('no4',      '10YNO-4--------9', ('no4',)),
+    Zone('no5',      '10Y1001A1001A48H', ('no5',)),
+    Zone('se1',      '10Y1001A1001A44P', ('se1',)),
+    Zone('se2',      '10Y1001A1001A45N', ('se2',)),
+    Zone('se3',      '10Y1001A1001A46L', ('se3',)),
+    Zone('se4',      '10Y1001A1001A47J', ('se4',)),
+    Zone('it_north', '10Y1001A1001A73I', ('it-north',)),
+    Zone('it_cnor',  '10Y1001A1001A70O', ('it-cnor',)),
+    Zone('it_csud',  '10Y1001A1001A71M', ('it-csud',)),
+    Zone('it_sud',   '10Y1001A1001A788', ('it-sud',)),
+    Zone('it_cala',  '10Y1001C--00096J', ('it-cala',)),
+    Zone('it_sici',  '10Y1001A1001A75E', ('it-sici',)),
+    Zone('it_sard',  '10Y1001A1001A74G', ('it-sard',)),
+)
+
+# A served price record. Records are built once per update and never
+# modified, the updater replaces them as a whole.
+# etag is the entity tag of body, encoded its compressed variants (see
+# http_cache), binary the same in the binary format (see binary_format).
+# jittered holds the variants with a later next_date, see for_client().
+PriceRecord = namedtuple('PriceRecord', ['first_date', 'prices', 'next_date', 'body', 'cheapest', 'etag', 'encoded', 'binary', 'jittered'])
+
+def _encode(first_date, prices, next_date, res):
+    # Generate odered json without spaces
+    od = OrderedDict()
+    od['first_date'] = first_date
+    od['prices']     = list(prices)
+    od['next_date']  = next_date
+    body = json.dumps(od, separators=(',', ':'))
+    return body, http_cache.compress(body), \
+           binary_format.encode_series(binary_format.KIND_PRICES, first_date, res // 60, prices, next_date)
+
+def _jittered(record, bucket, delay):
+    next_date = record.next_date + delay
+    body, encoded, binary = _encode(record.first_date, record.prices, next_date, record.cheapest.resolution)
+    # The record's tag with a suffix, so delta requests can find the record
+    return record._replace(next_date=next_date, body=body, etag='{0}-j{1}'.format(record.etag, bucket),
+                           encoded=encoded, binary=binary, jittered={})
+
+def make_record(first_date, prices, next_date, resolution='PT15M'):
+    """Build the PriceRecord of a price series with the variants of every
+    poll jitter bucket, so no request has to encode or compress anything."""
+    res = RESOLUTION_SECONDS[resolution]
+    body, encoded, binary = _encode(first_date, prices, next_date, res)
+    record = PriceRecord(first_date, tuple(prices), next_date, body,
+                         build_cheapest_index(prices, res),
+                         http_cache.make_etag(body), encoded, binary, {})
+    jittered = {}
+    for bucket in range(poll_jitter.JITTER_BUCKETS):
+        delay = poll_jitter.offset(bucket)
+        if delay != 0:
+            jittered[bucket] = _jittered(record, bucket, delay)
+    return record._replace(jittered=jittered)
+
+def for_client(record, bucket):
+    """Return record as served to clients of the poll jitter bucket.
+
+    The variant only differs in next_date, which is delayed by the bucket's
+    offset (see poll_jitter).
+    """
+    return record.jittered.get(bucket, record)
+
+# Window lengths (hours) and percentiles served by the cheapest endpoint.
+CHEAPEST_HOURS = range(1, 13)
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# best[hours][i] is the first slot of the cheapest window of that length
+# that starts at slot i or later, so the cheapest window from now on is a
+# single lookup. sums are prefix sums of the prices.
+CheapestIndex = namedtuple('CheapestIndex', ['resolution', 'sums', 'best', 'percentiles'])
+
+def build_cheapest_index(prices, resolution):
+    """Build the CheapestIndex of a price series (resolution in seconds)."""
+    sums = array('q', [0])
+    for p in prices:
+        sums.append(sums[-1] + p)
+    best = {}
+    for hours in CHEAPEST_HOURS:
+        width = hours*3600 // resolution
+        starts = len(prices) - width + 1
+        if width == 0 or starts <= 0:
+            continue
+        b = starts - 1
+        idx = array('l', [0]) * starts
+        for i in range(starts - 1, -1, -1):
+            # <= prefers the earlier of two equally cheap windows
+            if sums[i + width] - sums[i] <= sums[b + width] - sums[b]:
+                b = i
+            idx[i] = b
+        best[hours] = idx
+    ordered = sorted(prices)
+    # nearest-rank percentiles
+    percentiles = tuple(ordered[max(0, -(-len(ordered)*q // 100) - 1)] for q in PERCENTILES) if ordered else ()
+    return CheapestIndex(resolution, sums, best, percentiles)
+
+def record_name(zone, resolution):
+    return "{0}_{1}".format(zone.name, RESOLUTION_NAMES[resolution])
 
-# Per-source health/diagnostics, populated during update().
+# Record name -> PriceRecord of everything currently served. Only ever
+# replaced as a whole (see update()), so readers never need a lock.
+dap_records = {}
+
+# Record name -> the last DELTA_HISTORY records served, newest first, to
+# answer delta requests that name the ETag the client holds. Replaced like
+# dap_records.
+DELTA_HISTORY = 4
+dap_history = {}
+
+# Serializes the writers of dap_records and dap_history (the updater, the
+# snapshot loader), readers don't take it.
+_publish_lock = threading.Lock()
+
+# Called with the {name: record} entries of every _publish(), e.g. by the
+# price stream. Must not block.
+publish_listeners = []
+
+# Built from ZONES by load_registry():
+_routes = {}   # (country, '15min') -> record name
+_zones_by_country = {}
+
+def load_registry(zones):
+    global ZONES, _routes, _zones_by_country
+    routes, by_country = {}, {}
+    for zone in zones:
+        for country in zone.countries:
+            by_country[country] = zone
+            for resolution in (zone.resolution,) + tuple(zone.derived):
+                routes[(country, RESOLUTION_NAMES[resolution])] = record_name(zone, resolution)
+    ZONES, _routes, _zones_by_country = tuple(zones), routes, by_country
+
+load_registry(ZONES)
+
+def daps():
+    """Yield (record name, zone, resolution) of every served record."""
+    for zone in ZONES:
+        for resolution in (zone.resolution,) + tuple(zone.derived):
+            yield record_name(zone, resolution), zone, resolution
+
+# Per-source health/diagnostics (see health.Health), populated during update().
 _health = {}
+_health_lock = threading.Lock()
 
 def _health_for(dap):
     h = _health.get(dap)
     if h is None:
-        h = {
-            "last_attempt": None,        # unix ts of last update attempt
-            "last_success": None,        # unix ts data was last refreshed
-            "source_used": None,         # 'entsoe' | 'fallback' | None
-            "entsoe_entries": None,      # entries ENTSO-E returned last attempt
-            "fallback_attempted": False, # was the Tibber fallback tried last attempt
-            "fallback_entries": None,    # entries the fallback returned (or None)
-            "num_prices": None,          # entries currently served
-            "first_date": None,          # unix ts of currently served data
-            "next_date": None,           # unix ts of expected next refresh
-            "last_error": None,          # last error message
-            "last_error_at": None,       # unix ts of last error
-            "consecutive_failures": 0,
-        }
-        _health[dap] = h
+        with _health_lock:
+            h = _health.get(dap)
+            if h is None:
+                h = _health[dap] = Health(**_new_health())
     return h
 
-
-def daps():
-    yield DAY_AHEAD_PRICE_DE_LU_15MIN, '10Y1001A1001A82H', 'PT15M' # DE_LU
-#    yield DAY_AHEAD_PRICE_DE_LU_60MIN, '10Y1001A1001A82H', 'PT60M' # DE_LU
-    yield DAY_AHEAD_PRICE_AT_15MIN,    '10YAT-APG------L', 'PT15M' # AT
-#    yield DAY_AHEAD_PRICE_AT_60MIN,    '10YAT-APG------L', 'PT60M' # AT
-
-dap_list = [DAY_AHEAD_PRICE_NOT_FOUND]*4
-
-def parse_timeseries(xml_text, resolution, value_key='price.amount'):
-    resolution_map = {
-        'PT60M': pd.Timedelta(60, 'min'),
-        'P1Y'  : pd.Timedelta(365,'day'),
-        'PT15M': pd.Timedelta(15, 'min'),
-        'PT30M': pd.Timedelta(30, 'min'),
-        'P1D'  : pd.Timedelta(1,  'day'),
-        'P7D'  : pd.Timedelta(7,  'day'),
-        'P1M'  : pd.Timedelta(30, 'day'),
+def _new_health():
+    return {
+        "last_attempt": None,        # unix ts of last update attempt
+        "last_success": None,        # unix ts data was last refreshed
+        "source_used": None,         # 'entsoe' | 'fallback' | 'derived' | 'snapshot' | None
+        "entsoe_entries": None,      # entries ENTSO-E returned last attempt
+        "fallback_attempted": False, # was the Tibber fallback tried last attempt
+        "fallback_entries": None,    # entries the fallback returned (or None)
+        "num_prices": None,          # entries currently served
+        "first_date": None,          # unix ts of currently served data
+        "next_date": None,           # unix ts of expected next refresh
+        "last_error": None,          # last error message
+        "last_error_at": None,       # unix ts of last error
+        "consecutive_failures": 0,
+        "fetch_mode": None,          # 'full' | 'incremental' of last attempt
+        "bytes_downloaded": None,    # bytes fetched from ENTSO-E last attempt (not a losing hedged download)
+        "bytes_downloaded_total": 0, # bytes fetched from ENTSO-E since start (all of them)
+        "overlap_mismatches": 0,     # incremental fetches that changed known prices
+        "hedged": False,             # did ENTSO-E and the fallback race last attempt
+        "entsoe_latency_ms": None,   # duration of the last successful ENTSO-E fetch
+        "entsoe_latency_p95_ms": None,
+        "fallback_latency_ms": None,
+        "fallback_latency_p95_ms": None,
+        "entsoe_wins": 0,            # races won by ENTSO-E since start
+        "fallback_wins": 0,          # races won by the fallback since start
+        "entsoe_latencies": (),      # recent successful fetch times (s)
+        "fallback_latencies": (),
     }
-    pdres       = resolution_map[resolution]
-    time_stamps = []
-    values      = []
-    xml_text    = re.sub(' xmlns="[^"]+"', '', xml_text, count=1) #Remove namespace
-    root        = ElementTree.fromstring(xml_text)
-    for time_serie in root.findall('TimeSeries'):
-        #curve_type = time_serie.find('curveType').text
-        for period in time_serie.findall('Period'):
-            start_time = pd.Timestamp(period.find('timeInterval').find('start').text)
-            if period.find('resolution').text == resolution:
-                for point in period.findall('Point'):
-                    position = int(point.find('position').text)-1
-                    value    = float(point.find(value_key).text)
-                    time_stamps.append(start_time+position*pdres)
-                    values.append(value)
-
-    # Fill ts with missing values
-    ts = pd.Series(data=values,index=time_stamps)
-    if len(ts) == 0:
-        return ts
-
-    # Deduplicate labels. We could also use ts.groupby(ts.index).mean()
-    # Currently the data just seems to be duplicated with same prices for AT... no idea what is going on.
-    ts = ts[~ts.index.duplicated(keep='first')]
-    return ts.resample(pdres).ffill()
-
-def get_dayahead_prices(api_key: str, area_code: str, start: datetime, end: datetime, resolution: str):
+
+
+def _entsoe_key():
+    # A missing key only makes the updates fail (visible in /v1/status), the
+    # server can still start and serve the snapshot.
+    global ENTSOE_KEY
+    if ENTSOE_KEY is None:
+        with open(ENTSOE_KEY_FILE) as f:
+            ENTSOE_KEY = f.read().strip()
+    return ENTSOE_KEY
+
+def _fallback():
+    global fallback_get_prices_de_lu
+    if fallback_get_prices_de_lu is _NOT_LOADED:
+        try:
+            from .fallback import fallback_get_prices_de_lu as f
+        except:
+            f = None
+        fallback_get_prices_de_lu = f
+    return fallback_get_prices_de_lu
+
+RESOLUTION_SECONDS = {
+    'PT15M': 15*60,
+    'PT30M': 30*60,
+    'PT60M': 60*60,
+    'P1D'  : 24*60*60,
+    'P7D'  : 7*24*60*60,
+    'P1M'  : 30*24*60*60,
+    'P1Y'  : 365*24*60*60,
+}
+
+# Marks slots of the output array that no point has been written to (yet).
+_MISSING = -2**63
+
+def _parse_utc(text):
+    # ENTSO-E always uses "YYYY-MM-DDTHH:MMZ"
+    return int(datetime.fromisoformat(text.strip().replace('Z', '+00:00')).timestamp())
+
+def parse_timeseries(xml, resolution, value_key='price.amount', scale=100):
+    """Parse an ENTSO-E publication document into a gapless integer series.
+
+    The document is read incrementally with iterparse, without building a DOM,
+    and every point is written straight into a preallocated array of
+    value*scale integers (centicent for prices). Only periods with the
+    requested resolution are used.
+
+    * Duplicated points (e.g. the same TimeSeries published twice for AT) keep
+      the first value.
+    * Gaps are filled with the previous value.
+    * Curve type A03 omits points that repeat the previous value, this also
+      applies to the end of a period, so A03 periods are filled up to the end
+      of their time interval.
+
+    Returns (first_ts, values) with first_ts the unix timestamp of values[0],
+    or (None, empty array) if the document contains no matching points.
+    """
+    res = RESOLUTION_SECONDS[resolution]
+    if isinstance(xml, str):
+        xml = xml.encode()
+
+    values    = array('q')
+    base      = None  # unix ts of values[0]
+    first     = None  # first and one past the last slot holding data
+    end       = None
+    pending   = []    # points seen before their period's start/resolution
+    curve     = 'A01'
+    start_ts  = end_ts = None
+    per_start = per_end = per_res = None
+    position  = value = None
+
+    def put(slot, v):
+        nonlocal values, base, first, end
+        if slot < 0:
+            values = array('q', [_MISSING]) * -slot + values
+            base += slot * res
+            if first is not None:
+                first -= slot
+                end   -= slot
+            slot = 0
+        elif slot >= len(values):
+            values.extend(array('q', [_MISSING]) * (slot + 1 - len(values)))
+        if values[slot] == _MISSING:
+            values[slot] = v
+        first = slot if first is None else min(first, slot)
+        end   = slot + 1 if end is None else max(end, slot + 1)
+
+    def slot_of(ts):
+        nonlocal base
+        if base is None:
+            base = ts
+        return (ts - base) // res
+
+    for _, elem in iterparse(BytesIO(xml), events=('end',)):
+        tag = elem.tag.rpartition('}')[2]  # ignore the namespace
+        if tag == 'Point':
+            if per_start is None or per_res is None:
+                pending.append((position, value))
+            elif per_res == resolution:
+                put(slot_of(per_start) + position - 1, value)
+            elem.clear()
+        elif tag == 'position':
+            position = int(elem.text)
+        elif tag == value_key:
+            value = int(float(elem.text) * scale)
+        elif tag == 'start':
+            start_ts = _parse_utc(elem.text)
+        elif tag == 'end':
+            end_ts = _parse_utc(elem.text)
+        elif tag == 'timeInterval':
+            per_start, per_end = start_ts, end_ts
+        elif tag == 'resolution':
+            per_res = elem.text.strip()
+        elif tag == 'curveType':
+            curve = elem.text.strip()
+        elif tag == 'period.timeInterval':
+            # Document interval: preallocate the whole range up front.
+            if base is None and start_ts is not None and end_ts is not None:
+                base = start_ts
+                values = array('q', [_MISSING]) * max(0, (end_ts - start_ts) // res)
+        elif tag == 'Period':
+            if per_res == resolution and per_start is not None:
+                for pos, v in pending:
+                    put(slot_of(per_start) + pos - 1, v)
+                if curve == 'A03' and end is not None and per_end is not None:
+                    end = max(end, slot_of(per_end))
+            pending   = []
+            per_start = per_end = per_res = None
+            elem.clear()
+        elif tag == 'TimeSeries':
+            curve = 'A01'
+            elem.clear()
+
+    if first is None:
+        return None, array('q')
+
+    if end > len(values):
+        values.extend(array('q', [_MISSING]) * (end - len(values)))
+    values = values[first:end]
+    last = values[0]
+    for i, v in enumerate(values):
+        if v == _MISSING:
+            values[i] = last
+        else:
+            last = v
+    return base + first * res, values
+
+
+def get_dayahead_prices(api_key: str, area_code: str, start: datetime, end: datetime, resolution: str, stats=None):
     fmt = '%Y%m%d%H00'  # Minutes must be 00, otherwise "HTTP 400 bad request" is returned.
+    # ENTSO-E expects the interval in UTC
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
     # &classificationSequence_AttributeInstanceComponent.Position=1 => sequence 1 = SDAC prices is correct (2 would be EXAA, is not correct)
-    url = f'https://web-api.tp.entsoe.eu/api?securityToken={api_key}&documentType=A44&in_Domain={area_code}' \
+    url = f'{ENTSOE_API_URL}?securityToken={api_key}&documentType=A44&in_Domain={area_code}' \
           f'&out_Domain={area_code}&periodStart={start.strftime(fmt)}&periodEnd={end.strftime(fmt)}&classificationSequence_AttributeInstanceComponent.Position=1'
 
-    with urlopen(url) as response:  # Raises URLError
+    with urlopen(url, timeout=ENTSOE_TIMEOUT) as response:  # Raises URLError
         if response.status != 200:
             raise Exception(f"{response.status=}")
-        xml_str = response.read().decode()
-        result = parse_timeseries(xml_str, resolution)
+        xml = response.read()
+    if stats is not None:
+        stats["bytes"] += len(xml)
+
+    return parse_timeseries(xml, resolution)
+
+def merge_prices(first_date, prices, new_first_date, new_prices, resolution):
+    """Append the points of a newly fetched series to a known one.
+
+    Points that are in both series must be unchanged, otherwise ValueError is
+    raised (as it is if the new series leaves a gap). Returns the merged list,
+    starting at first_date.
+    """
+    res = RESOLUTION_SECONDS[resolution]
+    if (new_first_date - first_date) % res != 0:
+        raise ValueError("Series are not aligned")
+    offset = (new_first_date - first_date) // res
+    if offset > len(prices):
+        raise ValueError("Gap of {0} points between known and new series".format(offset - len(prices)))
+    skip = max(0, -offset)  # new points before first_date are not needed
+    new_prices = new_prices[skip:]
+    offset += skip
+    overlap = min(len(prices) - offset, len(new_prices))
+    for i in range(overlap):
+        if prices[offset + i] != new_prices[i]:
+            raise ValueError("Known price at {0} changed from {1} to {2}".format(
+                first_date + (offset + i) * res, prices[offset + i], new_prices[i]))
+    return list(prices) + list(new_prices[overlap:])
+
+def _fetch_full(zone, known, start, end, stats):
+    """Fetch everything from start on.
+
+    Returns (first date, prices). A document that starts after start (a
+    leading gap) is completed with the points of the known record if it has
+    them, otherwise the prices start at its first full hour.
+    """
+    start_ts = int(start.timestamp())
+    first_ts, data = get_dayahead_prices(_entsoe_key(), zone.eic, start, end, zone.resolution, stats)
+    if first_ts is None:
+        return start_ts, []
+    if first_ts > start_ts:
+        res = RESOLUTION_SECONDS[zone.resolution]
+        if (known is not None) and (known.first_date <= start_ts) and \
+           (known.first_date + len(known.prices)*res >= first_ts):
+            head = known.prices[(start_ts - known.first_date) // res:(first_ts - known.first_date) // res]
+            return start_ts, merge_prices(start_ts, head, first_ts, data, zone.resolution)
+        logging.warning("ENTSO-E prices for {0} start {1} s after midnight".format(zone.name, first_ts - start_ts))
+        # From a full hour on, so the derived resolutions stay aligned
+        skip = (-(first_ts - start_ts) % 3600) // res
+        return first_ts + skip*res, list(data[skip:])
+    # Only keep what starts at start
+    return start_ts, merge_prices(start_ts, [], first_ts, data, zone.resolution)
+
+def _fetch_incremental(zone, known, start, end, stats):
+    """Fetch only what comes after the known record and merge it in.
+
+    Returns the prices from start on.
+    """
+    res = RESOLUTION_SECONDS[zone.resolution]
+    start_ts = int(start.timestamp())
+    prices = known.prices[(start_ts - known.first_date) // res:]
+    known_end = start_ts + len(prices) * res
+    # ENTSO-E only accepts full hours and answers with whole delivery days
+    # anyway, so the response may overlap what is already known.
+    fetch_from = datetime.fromtimestamp(known_end - known_end % 3600, timezone.utc)
+    if fetch_from >= end:
+        return list(prices)
+    first_ts, data = get_dayahead_prices(_entsoe_key(), zone.eic, fetch_from, end, zone.resolution, stats)
+    if first_ts is None:
+        return list(prices)
+    return merge_prices(start_ts, prices, first_ts, data, zone.resolution)
+
+def _fetch_entsoe(zone, known, start, end, stats, h=None):
+    """Fetch from ENTSO-E, incrementally if the known record covers start.
+
+    Returns (first date, prices, fetch mode), the first date is start unless
+    ENTSO-E has no prices for the start of the day (see _fetch_full()).
+    """
+    start_ts = int(start.timestamp())
+    if (known is not None) and (known.first_date <= start_ts < known.first_date + len(known.prices)*RESOLUTION_SECONDS[zone.resolution]):
+        try:
+            return start_ts, _fetch_incremental(zone, known, start, end, stats), "incremental"
+        except ValueError as e:
+            logging.warning("Incremental fetch for {0} failed, fetching everything: {1}".format(zone.name, e))
+            if h is not None:
+                h.update(add={"overlap_mismatches": 1})
+    return _fetch_full(zone, known, start, end, stats) + ("full",)
+
+def _is_complete(data, now):
+    # Today has at least 23 hours (DST), later tomorrow must be there too.
+    if len(data) < 23*4:
+        return False
+    return now.hour < TOMORROW_EXPECTED_HOUR or len(data) >= (24+23)*4
+
+def _p95(samples):
+    samples = sorted(samples)
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
 
+def _latency_p95(h, source):
+    """p95 of the recent successful fetch times of source, None if too few are known."""
+    return _p95(h[source + "_latencies"]) if h is not None else None
+
+def _timed(h, source, fn, *args):
+    t0 = time.monotonic()
+    result = fn(*args)
+    if h is not None:
+        latency = time.monotonic() - t0
+
+        def change(fields):
+            samples = fields[source + "_latencies"] = (fields[source + "_latencies"] + (latency,))[-LATENCY_SAMPLES:]
+            p95 = _p95(samples)
+            fields[source + "_latency_ms"] = int(latency * 1000)
+            fields[source + "_latency_p95_ms"] = None if p95 is None else int(p95 * 1000)
+        h.replace(change)
     return result
 
-def update_day_ahead_prices(country_code, resolution, dap=None):
-    logging.debug("Getting day ahead prices for country {0} with resolution {1}".format(country_code, resolution))
+def _fetch_hedged(zone, h, start, known, end, stats, fallback):
+    """Race ENTSO-E against the fallback, the first complete series wins.
+
+    The fallback is started together with ENTSO-E from
+    TOMORROW_EXPECTED_HOUR on (ENTSO-E is sometimes late), when ENTSO-E
+    takes longer than its recent p95, or when ENTSO-E answered with too
+    few prices or failed. If neither series is complete, the longer one is
+    used.
+
+    Returns (first date, prices, ENTSO-E fetch mode, source).
+    """
+    now = datetime.now(BERLIN)
+
+    def fetch_fallback(start):
+        return [int(i*100) for i in fallback(start)]
+
+    # The loser is not waited for. It finishes in the background so that its
+    # latency is still recorded. An ENTSO-E download that is still running
+    # is added to bytes_downloaded_total when it is done, not to the
+    # bytes_downloaded of this attempt.
+    entsoe_stats = {"bytes": 0}
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dap-hedge')
+    try:
+        futures = {pool.submit(_timed, h, "entsoe", _fetch_entsoe, zone, known, start, end, entsoe_stats, h): "entsoe"}
+
+        def start_fallback(reason):
+            logging.debug("Trying fallback for {0} 15min data ({1})".format(zone.name, reason))
+            if h is not None:
+                h.update(fallback_attempted=True)
+            futures[pool.submit(_timed, h, "fallback", fetch_fallback, start)] = "fallback"
+
+        if now.hour >= TOMORROW_EXPECTED_HOUR:
+            start_fallback("after {0}:00".format(TOMORROW_EXPECTED_HOUR))
+        else:
+            done, _ = wait(futures, timeout=_latency_p95(h, "entsoe"))
+            if not done:
+                start_fallback("ENTSO-E slower than p95")
+        hedged = len(futures) == 2
+
+        results = {}
+        errors = {}
+        pending = set(futures)
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                source = futures[f]
+                try:
+                    result = f.result()
+                except Exception as e:
+                    logging.warning("{0} fetch for {1} failed: {2}".format(source, zone.name, e))
+                    errors[source] = e
+                    continue
+                results[source] = result[1] if source == "entsoe" else result
+                if h is not None:
+                    h.update(**{source + "_entries": len(results[source])})
+                if _is_complete(results[source], now):
+                    winner = source
+                    break
+            if winner is None and not pending and "fallback" not in futures.values():
+                # ENTSO-E answered, but not enough, or failed
+                start_fallback("ENTSO-E incomplete" if "entsoe" in results else "ENTSO-E failed")
+                pending = {f for f, s in futures.items() if s == "fallback"}
+    finally:
+        pool.shutdown(wait=False)
+
+    entsoe_future = next(f for f, s in futures.items() if s == "entsoe")
+    if entsoe_future.done():
+        stats["bytes"] += entsoe_stats["bytes"]
+    elif h is not None:
+        entsoe_future.add_done_callback(
+            lambda f: h.update(add={"bytes_downloaded_total": entsoe_stats["bytes"]}))
+
+    if winner is None:
+        if not results:
+            raise errors.get("entsoe") or errors["fallback"]
+        # Longest series, ENTSO-E if equal
+        winner = max(results, key=lambda s: (len(results[s]), s == "entsoe"))
+        if winner == "entsoe" and "fallback" in futures.values():
+            logging.warning("Tibber fallback did not return more data")
+    if h is not None:
+        h.update(add={winner + "_wins": 1} if hedged else None, hedged=hedged)
+    if winner == "fallback":
+        logging.debug("Using Tibber fallback data for {0} 15min data".format(zone.name))
+    fetch_mode = entsoe_future.result()[2] if "entsoe" in results else None
+    first_date = entsoe_future.result()[0] if winner == "entsoe" else int(start.timestamp())
+    return first_date, results[winner], fetch_mode, winner
+
+def min_price_list_length(resolution):
+    # Enough prices to cover the next day as well
+    return 26*3600 // RESOLUTION_SECONDS[resolution]
+
+def update_day_ahead_prices(zone, dap=None, known=None):
+    """Fetch the prices of zone from today on.
+
+    If the known record already covers the start of today, only the points
+    after it are requested from ENTSO-E and merged in.
+    """
+    resolution = zone.resolution
+    logging.debug("Getting day ahead prices for zone {0} with resolution {1}".format(zone.name, resolution))
     h = _health_for(dap) if dap is not None else None
     now_ts = int(time.time())
     if h is not None:
-        h["last_attempt"] = now_ts
+        h.update(last_attempt=now_ts)
+    stats = {"bytes": 0}
     try:
-        start = pd.Timestamp.today(tz='Europe/Berlin').replace(hour=0, minute=0, second=0, microsecond=0)
+        start = datetime.now(BERLIN).replace(hour=0, minute=0, second=0, microsecond=0)
         end = start + timedelta(days=7)
 
-        ts     = get_dayahead_prices(ENTSOE_KEY, country_code, start, end, resolution)
-        data   = ts.to_list()
+        # data is in centicent
+        fallback = _fallback() if (zone.fallback and resolution == 'PT15M') else None
+        if h is not None:
+            h.update(fallback_attempted=False, fallback_entries=None, entsoe_entries=None, hedged=False)
+        if fallback is None:
+            first_date_ts, data, fetch_mode = _timed(h, "entsoe", _fetch_entsoe, zone, known, start, end, stats, h)
+            source = "entsoe"
+            if h is not None:
+                h.update(entsoe_entries=len(data))
+        else:
+            first_date_ts, data, fetch_mode, source = _fetch_hedged(zone, h, start, known, end, stats, fallback)
         if h is not None:
-            h["entsoe_entries"] = len(data)
-            h["source_used"] = "entsoe"
-            h["fallback_attempted"] = False
-            h["fallback_entries"] = None
-        # Check if data has valid number of entries
-        if resolution == 'PT15M':
-            # Only use fallback after 15:00, there is not enough data after that time, something is wrong with entso-e
-            current_hour = pd.Timestamp.now(tz='Europe/Berlin').hour
-            if (country_code == '10Y1001A1001A82H') and (fallback_get_prices_de_lu != None):
-                if (len(data) < (23*4)) or ((len(data) < (24+23)*4) and (current_hour >= 15)):
-                    logging.debug("Trying fallback for DE_LU 15min data")
-                    if h is not None:
-                        h["fallback_attempted"] = True
-                    fallback_data = fallback_get_prices_de_lu(start)
-                    if h is not None:
-                        h["fallback_entries"] = len(fallback_data)
-                    if len(fallback_data) > len(data):
-                        data = fallback_data
-                        if h is not None:
-                            h["source_used"] = "fallback"
-                        logging.debug("Using Tibber fallback data for DE_LU 15min data")
-                    else:
-                        logging.warning("Tibber fallback did not return more data")
+            h.update(fetch_mode=fetch_mode, source_used=source)
         if resolution == 'PT60M' and len(data) < 23:
             logging.warning("Invalid number of entries for 60min: {0}".format(len(data)))
             if h is not None:
-                h["last_error"] = "ENTSO-E returned too few 60min entries ({0})".format(len(data))
-                h["last_error_at"] = now_ts
-                h["source_used"] = None
-                h["consecutive_failures"] += 1
+                h.update(add={"consecutive_failures": 1}, source_used=None,
+                         last_error="ENTSO-E returned too few 60min entries ({0})".format(len(data)),
+                         last_error_at=now_ts)
 
             # Fallback no longer used for 60min data
             return None
 
-        # convert from cent in float to centicent in int
-        first_date_ts = int(start.timestamp())
-        prices = [int(i*100) for i in data]
+        prices = list(data)
         # If we got day ahead prices ask again tomorrow, else ask again today
-        if (resolution == 'PT15M' and len(data) < 26*4) or (resolution == 'PT60M' and len(data) < 26):
+        if len(data) < min_price_list_length(resolution):
             next_date = start.replace(hour=13, minute=30, second=0, microsecond=0)
-            if next_date < pd.Timestamp.today(tz='Europe/Berlin'):
-                next_date = pd.Timestamp.today(tz='Europe/Berlin') + timedelta(minutes=10)
+            if next_date < datetime.now(BERLIN):
+                next_date = datetime.now(BERLIN) + timedelta(minutes=10)
         else:
             next_date = (start + timedelta(days=1)).replace(hour=13, minute=30, second=0, microsecond=0)
         next_date_ts = int(next_date.timestamp())
         logging.debug("Discovered new day ahead prices for {0}/{1}: {2}, next: {3}/{4}".format(str(start), str(first_date_ts), str(prices), str(next_date), str(next_date_ts)))
 
         if h is not None:
-            h["last_success"] = now_ts
-            h["num_prices"] = len(prices)
-            h["first_date"] = first_date_ts
-            h["next_date"] = next_date_ts
-            h["consecutive_failures"] = 0
+            h.update(last_success=now_ts, num_prices=len(prices),
+                     first_date=first_date_ts, next_date=next_date_ts, consecutive_failures=0)
 
     except Exception as e:
         logging.error("Exception during entso-e query", exc_info=True)
         if h is not None:
-            h["last_error"] = "{0}: {1}".format(type(e).__name__, e)
-            h["last_error_at"] = now_ts
-            h["source_used"] = None
-            h["consecutive_failures"] += 1
+            h.update(add={"consecutive_failures": 1}, last_error="{0}: {1}".format(type(e).__name__, e),
+                     last_error_at=now_ts, source_used=None)
         return None
+    finally:
+        if h is not None:
+            h.update(add={"bytes_downloaded_total": stats["bytes"]}, bytes_downloaded=stats["bytes"])
 
-    # Generate odered json without spaces
-    od = OrderedDict()
-    od['first_date'] = first_date_ts
-    od['prices']     = prices
-    od['next_date']  = next_date_ts
-    return json.dumps(od, separators=(',', ':')), 200
+    return make_record(first_date_ts, prices, next_date_ts, resolution)
 
-def update_day_ahead_prices_with_retry(country_code, resolution, dap=None, retries=5):
+def update_day_ahead_prices_with_retry(zone, dap=None, known=None, retries=5):
     for retry in range(retries):
-        value = update_day_ahead_prices(country_code, resolution, dap)
-        if value != None:
-            return value
+        record = update_day_ahead_prices(zone, dap, known)
+        if record != None:
+            return record
         # Wait one minute more with every retry
         time.sleep(60*retry)
-    return DAY_AHEAD_PRICE_NOT_FOUND
+    return None
 
-def is_update_necessary(dap, min_price_list_length):
+def is_update_necessary(record, min_price_list_length):
     try:
-        if dap == None:
-            logging.debug("Update because dap == None")
+        if record == None:
+            logging.debug("Update because record == None")
             return True
 
-        if type(dap) != tuple:
-            logging.debug("Update because dap != tuple ({0})".format(str(dap)))
+        if not isinstance(record, PriceRecord):
+            logging.debug("Update because record is not a PriceRecord ({0})".format(str(record)))
             return True
 
-        if dap == DAY_AHEAD_PRICE_NOT_FOUND:
-            logging.debug("Update because dap == DAY_AHEAD_PRICE_NOT_FOUND")
-            return True
-
-        dap0_dict = json.loads(dap[0])
-        dap0_next_date = dap0_dict.get('next_date')
-        dap0_prices = dap0_dict.get('prices')
-        if (dap0_next_date == None) or (dap0_prices == None):
-            logging.debug("Update because JSON malformed ({0})".format(str(dap)))
-            return True
-
-        d1 = int(dap0_next_date) - 60*30 # try update 30 minutes before the wallboxes
+        d1 = int(record.next_date) - 60*30 # try update 30 minutes before the wallboxes
         d2 = int(datetime.now().timestamp())
         if d1 < d2:
             logging.debug("Update because {0} < {1}".format(d1, d2))
@@ -241,7 +733,7 @@ def is_update_necessary(dap, min_price_list_length):
 
         # Check if price list only contains one day of prices
         # In that case we did not get the day ahead prices the last time we updated the data
-        d1 = len(dap0_prices)
+        d1 = len(record.prices)
         d2 = min_price_list_length
         if d1 < d2:
             logging.debug("Update because price list too small {0} < {1}".format(d1, d2))
@@ -253,21 +745,260 @@ def is_update_necessary(dap, min_price_list_length):
         logging.error("Exception during entso-e query", exc_info=True)
         return True
 
+def _publish(records):
+    """Make the given {name: record} entries visible to request handlers.
+
+    The served dict is copied and swapped instead of modified in place, so a
+    request never sees a half-updated zone. Safe to call from any thread.
+    """
+    global dap_records, dap_history
+    with _publish_lock:
+        history = dict(dap_history)
+        for name, record in records.items():
+            known = history.get(name, ())
+            if not known or known[0].etag != record.etag:
+                history[name] = (record,) + known[:DELTA_HISTORY - 1]
+        dap_history = history
+        merged = dict(dap_records)
+        merged.update(records)
+        dap_records = merged
+    for listener in publish_listeners:
+        listener(records)
+
+def _derive(zone, source):
+    """Build the derived records of zone from its fetched source record."""
+    derived = {}
+    for resolution in zone.derived:
+        name = record_name(zone, resolution)
+        record = derive_day_ahead_prices(source, resolution, name, zone.resolution)
+        if record is not None:
+            derived[name] = record
+            archive(zone.eic, resolution, record)
+    return derived
+
 def update():
-    for dap, country_code, resolution in daps():
-        logging.debug("Check update for {0} {1}".format(country_code, resolution))
-        if is_update_necessary(dap_list[dap], 26 if resolution == 'PT60M' else 26*4):
-            dap_list[dap] = update_day_ahead_prices_with_retry(country_code, resolution, dap)
+    """Refresh every zone that needs it, return whether any record changed
+    (the snapshot was written then).
+
+    Zones are fetched in parallel (at most UPDATE_CONCURRENCY at once) and each
+    one is served as soon as its fetch has finished, a slow or failing zone
+    does not hold back the others.
+    """
+    todo = {}
+    for zone in ZONES:
+        name = record_name(zone, zone.resolution)
+        logging.debug("Check update for {0} {1}".format(zone.name, zone.resolution))
+        if is_update_necessary(dap_records.get(name), min_price_list_length(zone.resolution)):
+            todo[name] = zone
+
+    changed = False
+    if todo:
+        with ThreadPoolExecutor(max_workers=UPDATE_CONCURRENCY, thread_name_prefix='dap-update') as pool:
+            futures = {pool.submit(update_day_ahead_prices_with_retry, zone, name, dap_records.get(name)): (name, zone)
+                       for name, zone in todo.items()}
+            for future in as_completed(futures):
+                name, zone = futures[future]
+                record = future.result()
+                # Never replace good data with an error, the old prices are
+                # still more useful to the wallboxes than a 404.
+                if record is None:
+                    continue
+                records = {name: record}
+                old = dap_records.get(name)
+                if (old is None) or (record.body != old.body):
+                    records.update(_derive(zone, record))
+                    changed = True
+                _publish(records)
+                archive(zone.eic, zone.resolution, record)
+
+    # Derived records that are missing although their source is served (e.g.
+    # the snapshot was written by an older version).
+    missing = {}
+    for zone in ZONES:
+        source = dap_records.get(record_name(zone, zone.resolution))
+        if source is None:
+            continue
+        if any(record_name(zone, r) not in dap_records for r in zone.derived):
+            missing.update(_derive(zone, source))
+    if missing:
+        _publish(missing)
+        changed = True
+
+    if changed:
+        save_snapshot()
+    return changed
+
+def aggregate_prices(prices, factor):
+    """Average every `factor` consecutive prices (e.g. factor=4 turns 15min
+    into 60min prices). An incomplete group at the end is dropped."""
+    import numpy as np # only needed by the updater
+    a = np.asarray(prices, dtype=np.int64)
+    n = len(a) // factor * factor
+    return np.rint(a[:n].reshape(-1, factor).mean(axis=1)).astype(np.int64).tolist()
+
+def derive_day_ahead_prices(source, resolution, dap=None, source_resolution='PT15M'):
+    """Build the record for a coarser resolution from a served source record."""
+    try:
+        factor = RESOLUTION_SECONDS[resolution] // RESOLUTION_SECONDS[source_resolution]
+        prices = aggregate_prices(source.prices, factor)
+    except Exception as e:
+        logging.error("Exception while deriving {0} day ahead prices".format(resolution), exc_info=True)
+        if dap is not None:
+            _health_for(dap).update(last_error="{0}: {1}".format(type(e).__name__, e), last_error_at=int(time.time()))
+        return None
+
+    if dap is not None:
+        now_ts = int(time.time())
+        _health_for(dap).update(last_attempt=now_ts, last_success=now_ts, source_used="derived",
+                                num_prices=len(prices), first_date=source.first_date,
+                                next_date=source.next_date, consecutive_failures=0)
+
+    return make_record(source.first_date, prices, source.next_date, resolution)
+
+def archive(area_code, resolution, record):
+    """Append a freshly fetched record to the history in warp.db."""
+    try:
+        price_archive.append(WARP_DB_FILE, area_code, RESOLUTION_SECONDS[resolution],
+                             record.first_date, record.prices)
+    except Exception:
+        logging.error("Could not archive day ahead prices for {0} {1}".format(area_code, resolution), exc_info=True)
+
+# Version of the snapshot last written or loaded. Every save_snapshot()
+# writes the next one, so a follower (see reload_snapshot()) can tell a newer
+# file from an older one.
+_snapshot_version = 0
+
+def save_snapshot(path=None):
+    """Atomically write all currently served price data, and the health of
+    the updates, to the snapshot file as its next version."""
+    global _snapshot_version
+    path = path or SNAPSHOT_FILE
+    records = dap_records
+    od = OrderedDict()
+    for name, _, _ in daps():
+        if name in records:
+            od[name] = records[name].body
+    health = OrderedDict()
+    for name, h in list(_health.items()):
+        health[name] = {k: v for k, v in h.items() if not k.endswith("_latencies")}
+    version = _snapshot_version + 1
+    snapshot = OrderedDict([("version", version), ("written", int(time.time())),
+                            ("records", od), ("health", health)])
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError:
+        logging.error("Could not write day ahead price snapshot {0}".format(path), exc_info=True)
+        return
+    _snapshot_version = version
+
+# (inode, mtime, size) of the snapshot file last loaded, see reload_snapshot()
+_snapshot_seen = None
+
+def load_snapshot(path=None, follow=False):
+    """Load the price data persisted by save_snapshot() into dap_records.
+
+    Returns the number of records loaded. A missing or broken snapshot is not
+    an error, the updater will simply fetch everything from scratch.
+
+    With follow (see reload_snapshot()) the snapshot is only loaded if it is
+    newer than the last one, records that did not change are kept and the
+    health of the process that wrote it is taken over.
+    """
+    global _snapshot_seen, _snapshot_version
+    path = path or SNAPSHOT_FILE
+    try:
+        st = os.stat(path)
+        _snapshot_seen = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError):
+        logging.error("Could not read day ahead price snapshot {0}".format(path), exc_info=True)
+        return 0
+
+    if "records" in snapshot:
+        version, bodies, health = snapshot.get("version", 0), snapshot["records"], snapshot.get("health", {})
+    else:
+        version, bodies, health = 0, snapshot, {}  # written by an older version
+    if follow and version <= _snapshot_version:
+        return 0
+    _snapshot_version = max(_snapshot_version, version)
+
+    records = {}
+    served = dap_records
+    defaults = _new_health()
+    for name, _, resolution in daps():
+        if follow and isinstance(health.get(name), dict):
+            _health_for(name).update(**{k: v for k, v in health[name].items()
+                                        if k in defaults and not k.endswith("_latencies")})
+        body = bodies.get(name)
+        if not isinstance(body, str):
+            continue
+        if follow and name in served and served[name].body == body:
+            continue
+        try:
+            d = json.loads(body)
+            record = make_record(int(d['first_date']), [int(p) for p in d['prices']],
+                                 int(d['next_date']), resolution)
+        except (ValueError, KeyError, TypeError):
+            logging.warning("Ignoring malformed snapshot entry for {0}".format(name))
+            continue
+        records[name] = record
+        if not follow:
+            _health_for(name).update(source_used="snapshot", num_prices=len(record.prices),
+                                     first_date=record.first_date, next_date=record.next_date)
+    _publish(records)
+    logging.debug("Loaded {0} day ahead price records from snapshot version {1}".format(len(records), version))
+    return len(records)
+
+def reload_snapshot(path=None):
+    """load_snapshot() if the file was replaced by a newer version.
+
+    This is how the web workers that don't run the updater (see
+    acquire_updater_lock() and updater.py) get the new prices.
+    """
+    path = path or SNAPSHOT_FILE
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    if (st.st_ino, st.st_mtime_ns, st.st_size) == _snapshot_seen:
+        return 0
+    return load_snapshot(path, follow=True)
+
+_updater_lock = None
+
+def acquire_updater_lock(path=None):
+    """Return whether this process is the one that runs update().
+
+    With several gunicorn worker processes only the first one to take the
+    lock fetches from ENTSO-E. The lock is released when that process exits,
+    another one then takes over. updater.py holds it as well.
+    """
+    global _updater_lock
+    if _updater_lock is not None:
+        return True
+    f = open(path or UPDATER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _updater_lock = f
+    return True
 
 def get_health():
     """Return a JSON-serializable per-source health/diagnostics report."""
     out = OrderedDict()
-    for dap, country_code, resolution in daps():
-        h = _health_for(dap)
-        entry = dap_list[dap]
-        serving_ok = isinstance(entry, tuple) and len(entry) == 2 and entry[1] == 200
+    records = dap_records
+    for name, _, _ in daps():
+        h = _health_for(name).snapshot()  # no update half applied
         rec = OrderedDict()
-        rec["serving_data"]         = serving_ok
+        rec["serving_data"]         = name in records
         rec["source_used"]          = h["source_used"]
         rec["last_success"]         = h["last_success"]
         rec["last_attempt"]         = h["last_attempt"]
@@ -280,33 +1011,214 @@ def get_health():
         rec["consecutive_failures"] = h["consecutive_failures"]
         rec["last_error"]           = h["last_error"]
         rec["last_error_at"]        = h["last_error_at"]
-        out[DAP_NAMES[dap]] = rec
+        rec["fetch_mode"]           = h["fetch_mode"]
+        rec["bytes_downloaded"]     = h["bytes_downloaded"]
+        rec["bytes_downloaded_total"] = h["bytes_downloaded_total"]
+        rec["overlap_mismatches"]   = h["overlap_mismatches"]
+        rec["hedged"]               = h["hedged"]
+        rec["entsoe_latency_ms"]    = h["entsoe_latency_ms"]
+        rec["entsoe_latency_p95_ms"] = h["entsoe_latency_p95_ms"]
+        rec["fallback_latency_ms"]  = h["fallback_latency_ms"]
+        rec["fallback_latency_p95_ms"] = h["fallback_latency_p95_ms"]
+        rec["entsoe_wins"]          = h["entsoe_wins"]
+        rec["fallback_wins"]        = h["fallback_wins"]
+        out[name] = rec
     return out
 
+def _lookup(country, resolution):
+    """Return the served record for country/resolution or an error tuple."""
+    country    = country.lower()
+    resolution = resolution.lower()
+
+    name = _routes.get((country, resolution))
+    if name is None:
+        if not country in _zones_by_country:
+            logging.info("Country not supported: {0}".format(country))
+            return '{"error":"Country not supported"}', 400
+        logging.info("Resolution not supported: {0}".format(resolution))
+        return '{"error":"Resolution not supported"}', 400
+
+    record = dap_records.get(name)
+    if record is None:
+        return DAY_AHEAD_PRICE_NOT_FOUND
+    return record
+
+def delta_keep(record, res, first_date, count):
+    """Return how many of the count prices a client holds from first_date on
+    are the start of record, None if it has to replace them.
+    """
+    if (first_date - record.first_date) % res != 0:
+        return None
+    skip = (record.first_date - first_date) // res  # held prices before the record
+    keep = count - skip
+    if skip < 0 or keep <= 0 or keep > len(record.prices):
+        return None
+    return keep
+
+def _known_etag(name, tag):
+    """Return the recently served record of name with the entity tag, or None."""
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    tag = tag.strip('"').split('-')[0]  # without the jitter and encoding suffixes
+    for record in dap_history.get(name, ()):
+        if record.etag == tag:
+            return record
+    return None
+
+def _delta(name, record, resolution):
+    """Parse a delta request for record.
+
+    Returns None if the client gets the full body (no delta requested or its
+    prices don't fit), the number of its prices it keeps or an error tuple.
+    """
+    args = request.args
+    res = RESOLUTION_SECONDS[DAP_RESOLUTIONS[resolution.lower()]]
+    if 'known' in args:
+        known = _known_etag(name, args['known'])
+        if known is None:
+            return None
+        keep = delta_keep(record, res, known.first_date, len(known.prices))
+        skip = (record.first_date - known.first_date) // res
+        if keep is None or known.prices[skip:skip + keep] != record.prices[:keep]:
+            return None
+        return keep
+    if 'first_date' in args or 'count' in args:
+        try:
+            first_date = int(args['first_date'])
+            count      = int(args['count'])
+        except (KeyError, ValueError):
+            return '{"error":"first_date and count must be integers"}', 400
+        return delta_keep(record, res, first_date, count)
+    return None
+
+def format_delta(record, keep):
+    od = OrderedDict()
+    od['first_date'] = record.first_date
+    od['keep']       = keep
+    od['prices']     = record.prices[keep:]
+    od['next_date']  = record.next_date
+    return json.dumps(od, separators=(',', ':'))
+
+def _full_response(record, environ=None):
+    """(body, status, headers) of the full response of record, as served to
+    the requesting client (its poll jitter bucket, format and encoding)."""
+    valid_until = record.next_date
+    record = for_client(record, poll_jitter.client_bucket(environ))
+    binary = binary_format.requested(environ)
+    encoding, headers, not_modified = http_cache.negotiate(record.etag, valid_until, record.encoded, binary, environ,
+                                                             per_client=True)
+    if not_modified:
+        return '', 304, headers
+    if binary:
+        headers['Content-Type'] = binary_format.MEDIA_TYPE
+        return record.binary, 200, headers
+    if encoding is None:
+        return record.body, 200, headers
+    headers['Content-Encoding'] = encoding
+    return record.encoded[encoding], 200, headers
+
+def cached_response(country, resolution, environ):
+    """The response of day_ahead_prices() to a request without query
+    arguments, for the WSGI fast path (see fast_path). None if there is no
+    served record, Flask answers with the error then."""
+    name = _routes.get((country.lower(), resolution.lower()))
+    record = dap_records.get(name) if name is not None else None
+    if record is None:
+        return None
+    return _full_response(record, environ)
+
 # TODO: Rate limit per IP
 @day_ahead_prices_api.route('/v1/day_ahead_prices/<country>/<resolution>', methods=['GET'])
 def day_ahead_prices(country, resolution):
+    def inner(country, resolution):
+        record = _lookup(country, resolution)
+        if not isinstance(record, PriceRecord):
+            return record + ({},)
+        keep = _delta(_routes[(country.lower(), resolution.lower())], record, resolution)
+        if isinstance(keep, tuple):
+            return keep + ({},)
+        if keep is None:
+            return _full_response(record)
+        valid_until = record.next_date
+        record = for_client(record, poll_jitter.client_bucket())
+        # After merging the client holds the record, so the delta gets its
+        # ETag. Small enough to be sent uncompressed.
+        _, headers, not_modified = http_cache.negotiate(record.etag, valid_until, (), per_client=True)
+        if not_modified:
+            return '', 304, headers
+        return format_delta(record, keep), 200, headers
+    resp, status, headers = inner(country, resolution)
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
+
+
+@day_ahead_prices_api.route('/v1/day_ahead_prices/<country>/<resolution>/cheapest', methods=['GET'])
+def day_ahead_prices_cheapest(country, resolution):
+    def inner(country, resolution):
+        record = _lookup(country, resolution)
+        if not isinstance(record, PriceRecord):
+            return record
+        try:
+            hours = int(request.args['hours'])
+        except (KeyError, ValueError):
+            hours = None
+        if hours not in CHEAPEST_HOURS:
+            return '{"error":"hours must be an integer between 1 and 12"}', 400
+
+        index = record.cheapest
+        best  = index.best.get(hours)
+        now   = max(0, (int(time.time()) - record.first_date) // index.resolution)
+        if (best is None) or (now >= len(best)):
+            return '{"error":"Not enough prices for this window"}', 404
+
+        start = best[now]
+        width = hours*3600 // index.resolution
+        od = OrderedDict()
+        od['first_date']  = record.first_date + start*index.resolution
+        od['last_date']   = record.first_date + (start + width)*index.resolution
+        od['average']     = round((index.sums[start + width] - index.sums[start]) / width)
+        od['percentiles'] = OrderedDict(zip((str(q) for q in PERCENTILES), index.percentiles))
+        od['next_date']   = record.next_date
+        return json.dumps(od, separators=(',', ':')), 200
+    resp, status = inner(country, resolution)
+    return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
+
+
+@day_ahead_prices_api.route('/v1/day_ahead_prices/<country>/<resolution>/history', methods=['GET'])
+def day_ahead_prices_history(country, resolution):
     def inner(country, resolution):
         country    = country.lower()
         resolution = resolution.lower()
 
-        if not country in ('de', 'lu', 'at'):
-            logging.info("Country not supported: {0}".format(country))
+        zone = _zones_by_country.get(country)
+        if zone is None:
             return '{"error":"Country not supported"}', 400
-        if not resolution in('15min', '60min'):
-            logging.info("Resolution not supported: {0}".format(resolution))
+        # Only what the zone serves, as for the live prices
+        if (country, resolution) not in _routes:
             return '{"error":"Resolution not supported"}', 400
+        try:
+            start = int(request.args['from'])
+            end   = int(request.args['to'])
+        except (KeyError, ValueError):
+            return '{"error":"from and to must be unix timestamps"}', 400
+        if end <= start:
+            return '{"error":"to must be after from"}', 400
+        if end - start > MAX_HISTORY_SECONDS:
+            return '{"error":"Range too large"}', 400
+
+        res   = RESOLUTION_SECONDS[DAP_RESOLUTIONS[resolution]]
+        start = start - start % res
+        try:
+            prices = price_archive.query(WARP_DB_FILE, zone.eic, res, start, end)
+        except Exception:
+            logging.error("Exception during day ahead price history query", exc_info=True)
+            return '{"error":"Internal server error"}', 500
 
-        if country in ('de', 'lu') and resolution == '15min':
-            return dap_list[DAY_AHEAD_PRICE_DE_LU_15MIN]
-        elif country in ('de', 'lu') and resolution == '60min':
-            return dap_list[DAY_AHEAD_PRICE_DE_LU_60MIN]
-        elif country == 'at' and resolution == '15min':
-            return dap_list[DAY_AHEAD_PRICE_AT_15MIN]
-        elif country == 'at' and resolution == '60min':
-            return dap_list[DAY_AHEAD_PRICE_AT_60MIN]
-
-        logging.error("Reached unreachable code")
-        return '{"error":"Unknown error"}', 404
+        od = OrderedDict()
+        od['first_date'] = start
+        od['resolution'] = res // 60 # minutes
+        od['prices']     = prices
+        return json.dumps(od, separators=(',', ':')), 200
     resp, status = inner(country, resolution)
     return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
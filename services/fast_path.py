@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# WSGI fast path for the endpoints devices poll.
+#
+# Most requests ask for data this process already holds, a served price
+# record or a cached forecast with its response bodies prebuilt. For those
+# Flask's URL matching, request context and response object are most of the
+# work. FastPath sits in front of the Flask app (main.py) and answers GET
+# requests without query arguments for
+#
+#   /v1/day_ahead_prices/<country>/<resolution>
+#   /v1/temperatures/<lat>/<lon>
+#   /v1/solar_forecast/<lat>/<lon>/<dec>/<az>/<wp>
+#   /estimate/<lat>/<lon>/<dec>/<az>/<kwp>
+#
+# itself if the data is there, with the response the Flask route would send
+# (built by the cached_response() of its service). Everything else, cache
+# misses and invalid parameters included, goes to Flask.
+
+import logging
+
+from werkzeug.http import HTTP_STATUS_CODES
+
+from . import day_ahead_prices, temperatures, solar_forecast
+
+logger = logging.getLogger(__name__)
+
+# Status lines as werkzeug writes them
+_STATUS = {status: '{0} {1}'.format(status, HTTP_STATUS_CODES[status].upper()) for status in (200, 304)}
+
+
+def _lookup(path, environ):
+    """The (body, status, headers) of the request for path, or None."""
+    parts = path.split('/')
+    if '' in parts[1:]:
+        return None
+    if len(parts) == 5 and parts[1] == 'v1':
+        if parts[2] == 'day_ahead_prices':
+            return day_ahead_prices.cached_response(parts[3], parts[4], environ)
+        if parts[2] == 'temperatures':
+            return temperatures.cached_response(parts[3], parts[4], environ)
+    elif len(parts) == 8 and parts[1] == 'v1' and parts[2] == 'solar_forecast':
+        return solar_forecast.cached_response('native', *parts[3:], environ)
+    elif len(parts) == 7 and parts[1] == 'estimate':
+        return solar_forecast.cached_response('estimate', *parts[2:], environ)
+    return None
+
+
+class FastPath:
+    """WSGI middleware, e.g. app.wsgi_app = FastPath(app.wsgi_app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') == 'GET' and not environ.get('QUERY_STRING'):
+            try:
+                response = _lookup(environ.get('PATH_INFO', ''), environ)
+            except Exception:
+                logger.error("Fast path failed for {0}".format(environ.get('PATH_INFO')), exc_info=True)
+                response = None
+            if response is not None:
+                body, status, headers = response
+                if status == 304:
+                    # No entity headers, like werkzeug
+                    headers.pop('Content-Type', None)
+                    body = b''
+                else:
+                    if isinstance(body, str):
+                        body = body.encode()
+                    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+                    headers['Content-Length'] = str(len(body))
+                start_response(_STATUS[status], list(headers.items()))
+                return [body]
+        return self.app(environ, start_response)
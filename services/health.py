@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# Health/diagnostic fields of an upstream, for /v1/status.
+#
+# The fields are written by the updater threads and by request threads (with
+# gthread or gevent workers many at once) and read by the status page. Every
+# update copies the fields under a lock and publishes the copy as a new
+# read-only mapping, so counters are never lost and a reader sees an update
+# completely or not at all, without taking the lock.
+
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+
+class Health(Mapping):
+    def __init__(self, **fields):
+        self._lock = threading.Lock()
+        self._fields = MappingProxyType(fields)
+
+    def snapshot(self):
+        """Return the current fields (a read-only mapping that never changes)."""
+        return self._fields
+
+    def update(self, add=None, **fields):
+        """Set fields and add the counts in add (field -> number) in one step."""
+        def change(h):
+            h.update(fields)
+            for key, n in (add or {}).items():
+                h[key] += n
+        self.replace(change)
+
+    def replace(self, change):
+        """Apply change(fields) to a copy of the fields and publish it."""
+        with self._lock:
+            fields = dict(self._fields)
+            change(fields)
+            self._fields = MappingProxyType(fields)
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
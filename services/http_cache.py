@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# HTTP caching for the endpoints devices poll.
+#
+# Served price records and solar cache entries carry a strong entity tag that
+# is computed once, when they are created. A request whose If-None-Match
+# matches the tag is answered with an empty 304 before the response body is
+# built.
+#
+# Responses also say how long they are valid (Cache-Control, Expires), so the
+# reverse proxy in front of gunicorn can answer repeated requests itself.
+#
+# Bodies are compressed once, when the record or cache entry is built (see
+# compress()), and the variant is picked by Accept-Encoding. Brotli is used if
+# the brotli package is installed, gzip always.
+#
+# The request headers are read from the WSGI environ, the one of the Flask
+# request unless the WSGI fast path (see fast_path) passes its own.
+
+import functools
+import gzip
+import hashlib
+import time
+
+from flask import request
+from werkzeug.http import http_date, parse_accept_header, parse_etags
+
+from . import poll_jitter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content that is past its validity (e.g. prices after next_date while the
+# update is still running) may still be cached this long. The price updater
+# runs every 5 minutes.
+MIN_MAX_AGE = 60
+
+
+def make_etag(*parts):
+    """Return an (unquoted) entity tag identifying the given parts."""
+    h = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def etag_header(tag):
+    return '"' + tag + '"'
+
+
+def not_modified(tag, environ=None):
+    """True if the request's If-None-Match matches tag.
+
+    If-None-Match uses the weak comparison, so W/"<tag>" from a proxy that
+    weakened the tag (e.g. after compressing) matches as well.
+    """
+    environ = request.environ if environ is None else environ
+    return parse_etags(environ.get('HTTP_IF_NONE_MATCH')).contains_weak(tag)
+
+
+def cache_headers(valid_until, now=None, private=False):
+    """Return Cache-Control and Expires for content valid until the unix
+    timestamp. private content may only be kept by the client's own cache."""
+    if now is None:
+        now = int(time.time())
+    max_age = max(MIN_MAX_AGE, int(valid_until - now))
+    return {
+        'Cache-Control': '{0}, max-age={1}'.format('private' if private else 'public', max_age),
+        'Expires': http_date(now + max_age),
+    }
+
+
+
+
+# Encodings compress() produces. Of two the client accepts equally, the
+# first one is used.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Levels of compress(): the smallest bodies for what is compressed once and
+# served many times, cheap ones for bodies compressed per request.
+LEVELS = {'br': 11, 'gzip': 9}
+FAST_LEVELS = {'br': 4, 'gzip': 5}
+
+def compress(body, encodings=None, levels=LEVELS):
+    """Return the compressed variants of body as {encoding: bytes}.
+
+    encodings defaults to all of ENCODINGS.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    variants = {}
+    for encoding in (ENCODINGS if encodings is None else encodings):
+        if encoding == 'br':
+            variants['br'] = brotli.compress(body, quality=levels['br'])
+        else:
+            variants['gzip'] = gzip.compress(body, levels['gzip'], mtime=0)
+    return variants
+
+
+# Devices send a handful of different Accept-Encoding headers, parsed once each.
+@functools.lru_cache(maxsize=256)
+def _accept_encodings(header):
+    return parse_accept_header(header)
+
+
+def select_encoding(variants=ENCODINGS, environ=None):
+    """Return the best encoding of variants the client accepts, None for identity."""
+    environ = request.environ if environ is None else environ
+    accept = _accept_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+    best = None
+    best_q = 0
+    for encoding in ENCODINGS:
+        if encoding in variants and accept[encoding] > best_q:
+            best, best_q = encoding, accept[encoding]
+    return best
+
+
+def negotiate(tag, valid_until, variants=ENCODINGS, binary=False, environ=None, per_client=False):
+    """Pick the encoding and build the headers of a cacheable response.
+
+    Every encoding is a representation of its own with its own entity tag, as
+    is the binary format (see binary_format), which is sent uncompressed.
+    per_client responses depend on the client's poll jitter bucket (see
+    poll_jitter).
+    Returns (encoding, headers, not_modified), encoding is None for identity.
+    Content-Encoding is left for the caller to add to a 200 response.
+    """
+    if binary:
+        encoding = None
+        tag = tag + '-bin'
+    else:
+        encoding = select_encoding(variants, environ)
+        if encoding is not None:
+            tag = tag + '-' + encoding
+    headers = {'ETag': etag_header(tag), 'Vary': 'Accept, Accept-Encoding'}
+    private = False
+    if per_client:
+        headers['Vary'] += ', X-Poll-Bucket'
+        private = poll_jitter.header_bucket(environ) is None
+    headers.update(cache_headers(valid_until, private=private))
+    return encoding, headers, not_modified(tag, environ)
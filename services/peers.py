@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Peer mode: several API nodes share their solar and temperature forecasts.
+#
+# Every cache key (see _cache_key() of solar_forecast and temperatures) has an
+# owner node, chosen by consistent hashing of the key over the configured
+# nodes. A node that misses a key it does not own asks the owner:
+#
+#   POST /internal/v1/peer/<kind>   {"keys": [key, ...]}
+#       -> {"entries": [[fetched, data] | null, ...]}
+#
+# The owner answers from its cache or fetches upstream itself, but never asks
+# another node, so a location is fetched from Open-Meteo once per TTL no
+# matter how many nodes serve it. If the owner does not answer in time the
+# node fetches upstream on its own. Adding a node only moves the keys it
+# takes over (about 1/n of them).
+#
+# Disabled until configure() is called with more than one node, main.py does
+# that from the PEERS and PEER_SELF environment variables and only then
+# registers the internal endpoint. It must not be reachable from outside
+# (see README), and it only answers for valid keys this node owns.
+
+import bisect
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from urllib.request import Request, urlopen
+
+from flask import Blueprint, request
+
+from .health import Health
+
+peers_api = Blueprint('peers_api', __name__)
+
+logger = logging.getLogger(__name__)
+
+# Points per node on the hash ring, evens out the share of keys per node.
+VIRTUAL_NODES = 100
+
+# The owner may have to fetch upstream first (a batch takes up to 30 s).
+PEER_TIMEOUT = 35
+
+# At most this many keys per request to a peer.
+MAX_PEER_KEYS = 1000
+
+_self = None
+_ring = None
+
+# kind -> (function(keys) returning {key: (fetched, data)} from this node's
+# cache or upstream, function(key) returning whether key is a valid cache
+# key), registered by the forecast modules.
+_handlers = {}
+
+_health = Health(requests=0, errors=0, last_error=None, last_error_at=None)
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], 'big')
+
+
+def _key_text(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=VIRTUAL_NODES):
+        points = sorted((_hash('{0}#{1}'.format(node, i)), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key):
+        """Return the node that owns key (a cache key tuple)."""
+        i = bisect.bisect(self._hashes, _hash(_key_text(key))) % len(self._hashes)
+        return self._nodes[i]
+
+
+def configure(self_url, urls):
+    """Enable peer mode with the base URLs of all nodes (including
+    self_url), None or a single node disables it."""
+    global _self, _ring
+    urls = [url.rstrip('/') for url in urls or ()]
+    if self_url is None or len(urls) < 2:
+        _self, _ring = None, None
+        return
+    _self = self_url.rstrip('/')
+    if _self not in urls:
+        raise ValueError("PEER_SELF {0} is not one of PEERS".format(_self))
+    _ring = HashRing(urls)
+
+
+def enabled():
+    return _ring is not None
+
+
+def register(kind, handler, valid):
+    _handlers[kind] = (handler, valid)
+
+
+def owner(key):
+    """Return the base URL of the node that owns key, None if it is this one."""
+    ring = _ring
+    if ring is None:
+        return None
+    node = ring.owner(key)
+    return None if node == _self else node
+
+
+def _ask(node, kind, keys):
+    body = json.dumps({"keys": keys}, separators=(',', ':')).encode()
+    req = Request('{0}/internal/v1/peer/{1}'.format(node, kind), data=body,
+                  headers={'Content-Type': 'application/json'})
+    with urlopen(req, timeout=PEER_TIMEOUT) as response:
+        entries = json.loads(response.read())['entries']
+    if len(entries) != len(keys):
+        raise ValueError("peer returned {0} entries for {1} keys".format(len(entries), len(keys)))
+    return entries
+
+
+def get_many(kind, keys):
+    """Return {key: (fetched, data)} of the keys owned by other nodes, as
+    far as they answered. The caller fetches the others itself."""
+    by_node = {}
+    for key in keys:
+        node = owner(key)
+        if node is not None:
+            by_node.setdefault(node, []).append(key)
+    found = {}
+    for node, owned in by_node.items():
+        for i in range(0, len(owned), MAX_PEER_KEYS):
+            chunk = owned[i:i + MAX_PEER_KEYS]
+            _health.update(add={"requests": 1})
+            try:
+                entries = _ask(node, kind, chunk)
+            except Exception as e:
+                logger.warning("Peer {0} did not answer for {1} {2}: {3}".format(node, len(chunk), kind, e))
+                _health.update(add={"errors": 1}, last_error="{0}: {1}: {2}".format(node, type(e).__name__, e),
+                               last_error_at=int(time.time()))
+                continue
+            for key, entry in zip(chunk, entries):
+                if entry is not None:
+                    found[key] = (entry[0], entry[1])
+    return found
+
+
+def get(kind, key):
+    """get_many() for one key, (fetched, data) or None."""
+    return get_many(kind, (key,)).get(key)
+
+
+def get_health():
+    h = _health.snapshot()
+    return OrderedDict([
+        ("enabled", _ring is not None),
+        ("self", _self),
+        ("requests", h["requests"]),
+        ("errors", h["errors"]),
+        ("last_error", h["last_error"]),
+        ("last_error_at", h["last_error_at"]),
+    ])
+
+
+@peers_api.route('/internal/v1/peer/<kind>', methods=['POST'])
+def peer(kind):
+    def inner():
+        if _ring is None or kind not in _handlers:
+            return '{"error":"Not found"}', 404, {}
+        handler, valid = _handlers[kind]
+        body = request.get_json(force=True, silent=True)
+        keys = body.get('keys') if isinstance(body, dict) else None
+        if not isinstance(keys, list) or len(keys) > MAX_PEER_KEYS or \
+           not all(isinstance(key, list) and all(type(v) in (int, float) for v in key) and valid(tuple(key))
+                   for key in keys):
+            return '{"error":"Invalid keys"}', 400, {}
+        keys = [tuple(key) for key in keys]
+        # Keys of other nodes get null, the asking node's ring differs (e.g.
+        # during a rollout of a new PEERS list) and it fetches them itself.
+        owned = [key for key in OrderedDict.fromkeys(keys) if owner(key) is None]
+        try:
+            found = handler(owned) if owned else {}
+        except Exception as e:
+            logger.error("Peer request for {0} {1} failed: {2}: {3}".format(len(owned), kind, type(e).__name__, e))
+            return '{"error":"Upstream unavailable"}', 502, {}
+        entries = [list(found[key]) if key in found else None for key in keys]
+        return json.dumps({"entries": entries}, separators=(',', ':')), 200, {}
+
+    resp, status, headers = inner()
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
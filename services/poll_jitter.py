@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# Spreads the times devices are told to come back.
+#
+# Every device that got the same next_date would poll in the same second
+# (13:30 for day-ahead prices). Each client is put into one of JITTER_BUCKETS
+# buckets instead, and the time it is given is delayed by its bucket's share
+# of JITTER_WINDOW. The bucket only depends on the client, so a device always
+# gets the same delay and its ETags stay stable.
+#
+# Behind the reverse proxy the client address is the proxy's. The proxy then
+# sets X-Poll-Bucket (e.g. with nginx's split_clients on $remote_addr) and
+# adds it to its cache key, see the README. Responses that depend on the
+# bucket say so (see http_cache.negotiate()): Vary: X-Poll-Bucket, and they
+# are private if the bucket came from the client address, which a shared
+# cache can't tell apart.
+
+import hashlib
+
+from flask import request
+
+# Every bucket is a variant of a response to build and cache (30 s apart).
+JITTER_BUCKETS = 30
+JITTER_WINDOW = 15 * 60  # seconds
+
+
+def bucket_of(key):
+    """Return the bucket of key (e.g. an address or coordinates)."""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=4).digest()
+    return int.from_bytes(digest, 'little') % JITTER_BUCKETS
+
+
+def header_bucket(environ=None):
+    """Return the valid bucket of the X-Poll-Bucket header or None (of the
+    Flask request unless the WSGI environ is given)."""
+    environ = request.environ if environ is None else environ
+    header = environ.get('HTTP_X_POLL_BUCKET')
+    if header is None:
+        return None
+    try:
+        bucket = int(header)
+    except ValueError:
+        return None
+    return bucket if 0 <= bucket < JITTER_BUCKETS else None
+
+
+def client_bucket(environ=None):
+    """Return the bucket of the requesting client (of the Flask request
+    unless the WSGI environ is given)."""
+    environ = request.environ if environ is None else environ
+    bucket = header_bucket(environ)
+    if bucket is not None:
+        return bucket
+    return bucket_of(environ.get('REMOTE_ADDR') or '')
+
+
+def offset(bucket):
+    """Return the delay in seconds of bucket."""
+    return bucket * JITTER_WINDOW // JITTER_BUCKETS
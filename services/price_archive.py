@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Historical day-ahead price archive in warp.db (SQLite).
+#
+# Every fetched series is appended to the archive, keyed by bidding zone
+# (ENTSO-E area code), resolution and time. Prices are stored as compact
+# blocks of one UTC day each (little endian int32 centicent, one slot per
+# interval, _MISSING for unknown slots). The table is clustered on its primary
+# key (zone, resolution, block_start), so a range query only touches the
+# blocks it returns, independent of how many years are archived.
+
+import sqlite3
+import sys
+import threading
+from array import array
+
+BLOCK_SECONDS = 24 * 60 * 60
+
+# Marks archived slots that no price is known for.
+_MISSING = -2**31
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS day_ahead_price_blocks (
+    zone        TEXT    NOT NULL, -- ENTSO-E area code
+    resolution  INTEGER NOT NULL, -- seconds
+    block_start INTEGER NOT NULL, -- unix ts, multiple of BLOCK_SECONDS
+    prices      BLOB    NOT NULL, -- int32 LE centicent, BLOCK_SECONDS/resolution slots
+    PRIMARY KEY (zone, resolution, block_start)
+) WITHOUT ROWID
+'''
+
+# One connection per thread and database file.
+_local = threading.local()
+
+
+def _connect(path):
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(_SCHEMA)
+        conns[path] = conn
+    return conn
+
+
+def _pack(values):
+    a = array('i', values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpack(blob):
+    a = array('i')
+    a.frombytes(blob)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def append(path, zone, resolution, first_date, prices):
+    """Merge a series (centicent, one value per resolution seconds starting at
+    first_date) into the archive. Newer values replace archived ones."""
+    if not prices:
+        return
+    slots = BLOCK_SECONDS // resolution
+    conn = _connect(path)
+    with conn:
+        i = 0
+        while i < len(prices):
+            ts = first_date + i * resolution
+            block_start = ts - ts % BLOCK_SECONDS
+            offset = (ts - block_start) // resolution
+            n = min(slots - offset, len(prices) - i)
+
+            row = conn.execute('SELECT prices FROM day_ahead_price_blocks '
+                               'WHERE zone=? AND resolution=? AND block_start=?',
+                               (zone, resolution, block_start)).fetchone()
+            block = _unpack(row[0]) if row is not None else array('i', [_MISSING]) * slots
+            block[offset:offset + n] = array('i', prices[i:i + n])
+            conn.execute('INSERT OR REPLACE INTO day_ahead_price_blocks '
+                         '(zone, resolution, block_start, prices) VALUES (?, ?, ?, ?)',
+                         (zone, resolution, block_start, _pack(block)))
+            i += n
+
+
+def query(path, zone, resolution, start, end):
+    """Return the archived prices for [start, end) as a list with one entry
+    per interval, starting at start (which must be aligned to resolution).
+    Unknown intervals are None."""
+    n = max(0, (end - start + resolution - 1) // resolution)
+    out = [None] * n
+    if n == 0:
+        return out
+    conn = _connect(path)
+    rows = conn.execute('SELECT block_start, prices FROM day_ahead_price_blocks '
+                        'WHERE zone=? AND resolution=? AND block_start>=? AND block_start<? '
+                        'ORDER BY block_start',
+                        (zone, resolution, start - start % BLOCK_SECONDS, end))
+    for block_start, blob in rows:
+        block = _unpack(blob)
+        # Slot range of this block that falls into [start, end)
+        lo = max(0, (start - block_start) // resolution)
+        hi = min(len(block), (start + n * resolution - block_start) // resolution)
+        dst = (block_start - start) // resolution + lo
+        out[dst:dst + hi - lo] = [None if v == _MISSING else v for v in block[lo:hi]]
+    return out
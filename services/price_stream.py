@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# Server-Sent Events stream of day-ahead price updates.
+#
+#   GET /v1/day_ahead_prices/<country>/<resolution>/stream
+#
+# sends the served record right away and then every new one the moment the
+# updater publishes it: event "prices", id the record's ETag, data the body
+# of /v1/day_ahead_prices/<country>/<resolution>. A client that reconnects
+# with the Last-Event-ID of the served record does not get it again.
+#
+# The gunicorn worker handles one request at a time, so the streams are
+# served by a small asyncio server of their own (started by main.py, the
+# reverse proxy routes .../stream to it, see the README). All connections
+# share one event loop thread and are a protocol object each, no thread or
+# task. A new record is formatted once and written to every subscriber's
+# transport without waiting for it to drain; clients that stop reading
+# (more than MAX_BUFFERED bytes pending) are dropped.
+
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+from . import day_ahead_prices as dap
+
+DEFAULT_PORT = 5003
+
+# A comment line is sent this often, so proxies and NAT keep idle streams.
+KEEPALIVE_SECONDS = 30
+# Reconnect delay for EventSource clients (ms).
+RETRY_MS = 10000
+MAX_BUFFERED = 64 * 1024
+MAX_REQUEST_HEAD = 8192
+REQUEST_TIMEOUT = 10 # seconds
+
+_STREAM_HEAD = ('HTTP/1.1 200 OK\r\n'
+                'Content-Type: text/event-stream\r\n'
+                'Cache-Control: no-cache\r\n'
+                'X-Accel-Buffering: no\r\n'
+                '\r\n'
+                'retry: {0}\n\n').format(RETRY_MS).encode()
+
+
+def format_event(record):
+    return 'id: {0}\nevent: prices\ndata: {1}\n\n'.format(record.etag, record.body).encode()
+
+
+def _error(status, body):
+    reason = {400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              431: 'Request Header Fields Too Large'}.get(status, 'Error')
+    body = body.encode()
+    return ('HTTP/1.1 {0} {1}\r\n'
+            'Content-Type: application/json; charset=utf-8\r\n'
+            'Content-Length: {2}\r\n'
+            'Connection: close\r\n'
+            '\r\n').format(status, reason, len(body)).encode() + body
+
+
+class _Connection(asyncio.Protocol):
+    def __init__(self, stream):
+        self.stream = stream
+        self.transport = None
+        self.name = None
+        self.etag = None  # of the last record the client got
+        self.head = b''
+        self.timeout = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.timeout = self.stream.loop.call_later(REQUEST_TIMEOUT, transport.abort)
+
+    def data_received(self, data):
+        if self.name is not None or self.timeout is None:
+            return # nothing is expected after the request
+        self.head += data
+        end = self.head.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self.head) > MAX_REQUEST_HEAD:
+                self.reply(_error(431, '{"error":"Request too large"}'))
+            return
+        self.timeout.cancel()
+        self.timeout = None
+        self.stream._open(self, self.head[:end].decode('latin-1'))
+
+    def reply(self, response):
+        self.transport.write(response)
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        if self.timeout is not None:
+            self.timeout.cancel()
+        self.stream._close(self)
+
+
+class PriceStream:
+    """The stream server, running its event loop in a thread of its own."""
+
+    def __init__(self):
+        self.loop = None
+        self.port = None
+        self.subscribers = {} # record name -> set of _Connection
+        self._server = None
+        self._thread = None
+
+    @property
+    def connections(self):
+        return sum(len(s) for s in self.subscribers.values())
+
+    def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        error = []
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            try:
+                self._server = self.loop.run_until_complete(
+                    self.loop.create_server(lambda: _Connection(self), host, port, backlog=1024))
+            except OSError as e:
+                error.append(e)
+                ready.set()
+                return
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.loop.call_later(KEEPALIVE_SECONDS, self._keepalive)
+            ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='price-stream', daemon=True)
+        self._thread.start()
+        ready.wait()
+        if error:
+            self.loop.close()
+            raise error[0]
+        dap.publish_listeners.append(self.notify)
+        logging.info("Price stream listening on {0}:{1}".format(host, self.port))
+        return self
+
+    def stop(self):
+        if self.notify in dap.publish_listeners:
+            dap.publish_listeners.remove(self.notify)
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join()
+        self.loop.close()
+
+    def notify(self, records):
+        """Called by the updater (any thread) with the published records."""
+        self.loop.call_soon_threadsafe(self._broadcast, records)
+
+    # Everything below runs in the event loop thread.
+
+    def _shutdown(self):
+        self._server.close()
+        for connections in self.subscribers.values():
+            for connection in connections:
+                connection.transport.abort()
+        self.loop.stop()
+
+    def _open(self, connection, head):
+        lines = head.split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return connection.reply(_error(400, '{"error":"Bad request"}'))
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        parts = urlsplit(target).path.strip('/').split('/')
+        if len(parts) != 5 or parts[:2] != ['v1', 'day_ahead_prices'] or parts[4] != 'stream':
+            return connection.reply(_error(404, '{"error":"Not found"}'))
+        if method != 'GET':
+            return connection.reply(_error(405, '{"error":"Method not allowed"}'))
+        name = dap._routes.get((parts[2].lower(), parts[3].lower()))
+        if name is None:
+            body, status = dap._lookup(parts[2], parts[3])
+            return connection.reply(_error(status, body))
+
+        # Served records are only ever replaced, this one is complete.
+        record = dap.dap_records.get(name)
+        connection.name = name
+        connection.transport.write(_STREAM_HEAD)
+        if record is not None:
+            if headers.get('last-event-id') != record.etag:
+                connection.transport.write(format_event(record))
+            connection.etag = record.etag
+        self.subscribers.setdefault(name, set()).add(connection)
+
+    def _close(self, connection):
+        connections = self.subscribers.get(connection.name)
+        if connections is not None:
+            connections.discard(connection)
+
+    def _send(self, connections, data, etag=None):
+        for connection in list(connections):
+            if etag is not None and connection.etag == etag:
+                continue # a republished record the client already has
+            transport = connection.transport
+            if transport.get_write_buffer_size() > MAX_BUFFERED:
+                transport.abort()
+            else:
+                transport.write(data)
+                connection.etag = etag or connection.etag
+
+    def _broadcast(self, records):
+        for name, record in records.items():
+            connections = self.subscribers.get(name)
+            if connections:
+                self._send(connections, format_event(record), record.etag)
+
+    def _keepalive(self):
+        for connections in self.subscribers.values():
+            self._send(connections, b':\n\n')
+        self.loop.call_later(KEEPALIVE_SECONDS, self._keepalive)
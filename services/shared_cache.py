@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Forecast cache shared by the gunicorn worker processes of one host.
+#
+# The solar and temperature caches keep their entries in process memory
+# (L1). With more than one worker process each entry is also written here, to
+# a SQLite database in WAL mode, and a worker that misses in its L1 looks
+# here before it asks Open-Meteo. So a location is fetched once per host and
+# TTL, not once per worker. Only the upstream data is stored (as JSON), the
+# response bodies are built again by the worker that reads it.
+#
+# Disabled (every lookup misses, nothing is stored) until enable() is called,
+# main.py does that. A failing database is logged and treated like a miss,
+# requests then go upstream as without the shared cache.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS forecast_cache (
+    kind    TEXT NOT NULL, -- 'solar' | 'temperatures'
+    key     TEXT NOT NULL, -- JSON of the quantized cache key
+    fetched REAL NOT NULL, -- unix ts the upstream data was fetched
+    value   TEXT NOT NULL, -- JSON of the upstream data
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID
+'''
+
+# Expired entries are deleted by the next put() after this many seconds.
+PURGE_INTERVAL = 600
+
+_path = None
+_last_purge = {}
+
+# One connection per thread (and process, gunicorn may fork after import).
+_local = threading.local()
+
+
+def enable(path):
+    """Use the database at path from now on (created if missing), None
+    disables the shared cache again."""
+    global _path
+    _path = path
+    if path is None:
+        return
+    try:
+        _connect()
+    except sqlite3.Error:
+        logging.error("Could not open the shared cache {0}, not sharing forecasts".format(path), exc_info=True)
+        _path = None
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != _path:
+        conn = sqlite3.connect(_path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # a lost entry is only fetched again
+        conn.execute(_SCHEMA)
+        _local.conn, _local.pid, _local.path = conn, os.getpid(), _path
+    return conn
+
+
+def _key(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+def get_many(kind, keys, now, ttl):
+    """Return {key: (fetched, value)} of the keys stored fresher than ttl."""
+    if _path is None or not keys:
+        return {}
+    by_text = {_key(key): key for key in keys}
+    found = {}
+    try:
+        conn = _connect()
+        texts = list(by_text)
+        # SQLite allows 999 parameters per statement in older versions
+        for i in range(0, len(texts), 500):
+            chunk = texts[i:i + 500]
+            rows = conn.execute('SELECT key, fetched, value FROM forecast_cache WHERE kind=? AND fetched>? '
+                                'AND key IN ({0})'.format(','.join('?' * len(chunk))),
+                                [kind, now - ttl] + chunk)
+            for text, fetched, value in rows:
+                found[by_text[text]] = (fetched, json.loads(value))
+    except (sqlite3.Error, ValueError):
+        logging.error("Could not read the shared {0} cache".format(kind), exc_info=True)
+    return found
+
+
+def get(kind, key, now, ttl):
+    """Return (fetched, value) of key if stored fresher than ttl, else None."""
+    return get_many(kind, (key,), now, ttl).get(key)
+
+
+def put(kind, entries, ttl):
+    """Store {key: (fetched, value)} and delete the expired entries of kind
+    every PURGE_INTERVAL seconds."""
+    if _path is None or not entries:
+        return
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR REPLACE INTO forecast_cache (kind, key, fetched, value) VALUES (?, ?, ?, ?)',
+                             [(kind, _key(key), fetched, json.dumps(value, separators=(',', ':')))
+                              for key, (fetched, value) in entries.items()])
+            now = time.time()
+            if now - _last_purge.get(kind, 0) > PURGE_INTERVAL:
+                _last_purge[kind] = now
+                conn.execute('DELETE FROM forecast_cache WHERE kind=? AND fetched<?', (kind, now - ttl))
+    except (sqlite3.Error, TypeError, ValueError):
+        logging.error("Could not write the shared {0} cache".format(kind), exc_info=True)
@@ -23,8 +23,9 @@
 # irradiance (Wh/m² per hour). The actual peak power (wp) is applied at response
 # time, so two installations that differ only in size share one upstream call.
 #
-# NOTE: like day_ahead_prices, the in-memory cache assumes gunicorn runs with a
-# single worker (-w 1).
+# With several gunicorn worker processes the entries are shared through
+# shared_cache, every worker keeps its own in-memory copy. In peer mode the
+# entries of several nodes are shared, see peers.
 
 import json
 import logging
@@ -38,6 +39,9 @@ from urllib.request import urlopen
 
 from flask import Blueprint
 
+from . import http_cache, binary_format, poll_jitter, shared_cache, peers
+from .health import Health
+
 solar_forecast_api = Blueprint('solar_forecast_api', __name__)
 
 logger = logging.getLogger(__name__)
@@ -84,19 +88,32 @@ LAT_LON_QUANT = 0.0001 # degrees (~7m-11m)
 TILT_QUANT = 1         # degrees
 AZIMUTH_QUANT = 1      # degrees
 
-# Align roughly with the ICON model update cadence (every 3 h). A device polls
-# at most every ~2 h, so it never sees data older than one model run.
+# Align roughly with the ICON model update cadence (every 3 h). /estimate
+# tells a device to poll again just after the entry expired (see
+# ratelimit_period()), so it never sees data older than one model run.
 CACHE_TTL_SECONDS = 3 * 3600
 
+# The period in /estimate responses changes in steps of this many seconds of
+# poll delay, so the body (and its ETag) is not different for every request.
+RATELIMIT_STEP = 600
+
 # Hard cap on cache entries to bound memory; evicted least-recently-fetched.
 MAX_CACHE_ENTRIES = 50000
 
-# key (tuple) -> dict(first_date, utc_offset, gti, place, fetched)
+# Response bodies (per endpoint and peak power) kept in a cache entry, with
+# the compressed variants that were asked for. Usually there is only one
+# installation per cache key.
+MAX_RESPONSES_PER_ENTRY = 4
+
+# key (tuple) -> dict(first_date, utc_offset, gti, place, etag, fetched, responses)
 _cache = OrderedDict()
 _cache_lock = threading.Lock()
 
+# What of an entry is stored in shared_cache.
+_SHARED_FIELDS = ('first_date', 'utc_offset', 'gti', 'place', 'etag')
+
 # Last upstream (Open-Meteo) interaction, for /v1/status diagnostics.
-_upstream_health = {"last_success": None, "last_error": None, "last_error_at": None}
+_upstream_health = Health(last_success=None, last_error=None, last_error_at=None)
 
 
 def _quantize(value, step):
@@ -138,6 +155,8 @@ def fetch_irradiance(lat, lon, dec, az):
       * gti:         list of Wh/m² per hour (preceding-hour mean), aligned so
                      that gti[i] is the energy during (time[i]-1h, time[i]]
       * place:       human readable location string (timezone name)
+      * etag:        entity tag of the above, see http_cache
+      * responses:   response bodies built from it, see _respond()
     """
     url = _build_url(lat, lon, dec, az)
     try:
@@ -156,47 +175,74 @@ def fetch_irradiance(lat, lon, dec, az):
         # Null values (e.g. before sunrise) are reported as None -> treat as 0.
         gti = [float(v) if v is not None else 0.0 for v in gti]
     except Exception as e:
-        _upstream_health["last_error"] = f"{type(e).__name__}: {e}"
-        _upstream_health["last_error_at"] = int(time.time())
+        _upstream_health.update(last_error=f"{type(e).__name__}: {e}", last_error_at=int(time.time()))
         raise
 
-    _upstream_health["last_success"] = int(time.time())
-    return {
+    _upstream_health.update(last_success=int(time.time()))
+    entry = {
         'first_date': int(times[0]),
         'utc_offset': int(data.get('utc_offset_seconds', 0)),
         'gti': gti,
         'place': data.get('timezone', f"{lat},{lon}"),
     }
+    # From the content, so that a refetch of an unchanged forecast still matches.
+    entry['etag'] = http_cache.make_etag(entry['first_date'], entry['utc_offset'], entry['place'], gti)
+    entry['responses'] = {}
+    return entry
 
 
 def get_health():
     """Return a JSON-serializable health/diagnostics report for this service."""
+    health = _upstream_health.snapshot()
     return OrderedDict([
         ("commercial", OPENMETEO_KEY is not None),
         ("upstream", urlparse(OPEN_METEO_BASE_URL).hostname),
         ("cache_entries", len(_cache)),
-        ("last_success", _upstream_health["last_success"]),
-        ("last_error", _upstream_health["last_error"]),
-        ("last_error_at", _upstream_health["last_error_at"]),
+        ("last_success", health["last_success"]),
+        ("last_error", health["last_error"]),
+        ("last_error_at", health["last_error_at"]),
     ])
 
 
-def get_cached_irradiance(lat, lon, dec, az):
-    """Return a (possibly cached) irradiance entry for the quantized request."""
-    key = _cache_key(lat, lon, dec, az)
-    now = time.time()
-
+def _memory_entry(key, now):
+    """The fresh entry of key in this process' cache, or None."""
     with _cache_lock:
         entry = _cache.get(key)
         if entry is not None and (now - entry['fetched']) < CACHE_TTL_SECONDS:
             _cache.move_to_end(key)
             return entry
+    return None
+
 
-    # Fetch outside the lock (network IO). With -w 1 a small amount of duplicate
-    # work on a cold cache is acceptable and keeps the lock contention-free.
-    qlat, qlon, qdec, qaz = key
-    entry = fetch_irradiance(qlat, qlon, qdec, qaz)
-    entry['fetched'] = now
+def get_cached_irradiance(lat, lon, dec, az, forward=True):
+    """Return a (possibly cached) irradiance entry for the quantized request.
+
+    Without forward a key owned by another node (see peers) is not asked
+    for there but fetched upstream.
+    """
+    key = _cache_key(lat, lon, dec, az)
+    now = time.time()
+
+    entry = _memory_entry(key, now)
+    if entry is not None:
+        return entry
+
+    # Fetch outside the lock (network IO). Concurrent requests for the same
+    # key on a cold cache may fetch twice, that is acceptable and keeps the
+    # lock contention-free.
+    shared = shared_cache.get('solar', key, now, CACHE_TTL_SECONDS)
+    if shared is None and forward:
+        shared = peers.get('solar', key)
+        if shared is not None:
+            shared_cache.put('solar', {key: shared}, CACHE_TTL_SECONDS)
+    if shared is not None:
+        fetched, data = shared
+        entry = dict(data, fetched=fetched, responses={})
+    else:
+        qlat, qlon, qdec, qaz = key
+        entry = fetch_irradiance(qlat, qlon, qdec, qaz)
+        entry['fetched'] = now
+        shared_cache.put('solar', {key: (now, {k: entry[k] for k in _SHARED_FIELDS})}, CACHE_TTL_SECONDS)
 
     with _cache_lock:
         _cache[key] = entry
@@ -207,6 +253,26 @@ def get_cached_irradiance(lat, lon, dec, az):
     return entry
 
 
+def _peer_entries(keys):
+    entries = {}
+    for key in keys:
+        entry = get_cached_irradiance(*key, forward=False)
+        entries[key] = (entry['fetched'], {k: entry[k] for k in _SHARED_FIELDS})
+    return entries
+
+def _valid_key(key):
+    """True if key is a cache key of a valid request (sent by a peer)."""
+    if len(key) != 4:
+        return False
+    try:
+        _parse_common(*key)
+    except ParamError:
+        return False
+    return _cache_key(*key) == key
+
+peers.register('solar', _peer_entries, _valid_key)
+
+
 def compute_forecast(entry, wp):
     """Convert cached irradiance into a list of Wh produced per clock hour.
 
@@ -278,7 +344,73 @@ def _parse_power(power_str, scale):
     return wp
 
 
-def format_forecast_solar_response(entry, forecast):
+def _response_etag(entry, wp):
+    # The body only depends on the cache entry and the peak power.
+    return '{0}-{1:g}'.format(entry['etag'], wp)
+
+
+def _respond(entry, wp, endpoint, format_response, format_binary=None, version=None, valid_until=None,
+             environ=None):
+    """Answer a forecast request from entry.
+
+    The body is built on the first request for this endpoint and peak power
+    and each encoding is compressed once, later polls reuse them until the
+    entry expires. A matching If-None-Match is answered before any of it.
+    Endpoints with a format_binary also serve the binary format. Bodies that
+    depend on more than entry and wp pass it as version, a new version
+    replaces the cached bodies. valid_until (default: when entry expires) is
+    when caches have to ask again.
+    """
+    binary = format_binary is not None and binary_format.requested(environ)
+    tag = _response_etag(entry, wp)
+    if version is not None:
+        tag = '{0}-v{1}'.format(tag, version)
+    if valid_until is None:
+        valid_until = entry['fetched'] + CACHE_TTL_SECONDS
+    encoding, headers, not_modified = http_cache.negotiate(tag, valid_until, binary=binary, environ=environ)
+    if not_modified:
+        return '', 304, headers
+    responses = entry.setdefault('responses', {})
+    key = ('binary' if binary else endpoint, wp)
+    cached = responses.get(key)
+    if cached is not None and cached[0] == version:
+        variants = cached[1]
+    else:
+        forecast = compute_forecast(entry, wp)
+        variants = {None: format_binary(entry, forecast) if binary else format_response(entry, forecast)}
+        # Set as a whole: a concurrent request sees the old or the new bodies.
+        if cached is not None or len(responses) < MAX_RESPONSES_PER_ENTRY:
+            responses[key] = (version, variants)
+    if binary:
+        headers['Content-Type'] = binary_format.MEDIA_TYPE
+        return variants[None], 200, headers
+    if encoding is None:
+        return variants[None], 200, headers
+    body = variants.get(encoding)
+    if body is None:
+        body = variants[encoding] = http_cache.compress(variants[None], (encoding,))[encoding]
+    headers['Content-Encoding'] = encoding
+    return body, 200, headers
+
+
+def _poll_target(entry, key):
+    """When the firmware should poll again for entry: after it expires, with the jitter of key."""
+    return entry['fetched'] + CACHE_TTL_SECONDS + poll_jitter.offset(poll_jitter.bucket_of(key))
+
+
+def ratelimit_period(entry, key, now):
+    """Return the ratelimit period for an /estimate response sent at now.
+
+    The firmware polls again 2 * period seconds later. That is set to just
+    after entry expires, delayed by the poll jitter of the location key and
+    rounded up to RATELIMIT_STEP.
+    """
+    wait = max(_poll_target(entry, key) - now, 1)
+    wait = -(-wait // RATELIMIT_STEP) * RATELIMIT_STEP
+    return int(wait) // 2
+
+
+def format_forecast_solar_response(entry, forecast, period=3600):
     """Build a forecast.solar-compatible JSON string.
 
     The firmware reads result.watt_hours_period (keyed by local "YYYY-MM-DD
@@ -303,9 +435,9 @@ def format_forecast_solar_response(entry, forecast):
     message['text'] = ''
     message['info'] = OrderedDict([('place', entry['place'])])
     # period drives the firmware's next poll: next_check = now + period*2/60 min.
-    # 3600 s => the firmware polls again in ~2 h, matching our cache cadence.
+    # See ratelimit_period().
     message['ratelimit'] = OrderedDict([
-        ('period', 3600),
+        ('period', period),
         ('limit', 100),
         ('remaining', 100),
     ])
@@ -316,6 +448,16 @@ def format_forecast_solar_response(entry, forecast):
     return json.dumps(od, separators=(',', ':'))
 
 
+def _estimate_response(entry, key, wp, environ=None):
+    period = ratelimit_period(entry, key, time.time())
+    # The period shrinks by RATELIMIT_STEP / 2 once the poll target is less
+    # than 2 * period - RATELIMIT_STEP away, caches must not keep it longer.
+    valid_until = _poll_target(entry, key) - 2 * period + RATELIMIT_STEP
+    return _respond(entry, wp, 'estimate',
+                    lambda entry, forecast: format_forecast_solar_response(entry, forecast, period),
+                    version=period, valid_until=valid_until, environ=environ)
+
+
 @solar_forecast_api.route('/estimate/<lat>/<lon>/<dec>/<az>/<kwp>', methods=['GET'])
 def estimate(lat, lon, dec, az, kwp):
     def inner():
@@ -323,24 +465,24 @@ def estimate(lat, lon, dec, az, kwp):
             flat, flon, fdec, faz = _parse_common(lat, lon, dec, az)
             wp = _parse_power(kwp, 1000)  # kWp segment
         except ParamError as e:
-            return json.dumps({"message": {"code": e.status, "type": "error", "text": e.message}}), e.status
+            return json.dumps({"message": {"code": e.status, "type": "error", "text": e.message}}), e.status, {}
 
         try:
             entry = get_cached_irradiance(flat, flon, fdec, faz)
-            forecast = compute_forecast(entry, wp)
-            return format_forecast_solar_response(entry, forecast), 200
+            return _estimate_response(entry, _cache_key(flat, flon, fdec, faz), wp)
         except HTTPError as e:
             logger.error(f"Open-Meteo HTTP error: {e.code} - {e.reason}")
-            return '{"error":"Forecast service unavailable"}', 503
+            return '{"error":"Forecast service unavailable"}', 503, {}
         except (URLError, ValueError) as e:
             logger.error(f"Open-Meteo error: {e}")
-            return '{"error":"Forecast service unavailable"}', 503
+            return '{"error":"Forecast service unavailable"}', 503, {}
         except Exception as e:
             logger.error(f"Unexpected error in solar forecast estimate: {e}", exc_info=True)
-            return '{"error":"Internal server error"}', 500
+            return '{"error":"Internal server error"}', 500, {}
 
-    resp, status = inner()
-    return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
+    resp, status, headers = inner()
+    headers['Content-Type'] = 'application/json; charset=utf-8'
+    return resp, status, headers
 
 
 def format_native_response(entry, forecast):
@@ -351,6 +493,14 @@ def format_native_response(entry, forecast):
     return json.dumps(od, separators=(',', ':'))
 
 
+def format_binary_response(entry, forecast):
+    return binary_format.encode_series(binary_format.KIND_SOLAR_FORECAST, entry['first_date'], 60, forecast)
+
+
+def _native_response(entry, wp, environ=None):
+    return _respond(entry, wp, 'native', format_native_response, format_binary_response, environ=environ)
+
+
 @solar_forecast_api.route('/v1/solar_forecast/<lat>/<lon>/<dec>/<az>/<wp>', methods=['GET'])
 def solar_forecast(lat, lon, dec, az, wp):
     def inner():
@@ -358,21 +508,42 @@ def solar_forecast(lat, lon, dec, az, wp):
             flat, flon, fdec, faz = _parse_common(lat, lon, dec, az)
             wpeak = _parse_power(wp, 1)  # Wp segment
         except ParamError as e:
-            return '{"error":"' + e.message + '"}', e.status
+            return '{"error":"' + e.message + '"}', e.status, {}
 
         try:
             entry = get_cached_irradiance(flat, flon, fdec, faz)
-            forecast = compute_forecast(entry, wpeak)
-            return format_native_response(entry, forecast), 200
+            return _native_response(entry, wpeak)
         except HTTPError as e:
             logger.error(f"Open-Meteo HTTP error: {e.code} - {e.reason}")
-            return '{"error":"Forecast service unavailable"}', 503
+            return '{"error":"Forecast service unavailable"}', 503, {}
         except (URLError, ValueError) as e:
             logger.error(f"Open-Meteo error: {e}")
-            return '{"error":"Forecast service unavailable"}', 503
+            return '{"error":"Forecast service unavailable"}', 503, {}
         except Exception as e:
             logger.error(f"Unexpected error in solar forecast: {e}", exc_info=True)
-            return '{"error":"Internal server error"}', 500
+            return '{"error":"Internal server error"}', 500, {}
 
-    resp, status = inner()
-    return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
+    resp, status, headers = inner()
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
+
+
+def cached_response(endpoint, lat, lon, dec, az, power, environ):
+    """The response of solar_forecast() (endpoint 'native') or estimate()
+    (endpoint 'estimate') for a forecast in this process' cache, for the WSGI
+    fast path (see fast_path). None for anything else, Flask answers it then.
+    """
+    try:
+        flat, flon, fdec, faz = _parse_common(lat, lon, dec, az)
+        wp = _parse_power(power, 1000 if endpoint == 'estimate' else 1)
+    except ParamError:
+        return None
+    key = _cache_key(flat, flon, fdec, faz)
+    entry = _memory_entry(key, time.time())
+    if entry is None:
+        return None
+    if endpoint == 'estimate':
+        resp, status, headers = _estimate_response(entry, key, wp, environ)
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        return resp, status, headers
+    return _native_response(entry, wp, environ)
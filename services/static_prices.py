@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Static publication of the served day-ahead price records.
+#
+# The prices change a few times a day, so the reverse proxy can serve
+#
+#   GET /v1/day_ahead_prices/<country>/<resolution>
+#
+# from files without reaching Python. Every record is written, for every
+# country that routes to it and every poll jitter bucket (see poll_jitter),
+# to
+#
+#   <dir>/<bucket>/v1/day_ahead_prices/<country>/<resolution>.json
+#
+# with the variants next to it: .json.gz and .json.br (if brotli is
+# installed) for nginx's gzip_static/brotli_static and .bin in the binary
+# format (see binary_format). Every file is replaced atomically (written to a
+# temporary file and renamed) and only when its record changed. The files
+# are written by a thread of their own, publishing only queues the records.
+#
+# updater.py enables this. Requests the files don't answer (delta requests,
+# ETags of the Flask responses) are still served by the Flask route, see the
+# README for the nginx configuration.
+
+import logging
+import os
+import threading
+
+from . import day_ahead_prices as dap
+from . import poll_jitter
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(dap.PROJET_DIR, "static_prices")
+
+_dir = None
+
+# (directory, record name) -> ETag of the record last written there. Only
+# used by the writer thread.
+_written = {}
+
+# Record name -> latest record not written yet. Filled by publish(), emptied
+# by the writer thread; _busy while it writes.
+_pending = {}
+_busy = False
+_cond = threading.Condition()
+_thread = None
+
+
+def path_of(directory, bucket, country, resolution, suffix='.json'):
+    return os.path.join(directory, str(bucket), 'v1', 'day_ahead_prices', country, resolution + suffix)
+
+
+def _write(path, data):
+    if isinstance(data, str):
+        data = data.encode()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _files(record):
+    """Yield (suffix, bytes) of every file of a record variant."""
+    yield '.json', record.body
+    for encoding, data in record.encoded.items():
+        yield '.json.' + ('gz' if encoding == 'gzip' else encoding), data
+    yield '.bin', record.binary
+
+
+def _write_records(directory, records):
+    """Write the {name: record} entries that changed since they were last written."""
+    for name, record in records.items():
+        if _written.get((directory, name)) == record.etag:
+            continue
+        routes = [key for key, routed in dap._routes.items() if routed == name]
+        try:
+            for bucket in range(poll_jitter.JITTER_BUCKETS):
+                variant = dap.for_client(record, bucket)
+                for country, resolution in routes:
+                    os.makedirs(os.path.dirname(path_of(directory, bucket, country, resolution)), exist_ok=True)
+                    for suffix, data in _files(variant):
+                        _write(path_of(directory, bucket, country, resolution, suffix), data)
+        except OSError:
+            # Written again with the next update
+            logger.error("Could not publish day ahead prices {0} to {1}".format(name, directory), exc_info=True)
+            _written.pop((directory, name), None)
+            continue
+        _written[(directory, name)] = record.etag
+
+
+def _writer():
+    global _busy
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+            records = dict(_pending)
+            _pending.clear()
+            directory = _dir
+            _busy = True
+        try:
+            if directory is not None:
+                _write_records(directory, records)
+        except Exception:
+            logger.error("Exception while publishing day ahead prices", exc_info=True)
+        finally:
+            with _cond:
+                _busy = False
+                _cond.notify_all()
+
+
+def publish(records):
+    """Hand the {name: record} entries to the writer thread. Registered as a
+    publish listener of day_ahead_prices by enable(), so it must not block:
+    the files are written in the background, of a record published again
+    before that only the latest version.
+    """
+    with _cond:
+        if _dir is None:
+            return
+        _pending.update(records)
+        _cond.notify_all()
+
+
+def flush(timeout=None):
+    """Wait until everything published so far is written. Returns False on timeout."""
+    with _cond:
+        return _cond.wait_for(lambda: not _pending and not _busy, timeout)
+
+
+def enable(directory=None):
+    """Write the served records to directory (default STATIC_DIR) and every
+    record published from now on."""
+    global _dir, _thread
+    with _cond:
+        _dir = directory or STATIC_DIR
+        if _thread is None:
+            _thread = threading.Thread(target=_writer, name='static-prices', daemon=True)
+            _thread.start()
+    if publish not in dap.publish_listeners:
+        dap.publish_listeners.append(publish)
+    publish(dap.dap_records)
+
+
+def disable():
+    global _dir
+    with _cond:
+        _dir = None
+        _pending.clear()
+    if publish in dap.publish_listeners:
+        dap.publish_listeners.remove(publish)
@@ -17,7 +17,7 @@ from urllib.request import urlopen
 
 from flask import Blueprint, abort, redirect, render_template, request
 
-from . import temperatures, solar_forecast, day_ahead_prices
+from . import temperatures, solar_forecast, day_ahead_prices, peers
 from i18n import get_translations, detect_language, SUPPORTED_LANGUAGES
 
 status_api = Blueprint('status_api', __name__)
@@ -60,6 +60,7 @@ def build_status(check=False):
     od['solar_forecast'] = solar_forecast.get_health()
     od['temperatures'] = temperatures.get_health()
     od['day_ahead_prices'] = day_ahead_prices.get_health()
+    od['peers'] = peers.get_health()
     if check:
         od['openmeteo_key_valid'] = _probe_key()
     return od
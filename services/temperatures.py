@@ -3,12 +3,17 @@
 import logging
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.request import urlopen
 from urllib.error import URLError, HTTPError
-from flask import Blueprint
+from flask import Blueprint, request
 from collections import OrderedDict
 
+from . import http_cache, binary_format, shared_cache, peers
+from .health import Health
+
 temperatures_api = Blueprint('temperatures_api', __name__)
 
 logger = logging.getLogger(__name__)
@@ -29,33 +34,61 @@ if OPENMETEO_KEY:
 else:
     OPEN_METEO_BASE_URL = "https://api.open-meteo.com/v1/dwd-icon"
 
+# How long a forecast is cached and served as valid. The ICON model behind it
+# is updated every 3 hours.
+CACHE_TTL_SECONDS = 3600
+
+# Quantization of the cache key. Open-Meteo answers with the nearest point of
+# the model grid (ICON-D2: 2.2 km), so sites less than ~1 km apart share one
+# forecast.
+LAT_LON_QUANT = 0.01 # degrees
+
+# Hard cap on cache entries to bound memory; evicted least-recently-fetched.
+MAX_CACHE_ENTRIES = 50000
+
+# POST /v1/temperatures: locations per request, locations per upstream call
+# (Open-Meteo takes comma separated lists) and upstream calls in parallel.
+MAX_BATCH_LOCATIONS = 10000
+UPSTREAM_BATCH = 100
+UPSTREAM_CONCURRENCY = 4
+STREAM_CHUNK = 500 # locations
+
+# (lat, lon) -> dict(first_date, temperatures, body, etag, fetched)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+_pool = ThreadPoolExecutor(max_workers=UPSTREAM_CONCURRENCY, thread_name_prefix='temperatures')
+# For the requests of other nodes (see peers). Not _pool: its jobs may wait
+# for a peer, which could be waiting for this node's pool in turn.
+_peer_pool = ThreadPoolExecutor(max_workers=UPSTREAM_CONCURRENCY, thread_name_prefix='temperatures-peer')
+
 # Last upstream interaction, for /v1/status diagnostics.
-_health = {"last_success": None, "last_error": None, "last_error_at": None}
+_health = Health(last_success=None, last_error=None, last_error_at=None)
 
 
 def _record_success():
-    _health["last_success"] = int(time.time())
+    _health.update(last_success=int(time.time()))
 
 
 def _record_error(message):
-    _health["last_error"] = message
-    _health["last_error_at"] = int(time.time())
+    _health.update(last_error=message, last_error_at=int(time.time()))
 
 
 def get_health():
     from collections import OrderedDict as _OD
     from urllib.parse import urlparse as _up
+    health = _health.snapshot()
     return _OD([
         ("commercial", OPENMETEO_KEY is not None),
         ("upstream", _up(OPEN_METEO_BASE_URL).hostname),
-        ("last_success", _health["last_success"]),
-        ("last_error", _health["last_error"]),
-        ("last_error_at", _health["last_error_at"]),
+        ("cache_entries", len(_cache)),
+        ("last_success", health["last_success"]),
+        ("last_error", health["last_error"]),
+        ("last_error_at", health["last_error_at"]),
     ])
 
 
-# Fetch temperature forecast from Open-Meteo DWD ICON API.
-def fetch_temperature_forecast(lat: float, lon: float) -> dict:
+def _build_url(lat, lon):
     url = (
         f"{OPEN_METEO_BASE_URL}"
         f"?latitude={lat}"
@@ -68,13 +101,30 @@ def fetch_temperature_forecast(lat: float, lon: float) -> dict:
 
     if OPENMETEO_KEY:
         url += f"&apikey={OPENMETEO_KEY}"
+    return url
 
-    with urlopen(url, timeout=10) as response:
+# Fetch temperature forecast from Open-Meteo DWD ICON API.
+def fetch_temperature_forecast(lat: float, lon: float) -> dict:
+    with urlopen(_build_url(lat, lon), timeout=10) as response:
         if response.status != 200:
             raise Exception(f"Open-Meteo API returned status {response.status}")
         return json.loads(response.read().decode())
 
-def format_temperature_response(data: dict) -> str:
+# Fetch the forecasts of several locations ((lat, lon) tuples) in one call.
+def fetch_temperature_forecasts(locations: list) -> list:
+    url = _build_url(','.join(str(lat) for lat, _ in locations), ','.join(str(lon) for _, lon in locations))
+    with urlopen(url, timeout=30) as response:
+        if response.status != 200:
+            raise Exception(f"Open-Meteo API returned status {response.status}")
+        data = json.loads(response.read().decode())
+    if isinstance(data, dict):
+        data = [data]  # a single location is not wrapped in a list
+    if len(data) != len(locations):
+        raise ValueError(f"Open-Meteo returned {len(data)} forecasts for {len(locations)} locations")
+    return data
+
+def parse_temperatures(data: dict) -> tuple:
+    """Return first_date and the temperatures in 10ths of degree Celsius."""
     hourly = data.get('hourly', {})
     hourly_times = hourly.get('time', [])
     hourly_temps = hourly.get('temperature_2m', [])
@@ -82,12 +132,208 @@ def format_temperature_response(data: dict) -> str:
     if len(hourly_temps) < 47 or len(hourly_times) < 47:
         raise ValueError("Insufficient hourly data received (need at least 47)")
 
+    return hourly_times[0], [round(t * 10) for t in hourly_temps]
+
+def format_temperature_response(data: dict) -> str:
+    return _format(*parse_temperatures(data))
+
+def _format(first_date, temps):
     result = OrderedDict()
-    result['first_date'] = hourly_times[0]
-    result['temperatures'] = [round(t * 10) for t in hourly_temps]
+    result['first_date'] = first_date
+    result['temperatures'] = temps
 
     return json.dumps(result, separators=(',', ':'))
 
+def format_binary_response(entry: dict) -> bytes:
+    return binary_format.encode_series(binary_format.KIND_TEMPERATURES, entry['first_date'], 60, entry['temperatures'])
+
+def _cache_key(lat, lon):
+    return (round(round(lat / LAT_LON_QUANT) * LAT_LON_QUANT, 2),
+            round(round(lon / LAT_LON_QUANT) * LAT_LON_QUANT, 2))
+
+def _entry(first_date, temps, fetched):
+    body = _format(first_date, temps)
+    return {'first_date': first_date, 'temperatures': temps, 'body': body,
+            'etag': http_cache.make_etag(body), 'fetched': fetched}
+
+def _make_entry(data, fetched):
+    return _entry(*parse_temperatures(data), fetched)
+
+def _store(entries, shared=True):
+    """Cache the entries in memory and, unless they came from there, in shared_cache."""
+    with _cache_lock:
+        for key, entry in entries.items():
+            _cache[key] = entry
+            _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    if shared:
+        shared_cache.put('temperatures', {key: _shared(e) for key, e in entries.items()}, CACHE_TTL_SECONDS)
+
+def _shared(entry):
+    """(fetched, data) of entry as stored in shared_cache and sent to peers."""
+    return entry['fetched'], [entry['first_date'], entry['temperatures']]
+
+def _cached(keys, now):
+    """Return {key: entry} of the keys that have a fresh cache entry."""
+    found = {}
+    with _cache_lock:
+        for key in keys:
+            entry = _cache.get(key)
+            if entry is not None and (now - entry['fetched']) < CACHE_TTL_SECONDS:
+                _cache.move_to_end(key)
+                found[key] = entry
+    # Fetched by another worker process?
+    missing = [key for key in keys if key not in found]
+    shared = shared_cache.get_many('temperatures', missing, now, CACHE_TTL_SECONDS)
+    if shared:
+        entries = {key: _entry(first_date, temps, fetched) for key, (fetched, (first_date, temps)) in shared.items()}
+        _store(entries, shared=False)
+        found.update(entries)
+    return found
+
+def _from_peers(keys):
+    """Return {key: entry} of the keys that other nodes own and answered for
+    (see peers), and cache them here as well."""
+    found = peers.get_many('temperatures', keys)
+    entries = {key: _entry(first_date, temps, fetched) for key, (fetched, (first_date, temps)) in found.items()}
+    if entries:
+        _store(entries)
+    return entries
+
+def get_cached_temperatures(lat, lon, forward=True):
+    """Return a (possibly cached) forecast entry for the quantized location.
+
+    Without forward a location owned by another node is fetched upstream
+    instead of being asked for there.
+    """
+    key = _cache_key(lat, lon)
+    now = time.time()
+    entry = _cached((key,), now).get(key)
+    if entry is None and forward:
+        entry = _from_peers((key,)).get(key)
+    if entry is not None:
+        return entry
+
+    # Fetch outside the lock (network IO), like the solar forecast cache.
+    try:
+        entry = _make_entry(fetch_temperature_forecast(*key), now)
+    except HTTPError as e:
+        _record_error(f"HTTPError: {e.code} {e.reason}")
+        raise
+    except Exception as e:
+        _record_error(f"{type(e).__name__}: {e}")
+        raise
+    _record_success()
+    _store({key: entry})
+    return entry
+
+def fetch_batch(keys, forward=True):
+    """Fetch and cache the forecasts of the quantized locations with one
+    upstream call, the ones owned by other nodes from there (unless not
+    forward)."""
+    found = _from_peers(keys) if forward else {}
+    keys = [key for key in keys if key not in found]
+    if not keys:
+        return found
+    now = time.time()
+    try:
+        entries = _fetch_entries(keys, now)
+    except HTTPError as e:
+        _record_error(f"HTTPError: {e.code} {e.reason}")
+        raise
+    except Exception as e:
+        _record_error(f"{type(e).__name__}: {e}")
+        raise
+    if entries:
+        _record_success()
+        _store(entries)
+    entries.update(found)
+    return entries
+
+def _refused(e):
+    """True if Open-Meteo refused a request because of its locations (4xx,
+    but not rate limiting)."""
+    return isinstance(e, HTTPError) and 400 <= e.code < 500 and e.code != 429
+
+def _fetch_entries(keys, now):
+    """Return {key: entry} of the keys whose forecasts could be fetched.
+
+    Open-Meteo refuses a whole request for one location it can't serve, so a
+    refused request is split in halves until the failing locations are
+    alone. These and the forecasts that can't be parsed are left out (and
+    logged), so that only they get an error entry in a batch response. Other
+    errors (timeouts, 5xx) are raised.
+    """
+    try:
+        data = fetch_temperature_forecasts(keys)
+    except Exception as e:
+        if not _refused(e) or len(keys) == 1:
+            raise
+        entries = {}
+        for part in (keys[:len(keys) // 2], keys[len(keys) // 2:]):
+            try:
+                entries.update(_fetch_entries(part, now))
+            except HTTPError as part_error:
+                if not _refused(part_error) or len(part) > 1:
+                    raise
+                logger.error(f"Open-Meteo refused location {part[0]}: {part_error.code} {part_error.reason}")
+                _record_error(f"HTTPError: {part_error.code} {part_error.reason}")
+        return entries
+    entries = {}
+    for key, forecast in zip(keys, data):
+        try:
+            entries[key] = _make_entry(forecast, now)
+        except Exception as e:
+            logger.error(f"Invalid Open-Meteo forecast for {key}: {type(e).__name__}: {e}")
+            _record_error(f"{type(e).__name__}: {e}")
+    return entries
+
+def _peer_entries(keys):
+    entries = _cached(keys, time.time())
+    missing = [key for key in keys if key not in entries]
+    groups = [missing[i:i + UPSTREAM_BATCH] for i in range(0, len(missing), UPSTREAM_BATCH)]
+    for fetched in _peer_pool.map(lambda group: fetch_batch(group, forward=False), groups):
+        entries.update(fetched)
+    return {key: _shared(entry) for key, entry in entries.items()}
+
+def _valid_key(key):
+    """True if key is the cache key of a valid location (sent by a peer)."""
+    return len(key) == 2 and -90 <= key[0] <= 90 and -180 <= key[1] <= 180 and _cache_key(*key) == key
+
+peers.register('temperatures', _peer_entries, _valid_key)
+
+def _respond(entry, environ=None):
+    binary = binary_format.requested(environ)
+    _, headers, not_modified = http_cache.negotiate(entry['etag'], entry['fetched'] + CACHE_TTL_SECONDS,
+                                                    (), binary, environ)
+    if not_modified:
+        return '', 304, headers
+    if binary:
+        if 'binary' not in entry:
+            entry['binary'] = format_binary_response(entry)
+        headers['Content-Type'] = binary_format.MEDIA_TYPE
+        return entry['binary'], 200, headers
+    return entry['body'], 200, headers
+
+def cached_response(lat_str, lon_str, environ):
+    """The response of temperatures() for a location in this process' cache,
+    for the WSGI fast path (see fast_path). None for anything else, Flask
+    answers it then."""
+    try:
+        lat, lon = float(lat_str), float(lon_str)
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return None
+    key = _cache_key(lat, lon)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or (time.time() - entry['fetched']) >= CACHE_TTL_SECONDS:
+            return None
+        _cache.move_to_end(key)
+    return _respond(entry, environ)
+
 # Get hourly temperature forecast for today and tomorrow.
 #
 # Parameters:
@@ -97,49 +343,141 @@ def format_temperature_response(data: dict) -> str:
 # Returns:
 # * JSON with first_date (UTC timestamp of local midnight) and a flat
 #   temperatures array of 47-49 temperature integers in 10ths of degree Celsius.
+#   With ?format=binary the same as binary series (see binary_format).
 @temperatures_api.route('/v1/temperatures/<lat>/<lon>', methods=['GET'])
 def temperatures(lat, lon):
     def inner(lat_str, lon_str):
         try:
             lat = float(lat_str)
         except ValueError:
-            return '{"error":"Invalid latitude format"}', 400
+            return '{"error":"Invalid latitude format"}', 400, {}
 
         try:
             lon = float(lon_str)
         except ValueError:
-            return '{"error":"Invalid longitude format"}', 400
+            return '{"error":"Invalid longitude format"}', 400, {}
 
         if not (-90 <= lat <= 90):
-            return '{"error":"Latitude must be between -90 and 90"}', 400
+            return '{"error":"Latitude must be between -90 and 90"}', 400, {}
 
         if not (-180 <= lon <= 180):
-            return '{"error":"Longitude must be between -180 and 180"}', 400
+            return '{"error":"Longitude must be between -180 and 180"}', 400, {}
 
         # Fetch and format temperature data
         try:
-            data = fetch_temperature_forecast(lat, lon)
-            response = format_temperature_response(data)
-            _record_success()
-            return response, 200
+            return _respond(get_cached_temperatures(lat, lon))
         except HTTPError as e:
             logger.error(f"Open-Meteo HTTP error: {e.code} - {e.reason}")
-            _record_error(f"HTTPError: {e.code} {e.reason}")
             if e.code == 400:
-                return '{"error":"Invalid coordinates"}', 400
-            return '{"error":"Weather service unavailable"}', 503
+                return '{"error":"Invalid coordinates"}', 400, {}
+            return '{"error":"Weather service unavailable"}', 503, {}
         except URLError as e:
             logger.error(f"Open-Meteo connection error: {e.reason}")
-            _record_error(f"URLError: {e.reason}")
-            return '{"error":"Weather service unavailable"}', 503
+            return '{"error":"Weather service unavailable"}', 503, {}
         except ValueError as e:
             logger.error(f"Data parsing error: {e}")
-            _record_error(f"ValueError: {e}")
-            return '{"error":"Invalid response from weather service"}', 503
+            return '{"error":"Invalid response from weather service"}', 503, {}
         except Exception as e:
             logger.error(f"Unexpected error fetching temperatures: {e}", exc_info=True)
-            _record_error(f"{type(e).__name__}: {e}")
-            return '{"error":"Internal server error"}', 500
+            return '{"error":"Internal server error"}', 500, {}
+
+    resp, status, headers = inner(lat, lon)
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
+
+
+def _parse_locations(body):
+    """Return the [lat, lon] pairs of a batch request as float tuples or raise ValueError."""
+    locations = body.get('locations') if isinstance(body, dict) else None
+    if not isinstance(locations, list):
+        raise ValueError("locations must be a list of [lat, lon]")
+    if len(locations) > MAX_BATCH_LOCATIONS:
+        raise ValueError(f"At most {MAX_BATCH_LOCATIONS} locations")
+    parsed = []
+    for i, location in enumerate(locations):
+        if not isinstance(location, list) or len(location) != 2:
+            raise ValueError(f"Invalid location at index {i}")
+        try:
+            lat, lon = (float(v) for v in location)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid location at index {i}")
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise ValueError(f"Location out of range at index {i}")
+        parsed.append((lat, lon))
+    return parsed
+
+
+def _stream_batch(locations, keys, entries, futures):
+    """Yield the JSON array of a batch response, in the order of locations.
+
+    Entries that were cached are in entries, the others come from the
+    upstream call of their future. What is ready is sent before waiting, and
+    at least every STREAM_CHUNK locations.
+    """
+    chunk = ['[']
+    failed = set()
+    for i, ((lat, lon), key) in enumerate(zip(locations, keys)):
+        if key not in entries:
+            future = futures[key]
+            if not future.done() and chunk:
+                yield ''.join(chunk)
+                chunk = []
+            try:
+                entries[key] = future.result().get(key)
+            except Exception as e:
+                if future not in failed:
+                    logger.error(f"Open-Meteo batch error: {type(e).__name__}: {e}")
+                    failed.add(future)
+                entries[key] = None
+        elif len(chunk) > 2 * STREAM_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+        entry = entries[key]
+        if i:
+            chunk.append(',')
+        if entry is None:
+            chunk.append(f'{{"lat":{lat!r},"lon":{lon!r},"error":"Weather service unavailable"}}')
+        else:
+            chunk.append(f'{{"lat":{lat!r},"lon":{lon!r},{entry["body"][1:]}')
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+# Get the temperature forecasts of many locations.
+#
+# Body: {"locations": [[lat, lon], ...]} with at most MAX_BATCH_LOCATIONS
+# locations.
+#
+# Returns:
+# * JSON array with one object per location, in the same order: lat, lon and
+#   the fields of GET /v1/temperatures, or lat, lon and error if its forecast
+#   could not be fetched. Locations in the same cache cell are fetched once,
+#   the ones not cached are fetched UPSTREAM_BATCH at a time. A location
+#   Open-Meteo refuses only fails itself, not the others of its upstream call.
+#   The response is streamed (chunked) while the upstream calls run.
+@temperatures_api.route('/v1/temperatures', methods=['POST'])
+def temperatures_batch():
+    def inner():
+        body = request.get_json(force=True, silent=True)
+        if body is None:
+            return '{"error":"Invalid JSON body"}', 400, {}
+        try:
+            locations = _parse_locations(body)
+        except ValueError as e:
+            return json.dumps({"error": str(e)}, separators=(',', ':')), 400, {}
+
+        keys = [_cache_key(lat, lon) for lat, lon in locations]
+        unique = list(OrderedDict.fromkeys(keys))
+        entries = _cached(unique, time.time())
+        misses = [key for key in unique if key not in entries]
+        futures = {}
+        for i in range(0, len(misses), UPSTREAM_BATCH):
+            group = misses[i:i + UPSTREAM_BATCH]
+            future = _pool.submit(fetch_batch, group)
+            for key in group:
+                futures[key] = future
+        return _stream_batch(locations, keys, entries, futures), 200, {}
 
-    resp, status = inner(lat, lon)
-    return resp, status, {'Content-Type': 'application/json; charset=utf-8'}
+    resp, status, headers = inner()
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    return resp, status, headers
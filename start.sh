@@ -1,4 +1,9 @@
 #!/bin/bash
 cd "$(dirname "$0")"
 source venv/bin/activate
-./venv/bin/gunicorn -w 1 --bind unix:app.sock main:app
+# gthread serves other requests while some wait for an upstream (up to 10 s
+# on a cache miss); WORKER_CLASS=gevent works as well (pip install gevent).
+# WORKERS=N runs N processes, they share the forecasts through cache.db and
+# one of them updates the prices. With PRICE_UPDATER=external none of them
+# does, start_updater.sh runs the updater as a process of its own.
+./venv/bin/gunicorn -w "${WORKERS:-1}" -k "${WORKER_CLASS:-gthread}" --threads "${THREADS:-16}" --bind unix:app.sock main:app
@@ -0,0 +1,4 @@
+#!/bin/bash
+cd "$(dirname "$0")"
+source venv/bin/activate
+./venv/bin/python updater.py
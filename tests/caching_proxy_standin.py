@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in for a caching reverse proxy (nginx with proxy_cache).
+#
+# Forwards GET requests to `backend` and keeps 200 responses that are marked
+# cacheable with "Cache-Control: public, max-age=N" for N seconds, keyed by
+# the request path, Accept, Accept-Encoding and the poll jitter bucket of the
+# client address, which it sends as X-Poll-Bucket (as the nginx configuration
+# in the README does). Everything else is passed through uncached. Hits and
+# misses are counted; `clock` can be replaced to let entries expire without
+# waiting.
+
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from services import poll_jitter
+
+_MAX_AGE = re.compile(r'(?:^|,)\s*max-age=(\d+)')
+
+# Hop-by-hop and length headers are set by the proxy itself.
+_SKIP_HEADERS = {'connection', 'transfer-encoding', 'content-length', 'server', 'date'}
+
+
+class CachingProxyStandIn:
+    def __init__(self, backend):
+        self.backend = backend.rstrip('/')
+        self.clock = time.time
+        self.hits = 0
+        self.misses = 0
+        self.cache = {} # (path, Accept, Accept-Encoding, bucket) -> (expires, status, headers, body)
+        self._lock = threading.Lock()
+
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                proxy._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_address[1])
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _fetch(self, path, accept, accept_encoding, bucket):
+        request = Request(self.backend + path, headers={'X-Poll-Bucket': str(bucket)})
+        if accept is not None:
+            request.add_header('Accept', accept)
+        if accept_encoding is not None:
+            request.add_header('Accept-Encoding', accept_encoding)
+        try:
+            with urlopen(request, timeout=10) as response:
+                return response.status, list(response.headers.items()), response.read()
+        except HTTPError as e:
+            return e.code, list(e.headers.items()), e.read()
+
+    def _handle(self, handler):
+        path = handler.path
+        key = (path, handler.headers.get('Accept'), handler.headers.get('Accept-Encoding'),
+               poll_jitter.bucket_of(handler.client_address[0]))
+        now = self.clock()
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            status, headers, body = self._fetch(*key)
+            cache_control = dict((k.lower(), v) for k, v in headers).get('cache-control', '')
+            max_age = _MAX_AGE.search(cache_control)
+            if status == 200 and 'public' in cache_control and max_age:
+                with self._lock:
+                    self.cache[key] = (now + int(max_age.group(1)), status, headers, body)
+        else:
+            _, status, headers, body = entry
+        handler.send_response(status)
+        for k, v in headers:
+            if k.lower() not in _SKIP_HEADERS:
+                handler.send_header(k, v)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
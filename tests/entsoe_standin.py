@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the ENTSO-E transparency API.
+#
+# Answers A44 (day-ahead price) requests for any in_Domain with a generated
+# document in PT15M and PT60M. Like the real API it answers with whole
+# delivery days: from the Berlin midnight of periodStart's day for `days`
+# days, but not beyond periodEnd or `published_until` (if set). Every request
+# can be delayed by `latency` seconds to make parallelism visible, and the
+# server counts requests, bytes sent and the highest number of requests that
+# were in flight at the same time. The query of the last request is kept in
+# `last_query`.
+
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from zoneinfo import ZoneInfo
+import time
+
+BERLIN = ZoneInfo('Europe/Berlin')
+
+HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<Publication_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-3:publicationdocument:7:3">
+  <type>A44</type>
+  <period.timeInterval>
+    <start>{start}</start>
+    <end>{end}</end>
+  </period.timeInterval>
+'''
+
+SERIES = '''  <TimeSeries>
+    <mRID>{mrid}</mRID>
+    <in_Domain.mRID codingScheme="A01">{zone}</in_Domain.mRID>
+    <out_Domain.mRID codingScheme="A01">{zone}</out_Domain.mRID>
+    <curveType>A01</curveType>
+    <Period>
+      <timeInterval>
+        <start>{start}</start>
+        <end>{end}</end>
+      </timeInterval>
+      <resolution>{resolution}</resolution>
+{points}
+    </Period>
+  </TimeSeries>
+'''
+
+FOOTER = '</Publication_MarketDocument>\n'
+
+RESOLUTIONS = {'PT15M': 15 * 60, 'PT60M': 60 * 60}
+
+
+def price(zone, ts):
+    """Deterministic price in EUR/MWh of zone at unix ts."""
+    return ((ts // 900) * 7919 + sum(zone.encode())) % 20000 / 100 - 20
+
+
+def document(zone, start, end, offset=0):
+    fmt = '%Y-%m-%dT%H:%MZ'
+    out = [HEADER.format(start=start.strftime(fmt), end=end.strftime(fmt))]
+    if end <= start:
+        # No data, the real API answers with an acknowledgement document
+        out.append(FOOTER)
+        return ''.join(out).encode()
+    t0 = int(start.timestamp())
+    for mrid, (resolution, seconds) in enumerate(RESOLUTIONS.items(), 1):
+        n = (int(end.timestamp()) - t0) // seconds
+        points = '\n'.join('      <Point><position>{0}</position><price.amount>{1:.2f}</price.amount></Point>'
+                           .format(i + 1, price(zone, t0 + i * seconds) + offset) for i in range(n))
+        out.append(SERIES.format(mrid=mrid, zone=zone, start=start.strftime(fmt), end=end.strftime(fmt),
+                                 resolution=resolution, points=points))
+    out.append(FOOTER)
+    return ''.join(out).encode()
+
+
+class EntsoeStandIn:
+    def __init__(self, latency=0.0, days=2, published_until=None):
+        self.latency = latency
+        self.days = days
+        self.published_until = published_until
+        self.price_offset = 0 # EUR/MWh added to every price, simulates corrections
+        self.last_query = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/api'.format(self._server.server_address[1])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, handler):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            query = parse_qs(urlparse(handler.path).query)
+            self.last_query = query
+            zone = query['in_Domain'][0]
+            period_start = datetime.strptime(query['periodStart'][0], '%Y%m%d%H%M').replace(tzinfo=timezone.utc)
+            period_end = datetime.strptime(query['periodEnd'][0], '%Y%m%d%H%M').replace(tzinfo=timezone.utc)
+            start = period_start.astimezone(BERLIN).replace(hour=0, minute=0).astimezone(timezone.utc)
+            end = min(start + timedelta(days=self.days), period_end)
+            if self.published_until is not None:
+                end = min(end, self.published_until)
+            body = document(zone, start, end, self.price_offset)
+        finally:
+            # Counted as done before the response is written, a client that
+            # has read the body may send its next request before this thread
+            # gets any further.
+            with self._lock:
+                self.in_flight -= 1
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/xml')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self._lock:
+            self.bytes_sent += len(body)
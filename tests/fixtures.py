@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+# Times and upstream stand-in data shared by the tests.
+
+from datetime import datetime
+
+import services.day_ahead_prices as dap
+
+T0 = 1760392800  # 2025-10-13T22:00Z, local midnight in Berlin
+
+
+def today():
+    """Start of today in Berlin, where a fetch for today's prices starts."""
+    return int(datetime.now(dap.BERLIN).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def fake_temperatures(lat, lon):
+    """Open-Meteo temperature data of a location, 48 hours from T0."""
+    return {'hourly': {'time': [T0 + h * 3600 for h in range(48)],
+                       'temperature_2m': [10 + h / 10 for h in range(48)]}}
+
+
+def fake_irradiance(lat, lon, dec, az):
+    """fetch_irradiance() result of a plane, 72 hours from T0."""
+    return {'first_date': T0, 'utc_offset': 7200, 'place': 'Europe/Berlin',
+            'gti': [float(dec + az + h) for h in range(72)], 'etag': 'x', 'responses': {}}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# The price, temperature and solar APIs served by gunicorn in a child process,
+# like start.sh does, to test and measure the worker classes.
+#
+# The child serves a fixed price record for de/15min and gets temperatures
+# from `upstream_url` (see open_meteo_standin.py), so a temperature request
+# for a new location waits for the stand-in's latency. Logging goes nowhere,
+# the updater is not started. With `shared_cache` (a database path) the
+# worker processes share their forecasts, see services/shared_cache.py. Set
+# `peers` to the urls of all servers before starting them for peer mode (see
+# services/peers.py). With `fast_path` the app is wrapped in
+# services/fast_path.py like in main.py.
+
+import multiprocessing
+import socket
+import time
+
+
+def _serve(port, worker_class, threads, workers, upstream_url, shared_cache_path, fast, peer_urls):
+    from flask import Flask
+    from gunicorn.app.base import BaseApplication
+    from concurrent.futures import ThreadPoolExecutor
+    import services.day_ahead_prices as dap
+    import services.solar_forecast as sf
+    import services.temperatures as temps
+    from services import shared_cache, peers, fast_path
+    from tests.fixtures import T0
+
+    dap.dap_records = {'de_lu_15min': dap.make_record(T0, list(range(96)), T0 + 13 * 3600)}
+    temps.OPEN_METEO_BASE_URL = upstream_url
+    temps._cache.clear()
+    sf._cache.clear()
+    # The pool threads of the test process were not forked
+    temps._pool = ThreadPoolExecutor(max_workers=temps.UPSTREAM_CONCURRENCY, thread_name_prefix='temperatures')
+    temps._peer_pool = ThreadPoolExecutor(max_workers=temps.UPSTREAM_CONCURRENCY, thread_name_prefix='temperatures-peer')
+    if shared_cache_path:
+        shared_cache.enable(shared_cache_path)
+    peers.configure('http://127.0.0.1:{0}'.format(port), peer_urls)
+    app = Flask(__name__)
+    for blueprint in (dap.day_ahead_prices_api, temps.temperatures_api, sf.solar_forecast_api):
+        app.register_blueprint(blueprint)
+    if peers.enabled():
+        app.register_blueprint(peers.peers_api)
+    if fast:
+        app.wsgi_app = fast_path.FastPath(app.wsgi_app)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in (('bind', '127.0.0.1:{0}'.format(port)), ('workers', workers),
+                               ('worker_class', worker_class), ('threads', threads),
+                               ('worker_connections', 1000), ('timeout', 60), ('loglevel', 'error')):
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+class GunicornServer:
+    def __init__(self, worker_class, upstream_url, threads=16, workers=1, shared_cache=None, fast_path=False):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.url = 'http://127.0.0.1:{0}'.format(self.port)
+        self.peers = None
+        self._args = (self.port, worker_class, threads, workers, upstream_url, shared_cache, fast_path)
+
+    def __enter__(self):
+        self._process = multiprocessing.get_context('fork').Process(
+            target=_serve, args=self._args + (self.peers,), daemon=True)
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                if time.monotonic() > deadline or not self._process.is_alive():
+                    self.__exit__()
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join(10)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the Open-Meteo DWD ICON temperature API.
+#
+# Answers hourly=temperature_2m requests for one location or, like the real
+# API, a list of them (comma separated latitude and longitude, the answer is
+# then a JSON array). The series starts at UTC midnight and has 24 values per
+# forecast day, the temperatures are generated from the coordinates. Every
+# request can be delayed by `latency` seconds, and the server counts
+# requests, locations and the highest number of requests that were in flight
+# at the same time. Requests with more than `max_locations` locations or one
+# of the locations in `refused` are answered with 400.
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+T0 = 1760400000  # 2025-10-14T00:00Z
+
+
+def location(lat, lon, days):
+    times = [T0 + h * 3600 for h in range(24 * days)]
+    temps = [round(10 + (lat % 7) - abs(h % 24 - 14) / 2 + (lon % 3) / 10, 1) for h in range(24 * days)]
+    return {'latitude': lat, 'longitude': lon, 'utc_offset_seconds': 0, 'timezone': 'GMT',
+            'hourly': {'time': times, 'temperature_2m': temps}}
+
+
+class OpenMeteoStandIn:
+    def __init__(self, latency=0.0, max_locations=1000):
+        self.latency = latency
+        self.max_locations = max_locations
+        self.refused = set()
+        self.requests = 0
+        self.locations = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/v1/dwd-icon'.format(self._server.server_address[1])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, handler):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            query = parse_qs(urlparse(handler.path).query)
+            lats = [float(v) for v in query['latitude'][0].split(',')]
+            lons = [float(v) for v in query['longitude'][0].split(',')]
+            days = int(query.get('forecast_days', ['7'])[0])
+            if len(lats) != len(lons) or len(lats) > self.max_locations:
+                status, data = 400, {'error': True, 'reason': 'Invalid number of locations'}
+            elif self.refused.intersection(zip(lats, lons)):
+                status, data = 400, {'error': True, 'reason': 'No data is available for this location'}
+            else:
+                status = 200
+                data = [location(lat, lon, days) for lat, lon in zip(lats, lons)]
+                if len(data) == 1:
+                    data = data[0]
+                with self._lock:
+                    self.locations += len(lats)
+            body = json.dumps(data).encode()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# The original pandas/ElementTree implementation of
+# services.day_ahead_prices.parse_timeseries. It is kept as the reference the
+# streaming parser is checked against (tests/test_day_ahead_prices.py) and
+# benchmarked against (benchmarks/bench_parser.py).
+
+import re
+from xml.etree import ElementTree
+
+import pandas as pd
+
+
+def reference_parse_timeseries(xml_text, resolution, value_key='price.amount'):
+    resolution_map = {
+        'PT60M': pd.Timedelta(60, 'min'),
+        'P1Y'  : pd.Timedelta(365,'day'),
+        'PT15M': pd.Timedelta(15, 'min'),
+        'PT30M': pd.Timedelta(30, 'min'),
+        'P1D'  : pd.Timedelta(1,  'day'),
+        'P7D'  : pd.Timedelta(7,  'day'),
+        'P1M'  : pd.Timedelta(30, 'day'),
+    }
+    pdres       = resolution_map[resolution]
+    time_stamps = []
+    values      = []
+    xml_text    = re.sub(' xmlns="[^"]+"', '', xml_text, count=1) #Remove namespace
+    root        = ElementTree.fromstring(xml_text)
+    for time_serie in root.findall('TimeSeries'):
+        #curve_type = time_serie.find('curveType').text
+        for period in time_serie.findall('Period'):
+            start_time = pd.Timestamp(period.find('timeInterval').find('start').text)
+            if period.find('resolution').text == resolution:
+                for point in period.findall('Point'):
+                    position = int(point.find('position').text)-1
+                    value    = float(point.find(value_key).text)
+                    time_stamps.append(start_time+position*pdres)
+                    values.append(value)
+
+    # Fill ts with missing values
+    ts = pd.Series(data=values,index=time_stamps)
+    if len(ts) == 0:
+        return ts
+
+    # Deduplicate labels. We could also use ts.groupby(ts.index).mean()
+    # Currently the data just seems to be duplicated with same prices for AT... no idea what is going on.
+    ts = ts[~ts.index.duplicated(keep='first')]
+    return ts.resample(pdres).ffill()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+from services import binary_format, temperatures
+from tests.test_solar_forecast import make_open_meteo_response
+
+NOW = 1760400000
+BINARY = {'Accept': binary_format.MEDIA_TYPE}
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        values = [0, 1, -1, 63, -64, 64, -65, 8191, -8192, 2 ** 31 - 1, -2 ** 31, 5, 5, 5]
+        data = binary_format.encode_series(binary_format.KIND_PRICES, NOW, 15, values, NOW + 86400)
+        self.assertEqual(binary_format.decode_series(data), {
+            'kind': binary_format.KIND_PRICES, 'resolution': 15, 'first_date': NOW,
+            'next_date': NOW + 86400, 'values': values})
+
+    def test_layout(self):
+        data = binary_format.encode_series(binary_format.KIND_TEMPERATURES, 0x01020304, 60, [1, 3, 2])
+        self.assertEqual(data, b'W\x01\x02\x3c\x04\x03\x02\x01\x00\x00\x00\x00\x03\x00'
+                               b'\x02\x04\x01')
+
+    def test_small_deltas_one_byte(self):
+        values = [8000 + (i % 7) * 9 for i in range(192)]
+        data = binary_format.encode_series(binary_format.KIND_PRICES, NOW, 15, values)
+        self.assertEqual(len(data), 14 + 2 + 191)
+
+    def test_bad_magic(self):
+        data = bytearray(binary_format.encode_series(binary_format.KIND_PRICES, NOW, 15, [1]))
+        data[0] = ord('{')
+        with self.assertRaises(ValueError):
+            binary_format.decode_series(bytes(data))
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.app.register_blueprint(sf.solar_forecast_api)
+        self.app.register_blueprint(temperatures.temperatures_api)
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_X_POLL_BUCKET'] = '0'  # next_date as in the record
+        sf._cache.clear()
+        temperatures._cache.clear()
+        self.prices = [(i * 7919) % 20000 - 2000 for i in range(192)]
+        self.record = dap.make_record(NOW, self.prices, NOW + 86400)
+        records = patch.object(dap, 'dap_records', {'de_lu_15min': self.record})
+        records.start()
+        self.addCleanup(records.stop)
+
+    def test_prices(self):
+        for kwargs in ({'query_string': {'format': 'binary'}}, {'headers': BINARY}):
+            r = self.client.get('/v1/day_ahead_prices/de/15min', **kwargs)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Type'], binary_format.MEDIA_TYPE)
+            series = binary_format.decode_series(r.data)
+            self.assertEqual(series['values'], self.prices)
+            self.assertEqual((series['first_date'], series['next_date'], series['resolution']),
+                             (NOW, NOW + 86400, 15))
+
+    def test_prices_encoded_with_record(self):
+        with patch('services.binary_format.encode_series') as encode:
+            r = self.client.get('/v1/day_ahead_prices/de/15min?format=binary', headers={'Accept-Encoding': 'gzip'})
+        encode.assert_not_called()
+        self.assertNotIn('Content-Encoding', r.headers)
+        self.assertEqual(r.data, self.record.binary)
+        self.assertLess(len(r.data), len(self.record.body) / 2)
+
+    def test_json_stays_default(self):
+        for accept in (None, '*/*', 'application/json', 'application/json, {0};q=0.5'.format(binary_format.MEDIA_TYPE)):
+            headers = {'Accept': accept} if accept else {}
+            r = self.client.get('/v1/day_ahead_prices/de/15min', headers=headers)
+            self.assertEqual(r.headers['Content-Type'], 'application/json; charset=utf-8', accept)
+            self.assertEqual(r.data.decode(), self.record.body)
+
+    def test_prices_etag(self):
+        plain = self.client.get('/v1/day_ahead_prices/de/15min')
+        binary = self.client.get('/v1/day_ahead_prices/de/15min', headers=BINARY)
+        self.assertNotEqual(plain.headers['ETag'], binary.headers['ETag'])
+        self.assertEqual(binary.headers['Vary'], 'Accept, Accept-Encoding, X-Poll-Bucket')
+        r = self.client.get('/v1/day_ahead_prices/de/15min',
+                            headers=dict(BINARY, **{'If-None-Match': binary.headers['ETag']}))
+        self.assertEqual(r.status_code, 304)
+        r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'If-None-Match': binary.headers['ETag']})
+        self.assertEqual(r.status_code, 200)
+
+    def test_errors_stay_json(self):
+        r = self.client.get('/v1/day_ahead_prices/xx/15min?format=binary')
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('error', json.loads(r.data))
+
+    def test_solar_forecast(self):
+        url = '/v1/solar_forecast/51.0/8.0/30/0/5000'
+        with patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()):
+            native = json.loads(self.client.get(url).data)
+        with patch('services.solar_forecast.compute_forecast', wraps=sf.compute_forecast) as compute:
+            for _ in range(3):
+                r = self.client.get(url, headers=BINARY)
+                self.assertEqual(r.headers['Content-Type'], binary_format.MEDIA_TYPE)
+                series = binary_format.decode_series(r.data)
+                self.assertEqual(series['values'], native['forecast'])
+                self.assertEqual(series['kind'], binary_format.KIND_SOLAR_FORECAST)
+                self.assertEqual(series['first_date'], native['first_date'])
+        self.assertEqual(compute.call_count, 1)
+        r = self.client.get(url, headers=dict(BINARY, **{'If-None-Match': r.headers['ETag']}))
+        self.assertEqual(r.status_code, 304)
+
+    def test_estimate_json_only(self):
+        with patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()):
+            r = self.client.get('/estimate/51.0/8.0/30/0/5', headers=BINARY)
+        self.assertEqual(r.headers['Content-Type'], 'application/json; charset=utf-8')
+        json.loads(r.data)
+
+    def test_temperatures(self):
+        data = {'hourly': {'time': [NOW + i * 3600 for i in range(48)],
+                           'temperature_2m': [10.0 + (i % 5) * 0.3 - 12 for i in range(48)]}}
+        with patch('services.temperatures.fetch_temperature_forecast', return_value=data):
+            plain = json.loads(self.client.get('/v1/temperatures/52.52/13.41').data)
+            r = self.client.get('/v1/temperatures/52.52/13.41?format=binary')
+            self.assertEqual(r.headers['Content-Type'], binary_format.MEDIA_TYPE)
+            series = binary_format.decode_series(r.data)
+            self.assertEqual(series['kind'], binary_format.KIND_TEMPERATURES)
+            self.assertEqual((series['first_date'], series['values']), (plain['first_date'], plain['temperatures']))
+            r = self.client.get('/v1/temperatures/52.52/13.41?format=binary',
+                                headers={'If-None-Match': r.headers['ETag']})
+            self.assertEqual(r.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
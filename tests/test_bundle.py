@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import unittest
+from unittest.mock import patch
+from urllib.error import URLError
+import json
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import bundle
+from tests.fixtures import T0, fake_temperatures, fake_irradiance
+
+
+class BundleTestBase(unittest.TestCase):
+    def setUp(self):
+        self.record = dap.make_record(T0, list(range(96)), T0 + 13 * 3600)
+        for p in (patch.object(dap, 'dap_records', {'de_lu_15min': self.record}),
+                  patch.object(temps, 'fetch_temperature_forecast', side_effect=fake_temperatures),
+                  patch.object(sf, 'fetch_irradiance', side_effect=fake_irradiance)):
+            self.addCleanup(p.stop)
+            setattr(self, p.attribute, p.start())
+        sf._cache.clear()
+        temps._cache.clear()
+        self.app = Flask(__name__)
+        self.app.register_blueprint(bundle.bundle_api)
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_X_POLL_BUCKET'] = '0'  # next_date as in the record
+
+    def get(self, url, status=200, **kwargs):
+        r = self.client.get(url, **kwargs)
+        self.assertEqual(r.status_code, status, r.data)
+        return r
+
+
+class TestBundle(BundleTestBase):
+
+    def test_prices_only(self):
+        d = self.get('/v1/bundle/de/15min').get_json()
+        self.assertEqual(list(d), ['next_date', 'prices'])
+        self.assertEqual(d['prices']['prices'], list(range(96)))
+        self.assertEqual(d['prices']['first_date'], T0)
+        self.assertEqual(d['next_date'], self.record.next_date)
+        self.fetch_temperature_forecast.assert_not_called()
+
+    def test_all_parts(self):
+        d = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000&plane=45,-90,2000').get_json()
+        self.assertEqual(d['temperatures']['first_date'], T0)
+        self.assertEqual(d['temperatures']['temperatures'], [100 + h for h in range(48)])
+        self.assertEqual(len(d['solar_forecast']), 2)
+        for part, (dec, az, wp) in zip(d['solar_forecast'], ((30, 0, 5000), (45, -90, 2000))):
+            entry = sf._cache[sf._cache_key(51.9, 8.6, dec, az)]
+            self.assertEqual((part['dec'], part['az'], part['wp']), (dec, az, wp))
+            self.assertEqual(part['forecast'], sf.compute_forecast(entry, wp))
+            self.assertEqual(part['updated'], int(entry['fetched']))
+            self.assertGreater(part['next_date'], entry['fetched'] + sf.CACHE_TTL_SECONDS - 1)
+        self.assertEqual(d['next_date'], min(d['prices']['next_date'], d['temperatures']['next_date'],
+                                             *(p['next_date'] for p in d['solar_forecast'])))
+
+    def test_forecasts_from_cache(self):
+        url = '/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000'
+        r = self.get(url)
+        self.get(url, 304, headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(self.fetch_irradiance.call_count, 1)
+        self.assertEqual(self.fetch_temperature_forecast.call_count, 1)
+
+    def slow_upstream(self):
+        """Make the fetches take 0.1 s and return the list of running fetches at each start."""
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow(fn):
+            def call(*args):
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.1)
+                with lock:
+                    running.pop()
+                return fn(*args)
+            return call
+
+        self.fetch_temperature_forecast.side_effect = slow(fake_temperatures)
+        self.fetch_irradiance.side_effect = slow(fake_irradiance)
+        return peak
+
+    def test_upstream_calls_in_parallel(self):
+        peak = self.slow_upstream()
+        self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000&plane=45,-90,2000&plane=20,90,1000')
+        self.assertEqual(max(peak), 4)
+
+    def test_bundles_in_parallel(self):
+        peak = self.slow_upstream()
+        url = '/v1/bundle/de/15min?lat={0}&lon=8.6' + '&plane=30,0,5000&plane=45,-90,2000&plane=20,90,1000&plane=60,0,500'
+        threads = [threading.Thread(target=self.app.test_client().get, args=(url.format(50 + i),)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(peak), 3 * (1 + bundle.MAX_PLANES))
+
+    def test_failed_part(self):
+        self.fetch_temperature_forecast.side_effect = URLError('down')
+        d = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000').get_json()
+        self.assertEqual(d['temperatures'], {'error': 'Weather service unavailable'})
+        self.assertEqual(d['prices']['prices'], list(range(96)))
+        self.assertEqual(len(d['solar_forecast'][0]['forecast']), sf.HORIZON_HOURS)
+        self.assertLessEqual(d['next_date'], time.time() + bundle.ERROR_RETRY_SECONDS)
+
+    def test_unexpected_part_error(self):
+        self.fetch_temperature_forecast.side_effect = TimeoutError('timed out')
+        self.fetch_irradiance.side_effect = Exception("Open-Meteo API returned status 503")
+        with self.assertLogs(bundle.logger, level='ERROR'):
+            d = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000').get_json()
+        self.assertEqual(d['temperatures'], {'error': 'Weather service unavailable'})
+        self.assertEqual(d['solar_forecast'], [{'error': 'Forecast service unavailable'}])
+        self.assertEqual(d['prices']['prices'], list(range(96)))
+
+    def test_no_prices_yet(self):
+        with patch.object(dap, 'dap_records', {}):
+            d = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6').get_json()
+        self.assertEqual(d['prices'], {'error': 'Data not found'})
+        self.assertIn('temperatures', d)
+
+    def test_not_modified(self):
+        r = self.get('/v1/bundle/de/15min')
+        self.get('/v1/bundle/de/15min', 304, headers={'If-None-Match': r.headers['ETag']})
+
+    def test_compressed(self):
+        r = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        plain = self.get('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0,5000')
+        self.assertEqual(gzip.decompress(r.data), plain.data)
+
+    def test_errors(self):
+        for url, error in (('/v1/bundle/xx/15min', 'Country not supported'),
+                           ('/v1/bundle/de/5min', 'Resolution not supported'),
+                           ('/v1/bundle/de/15min?lat=51.9', 'lat and lon are both required'),
+                           ('/v1/bundle/de/15min?lat=91&lon=8', 'lat or lon out of range'),
+                           ('/v1/bundle/de/15min?plane=30,0,5000', 'plane requires lat and lon'),
+                           ('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=30,0', 'plane must be <dec>,<az>,<wp>'),
+                           ('/v1/bundle/de/15min?lat=51.9&lon=8.6&plane=95,0,5000', 'Declination must be between 0 and 90'),
+                           ('/v1/bundle/de/15min?lat=51.9&lon=8.6' + '&plane=30,0,5000' * 5, 'At most 4 planes')):
+            r = self.get(url, 400)
+            self.assertEqual(r.get_json()['error'], error, url)
+        self.fetch_temperature_forecast.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
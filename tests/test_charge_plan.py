@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import json
+import random
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from services.charge_plan import charge_plan_api, solve
+from tests.fixtures import T0
+
+
+class TestSolve(unittest.TestCase):
+
+    def test_cheapest_slots_first(self):
+        charged, grid = solve([30, 10, 20, 40], [100] * 4, [0] * 4, 150)
+        self.assertEqual(list(charged), [0, 100, 50, 0])
+        self.assertEqual(list(grid), [0, 100, 50, 0])
+
+    def test_pv_used_first(self):
+        charged, grid = solve([30, 10, 20, 40], [100] * 4, [0, 0, 0, 60], 150)
+        self.assertEqual(list(charged), [0, 90, 0, 60])
+        self.assertEqual(list(grid), [0, 90, 0, 0])
+
+    def test_pv_capped_by_capacity(self):
+        charged, grid = solve([10, 10], [50, 50], [80, 0], 100)
+        self.assertEqual(list(charged), [50, 50])
+        self.assertEqual(list(grid), [0, 50])
+
+    def test_negative_price_before_pv(self):
+        charged, grid = solve([-5, 10], [100, 100], [0, 100], 100)
+        self.assertEqual(list(charged), [100, 0])
+
+    def test_negative_price_grid_before_pv(self):
+        charged, grid = solve([-1000, 500], [1000, 1000], [1000, 0], 1000)
+        self.assertEqual(list(charged), [1000, 0])
+        self.assertEqual(list(grid), [1000, 0])
+
+    def test_ties_prefer_earlier_slot(self):
+        charged, _ = solve([10, 10, 10], [100] * 3, [0] * 3, 150)
+        self.assertEqual(list(charged), [100, 50, 0])
+
+    def test_not_enough_capacity(self):
+        charged, _ = solve([10, 20], [100, 100], [0, 0], 500)
+        self.assertEqual(list(charged), [100, 100])
+
+    def test_optimal(self):
+        """Test that no random feasible allocation is cheaper."""
+        rng = random.Random(7)
+        for _ in range(20):
+            n = 12
+            prices = [rng.randint(-1000, 30000) for _ in range(n)]
+            capacity = [rng.choice([0, 2750, 2750, 5500]) for _ in range(n)]
+            pv = [rng.choice([0, 0, 1000, 4000]) for _ in range(n)]
+            energy = rng.uniform(0, sum(capacity))
+            charged, grid = solve(prices, capacity, pv, energy)
+            self.assertAlmostEqual(charged.sum(), energy, places=6)
+            best = sum(p * g for p, g in zip(prices, grid))
+            for _ in range(50):
+                # random feasible allocation: fill slots in random order
+                left, cost = energy, 0
+                for i in rng.sample(range(n), n):
+                    c = min(capacity[i], left)
+                    cost += prices[i] * max(0, c - pv[i])
+                    left -= c
+                self.assertLessEqual(best, cost + 1e-6)
+
+
+class TestChargePlanAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(charge_plan_api)
+        self.client = self.app.test_client()
+        prices = [10000] * 96
+        prices[8:12] = [2000] * 4     # 02:00-03:00 cheap
+        prices[48:52] = [1000] * 4    # 12:00-13:00 cheaper
+        self.record = dap.make_record(T0, prices, T0 + 86400)
+
+    def get(self, query, now=T0):
+        with patch.object(dap, 'dap_records', {'de_lu_15min': self.record}), \
+             patch('services.charge_plan.time.time', return_value=now):
+            r = self.client.get('/v1/charge_plan/de/15min?' + query)
+        return r.status_code, json.loads(r.data)
+
+    def test_plan(self):
+        status, d = self.get('energy=11000&power=11000&deadline={0}'.format(T0 + 86400))
+        self.assertEqual(status, 200)
+        self.assertEqual(d['first_date'], T0)
+        self.assertEqual(d['resolution'], 15)
+        self.assertEqual(len(d['power']), 96)
+        self.assertEqual(d['power'][48:52], [11000] * 4)
+        self.assertEqual(sum(d['power']), 11000 * 4)
+        self.assertEqual(d['energy'], 11000)
+        self.assertEqual(d['pv_energy'], 0)
+        self.assertEqual(d['cost'], 1100)  # 11 kWh at 10 EUR/MWh = 0.11 EUR
+        self.assertEqual(d['next_date'], T0 + 86400)
+
+    def test_deadline_and_current_slot(self):
+        # 7.5 minutes into the first slot, deadline before the cheapest hour
+        status, d = self.get('energy=22000&power=11000&deadline={0}'.format(T0 + 12 * 3600),
+                             now=T0 + 450)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(d['power']), 48)
+        self.assertEqual(d['power'][8:12], [11000] * 4)
+        self.assertEqual(d['energy'], 22000)
+        # the rest comes from 10000 ct/MWh slots, starting with the half slot now
+        self.assertEqual(d['power'][0], 11000)
+
+    def test_pv(self):
+        entry = {'first_date': T0, 'utc_offset': 7200, 'gti': [], 'place': 'x'}
+        forecast = [0] * 24
+        forecast[10] = 8000  # 8 kWh between 10:00 and 11:00
+        with patch('services.solar_forecast.get_cached_irradiance', return_value=entry), \
+             patch('services.solar_forecast.compute_forecast', return_value=forecast):
+            status, d = self.get('energy=11000&power=11000&deadline={0}&lat=52.5&lon=13.4&dec=30&az=0&wp=10000'
+                                 .format(T0 + 86400))
+        self.assertEqual(status, 200)
+        self.assertEqual(d['pv_energy'], 8000)
+        self.assertEqual(d['power'][40:44], [8000] * 4)
+        self.assertEqual(d['energy'], 11000)
+        self.assertEqual(d['cost'], 300)
+
+    def test_pv_unavailable(self):
+        query = 'energy=11000&power=11000&deadline={0}&lat=52.5&lon=13.4&dec=30&az=0&wp=10000'.format(T0 + 86400)
+        for error in (TimeoutError('timed out'), OSError('reset'), KeyError('hourly')):
+            with patch('services.solar_forecast.get_cached_irradiance', side_effect=error), \
+                 self.assertLogs('services.charge_plan', level='ERROR'):
+                status, d = self.get(query)
+            self.assertEqual(status, 503)
+            self.assertEqual(d, {'error': 'Forecast service unavailable'})
+
+    def test_errors(self):
+        deadline = 'deadline={0}'.format(T0 + 3600)
+        for query in ('power=11000&' + deadline,
+                      'energy=x&power=11000&' + deadline,
+                      'energy=-1&power=11000&' + deadline,
+                      'energy=1000&power=0&' + deadline,
+                      'energy=1000&power=11000',
+                      'energy=1000&power=11000&deadline={0}'.format(T0 - 1),
+                      'energy=1000&power=11000&lat=52&' + deadline,
+                      'energy=1000&power=11000&lat=100&lon=13&dec=30&az=0&wp=1000&' + deadline):
+            status, d = self.get(query)
+            self.assertEqual(status, 400, query)
+            self.assertIn('error', d)
+
+        with patch.object(dap, 'dap_records', {}):
+            r = self.client.get('/v1/charge_plan/de/15min?energy=1000&power=1000&' + deadline)
+        self.assertEqual(r.status_code, 404)
+        r = self.client.get('/v1/charge_plan/fr/15min?energy=1000&power=1000&' + deadline)
+        self.assertEqual(r.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,21 +7,24 @@ from unittest.mock import patch
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import pandas as pd
+from array import array
 import services.day_ahead_prices as dap
+from tests.fixtures import today
 
 
 class TestDayAheadHealth(unittest.TestCase):
     def setUp(self):
         dap._health.clear()
+        key = patch.object(dap, 'ENTSOE_KEY', 'test-key')
+        key.start()
+        self.addCleanup(key.stop)
 
     def test_entsoe_source_recorded(self):
-        series = pd.Series([0.05] * 96)  # full day of 15min data
+        series = (today(), array('q', [5] * 96))  # full day of 15min data
         with patch.object(dap, 'get_dayahead_prices', return_value=series):
-            res = dap.update_day_ahead_prices('10YAT-APG------L', 'PT15M',
-                                              dap.DAY_AHEAD_PRICE_AT_15MIN)
+            res = dap.update_day_ahead_prices(dap._zones_by_country['at'], 'at_15min')
         self.assertIsNotNone(res)
-        h = dap._health[dap.DAY_AHEAD_PRICE_AT_15MIN]
+        h = dap._health['at_15min']
         self.assertEqual(h['source_used'], 'entsoe')
         self.assertEqual(h['entsoe_entries'], 96)
         self.assertFalse(h['fallback_attempted'])
@@ -30,13 +33,12 @@ class TestDayAheadHealth(unittest.TestCase):
         self.assertIsNone(h['last_error'])
 
     def test_fallback_used_recorded(self):
-        series = pd.Series([0.05] * 10)  # too few -> triggers fallback
+        series = (today(), array('q', [5] * 10))  # too few -> triggers fallback
         with patch.object(dap, 'get_dayahead_prices', return_value=series), \
              patch.object(dap, 'fallback_get_prices_de_lu', return_value=[5.0] * 96):
-            res = dap.update_day_ahead_prices('10Y1001A1001A82H', 'PT15M',
-                                              dap.DAY_AHEAD_PRICE_DE_LU_15MIN)
+            res = dap.update_day_ahead_prices(dap._zones_by_country['de'], 'de_lu_15min')
         self.assertIsNotNone(res)
-        h = dap._health[dap.DAY_AHEAD_PRICE_DE_LU_15MIN]
+        h = dap._health['de_lu_15min']
         self.assertTrue(h['fallback_attempted'])
         self.assertEqual(h['fallback_entries'], 96)
         self.assertEqual(h['source_used'], 'fallback')
@@ -44,15 +46,22 @@ class TestDayAheadHealth(unittest.TestCase):
 
     def test_error_recorded(self):
         with patch.object(dap, 'get_dayahead_prices', side_effect=Exception("boom")):
-            res = dap.update_day_ahead_prices('10YAT-APG------L', 'PT15M',
-                                              dap.DAY_AHEAD_PRICE_AT_15MIN)
+            res = dap.update_day_ahead_prices(dap._zones_by_country['at'], 'at_15min')
         self.assertIsNone(res)
-        h = dap._health[dap.DAY_AHEAD_PRICE_AT_15MIN]
+        h = dap._health['at_15min']
         self.assertIn('boom', h['last_error'])
         self.assertIsNotNone(h['last_error_at'])
         self.assertEqual(h['consecutive_failures'], 1)
         self.assertIsNone(h['source_used'])
 
+    def test_missing_key_recorded(self):
+        with patch.object(dap, 'ENTSOE_KEY', None), \
+             patch.object(dap, 'ENTSOE_KEY_FILE', '/nonexistent/entsoe.key'):
+            res = dap.update_day_ahead_prices(dap._zones_by_country['at'], 'at_15min')
+        self.assertIsNone(res)
+        h = dap._health['at_15min']
+        self.assertIn('FileNotFoundError', h['last_error'])
+
     def test_get_health_structure(self):
         report = dap.get_health()
         self.assertIn('de_lu_15min', report)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from array import array
+import services.day_ahead_prices as dap
+from tests.fixtures import today
+
+NAME = 'de_lu_15min'
+
+
+class TestHedgedFetch(unittest.TestCase):
+    """ENTSO-E raced against the fallback for de_lu."""
+
+    def setUp(self):
+        dap._health.clear()
+        self.zone = dap._zones_by_country['de']
+        key = patch.object(dap, 'ENTSOE_KEY', 'test-key')
+        key.start()
+        self.addCleanup(key.stop)
+        self.fallback_calls = 0
+
+    def entsoe(self, entries, delay=0.0, error=None):
+        def fetch(key, eic, start, end, resolution, stats):
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            stats["bytes"] += 1000
+            return today(), array('q', [1] * entries)
+        return patch.object(dap, 'get_dayahead_prices', side_effect=fetch)
+
+    def fallback(self, entries, delay=0.0):
+        def fetch(start):
+            self.fallback_calls += 1
+            time.sleep(delay)
+            return [2.0] * entries
+        return patch.object(dap, 'fallback_get_prices_de_lu', side_effect=fetch)
+
+    def update(self, hour_reached):
+        # 0: always after the hour, 24: never
+        with patch.object(dap, 'TOMORROW_EXPECTED_HOUR', 0 if hour_reached else 24):
+            t0 = time.monotonic()
+            record = dap.update_day_ahead_prices(self.zone, NAME)
+            return record, time.monotonic() - t0
+
+    def test_fallback_faster_after_hour(self):
+        with self.entsoe(192, delay=0.5), self.fallback(192):
+            record, elapsed = self.update(True)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(record.prices[0], 200)
+        h = dap._health[NAME]
+        self.assertEqual(h['source_used'], 'fallback')
+        self.assertTrue(h['hedged'])
+        self.assertEqual(h['fallback_wins'], 1)
+        self.assertEqual(h['entsoe_wins'], 0)
+        self.assertIsNotNone(h['fallback_latency_ms'])
+
+    def test_entsoe_faster_after_hour(self):
+        with self.entsoe(192), self.fallback(192, delay=0.5):
+            record, elapsed = self.update(True)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(record.prices[0], 1)
+        h = dap._health[NAME]
+        self.assertEqual(h['source_used'], 'entsoe')
+        self.assertEqual(h['fetch_mode'], 'full')
+        self.assertEqual(h['entsoe_wins'], 1)
+        self.assertTrue(h['fallback_attempted'])
+
+    def test_incomplete_first_answer_waits_for_other(self):
+        with self.entsoe(192, delay=0.2), self.fallback(96):
+            record, _ = self.update(True)
+        self.assertEqual(len(record.prices), 192)
+        self.assertEqual(dap._health[NAME]['source_used'], 'entsoe')
+        self.assertEqual(dap._health[NAME]['fallback_entries'], 96)
+
+    def test_longest_used_if_none_complete(self):
+        with self.entsoe(96), self.fallback(100, delay=0.1):
+            record, _ = self.update(True)
+        self.assertEqual(len(record.prices), 100)
+        self.assertEqual(dap._health[NAME]['source_used'], 'fallback')
+
+    def test_entsoe_error_after_hour(self):
+        with self.entsoe(0, error=Exception("boom")), self.fallback(192):
+            record, _ = self.update(True)
+        self.assertIsNotNone(record)
+        self.assertEqual(dap._health[NAME]['source_used'], 'fallback')
+
+    def test_entsoe_error_before_hour(self):
+        with self.entsoe(0, error=Exception("boom")), self.fallback(96):
+            record, _ = self.update(False)
+        self.assertIsNotNone(record)
+        self.assertEqual(self.fallback_calls, 1)
+        self.assertEqual(dap._health[NAME]['source_used'], 'fallback')
+
+    def test_losing_download_counted(self):
+        with self.entsoe(192, delay=0.3), self.fallback(192):
+            self.update(True)
+            h = dap._health[NAME]
+            self.assertEqual((h['bytes_downloaded'], h['bytes_downloaded_total']), (0, 0))
+            time.sleep(0.5)
+        self.assertEqual(dap._health[NAME]['bytes_downloaded_total'], 1000)
+        with self.entsoe(192), self.fallback(192, delay=0.3):
+            self.update(True)
+        h = dap._health[NAME]
+        self.assertEqual((h['bytes_downloaded'], h['bytes_downloaded_total']), (1000, 2000))
+
+    def test_no_hedge_before_hour_without_history(self):
+        with self.entsoe(96, delay=0.1), self.fallback(96):
+            record, _ = self.update(False)
+        self.assertEqual(self.fallback_calls, 0)
+        h = dap._health[NAME]
+        self.assertFalse(h['hedged'])
+        self.assertEqual(h['source_used'], 'entsoe')
+        self.assertIsNotNone(h['entsoe_latency_ms'])
+        self.assertIsNone(h['entsoe_latency_p95_ms'])
+
+    def test_incomplete_entsoe_before_hour_tries_fallback(self):
+        with self.entsoe(10), self.fallback(96):
+            record, _ = self.update(False)
+        self.assertEqual(self.fallback_calls, 1)
+        h = dap._health[NAME]
+        self.assertEqual(h['source_used'], 'fallback')
+        self.assertFalse(h['hedged'])
+
+    def test_slower_than_p95_starts_fallback(self):
+        with self.entsoe(96, delay=0.01), self.fallback(96):
+            for _ in range(dap.HEDGE_MIN_SAMPLES):
+                self.update(False)
+        self.assertEqual(self.fallback_calls, 0)
+        self.assertIsNotNone(dap._health[NAME]['entsoe_latency_p95_ms'])
+
+        with self.entsoe(96, delay=0.5), self.fallback(96):
+            record, elapsed = self.update(False)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(self.fallback_calls, 1)
+        h = dap._health[NAME]
+        self.assertTrue(h['hedged'])
+        self.assertEqual(h['source_used'], 'fallback')
+        self.assertEqual(h['fallback_wins'], 1)
+
+    def test_other_zones_not_hedged(self):
+        with self.entsoe(96), self.fallback(96):
+            dap.update_day_ahead_prices(dap._zones_by_country['at'], 'at_15min')
+        self.assertEqual(self.fallback_calls, 0)
+        self.assertIsNotNone(dap._health['at_15min']['entsoe_latency_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
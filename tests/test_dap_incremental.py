@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta, timezone
+import services.day_ahead_prices as dap
+from tests.entsoe_standin import EntsoeStandIn
+
+NAME = 'at_15min'
+
+
+class TestMergePrices(unittest.TestCase):
+
+    def test_append(self):
+        self.assertEqual(dap.merge_prices(0, [1, 2], 1800, [3, 4], 'PT15M'), [1, 2, 3, 4])
+
+    def test_overlap_unchanged(self):
+        self.assertEqual(dap.merge_prices(0, [1, 2, 3], 900, [2, 3, 4, 5], 'PT15M'), [1, 2, 3, 4, 5])
+
+    def test_new_series_starts_earlier(self):
+        self.assertEqual(dap.merge_prices(900, [2, 3], 0, [1, 2, 3, 4], 'PT15M'), [2, 3, 4])
+        self.assertEqual(dap.merge_prices(900, [], 0, [1, 2, 3], 'PT15M'), [2, 3])
+
+    def test_overlap_changed(self):
+        with self.assertRaises(ValueError):
+            dap.merge_prices(0, [1, 2, 3], 900, [2, 7, 4], 'PT15M')
+
+    def test_gap(self):
+        with self.assertRaises(ValueError):
+            dap.merge_prices(0, [1, 2], 2700, [4], 'PT15M')
+
+    def test_not_aligned(self):
+        with self.assertRaises(ValueError):
+            dap.merge_prices(0, [1, 2], 1000, [3], 'PT15M')
+
+
+class TestIncrementalFetch(unittest.TestCase):
+    """Updates against the ENTSO-E stand-in with an already known record."""
+
+    def setUp(self):
+        self.zone = dap._zones_by_country['at']
+        self.start = datetime.now(dap.BERLIN).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start_ts = int(self.start.timestamp())
+        self.tomorrow = (self.start + timedelta(days=1)).astimezone(timezone.utc)
+        # Tomorrow's prices are published, nothing after that
+        self.published_until = (self.start + timedelta(days=2)).astimezone(timezone.utc)
+        key = patch.object(dap, 'ENTSOE_KEY', 'test-key')
+        key.start()
+        self.addCleanup(key.stop)
+        dap._health.clear()
+
+    def fetch(self, standin, known):
+        with patch.object(dap, 'ENTSOE_API_URL', standin.url):
+            return dap.update_day_ahead_prices(self.zone, NAME, known)
+
+    def full(self):
+        """Today and tomorrow, fetched without a known record."""
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            record = self.fetch(standin, None)
+        self.assertEqual(len(record.prices), 192)
+        self.assertEqual(dap._health[NAME]['fetch_mode'], 'full')
+        return record, standin.bytes_sent
+
+    def test_only_missing_day_is_downloaded(self):
+        full, full_bytes = self.full()
+        known = dap.make_record(self.start_ts, full.prices[:96], self.start_ts + 3600)
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            record = self.fetch(standin, known)
+        self.assertEqual(record.prices, full.prices)
+        self.assertEqual(record.first_date, self.start_ts)
+        self.assertEqual(standin.last_query['periodStart'], [self.tomorrow.strftime('%Y%m%d%H00')])
+        h = dap._health[NAME]
+        self.assertEqual(h['fetch_mode'], 'incremental')
+        self.assertEqual(h['bytes_downloaded'], standin.bytes_sent)
+        self.assertLess(h['bytes_downloaded'], full_bytes * 0.6)
+        self.assertEqual(h['bytes_downloaded_total'], full_bytes + standin.bytes_sent)
+
+    def test_yesterday_is_dropped(self):
+        full, _ = self.full()
+        yesterday = [1] * 96
+        known = dap.make_record(self.start_ts - 86400, yesterday + list(full.prices[:96]), self.start_ts)
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            record = self.fetch(standin, known)
+        self.assertEqual(record.first_date, self.start_ts)
+        self.assertEqual(record.prices, full.prices)
+
+    def test_overlap_is_validated(self):
+        """Test that whole-day answers overlapping the known points are checked."""
+        full, _ = self.full()
+        known = dap.make_record(self.start_ts, full.prices[:50], self.start_ts + 3600)
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            record = self.fetch(standin, known)
+        self.assertEqual(record.prices, full.prices)
+        self.assertEqual(dap._health[NAME]['fetch_mode'], 'incremental')
+        self.assertEqual(dap._health[NAME]['overlap_mismatches'], 0)
+
+    def test_changed_overlap_triggers_full_fetch(self):
+        full, _ = self.full()
+        known = dap.make_record(self.start_ts, full.prices[:50], self.start_ts + 3600)
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            standin.price_offset = 1
+            record = self.fetch(standin, known)
+        self.assertEqual(standin.requests, 2)
+        self.assertEqual(len(record.prices), len(full.prices))
+        for new, old in zip(record.prices, full.prices):
+            self.assertAlmostEqual(new, old + 100, delta=1)  # parser truncates to centicent
+        h = dap._health[NAME]
+        self.assertEqual(h['fetch_mode'], 'full')
+        self.assertEqual(h['overlap_mismatches'], 1)
+
+    def test_nothing_new_published(self):
+        full, _ = self.full()
+        known = dap.make_record(self.start_ts, full.prices[:96], self.start_ts + 3600)
+        with EntsoeStandIn(published_until=self.tomorrow) as standin:
+            record = self.fetch(standin, known)
+        self.assertEqual(record.prices, full.prices[:96])
+        self.assertEqual(dap._health[NAME]['fetch_mode'], 'incremental')
+
+    def test_stale_record_fetches_everything(self):
+        full, _ = self.full()
+        known = dap.make_record(self.start_ts - 2 * 86400, [1] * 96, self.start_ts - 86400)
+        with EntsoeStandIn(published_until=self.published_until) as standin:
+            record = self.fetch(standin, known)
+        self.assertEqual(record.prices, full.prices)
+        self.assertEqual(dap._health[NAME]['fetch_mode'], 'full')
+
+    def leading_gap(self, known, gap=3600):
+        """Fetch with a document that starts gap seconds after midnight."""
+        data = list(range(gap // 900, 192))
+
+        def get_dayahead_prices(key, eic, start, end, resolution, stats):
+            return self.start_ts + gap, data
+        with patch.object(dap, 'get_dayahead_prices', side_effect=get_dayahead_prices):
+            return dap.update_day_ahead_prices(self.zone, NAME, known)
+
+    def test_leading_gap_from_known_record(self):
+        # 99 differs from the document, so the incremental fetch fails
+        known = dap.make_record(self.start_ts - 86400, [1] * 96 + [-1, -2, -3, -4, 99], self.start_ts)
+        record = self.leading_gap(known)
+        self.assertEqual(record.first_date, self.start_ts)
+        self.assertEqual(record.prices, (-1, -2, -3, -4) + tuple(range(4, 192)))
+        self.assertEqual(dap._health[NAME]['fetch_mode'], 'full')
+
+    def test_leading_gap_trimmed(self):
+        for known in (None, dap.make_record(self.start_ts - 86400, [1] * 98, self.start_ts)):
+            record = self.leading_gap(known)
+            self.assertEqual(record.first_date, self.start_ts + 3600)
+            self.assertEqual(record.prices, tuple(range(4, 192)))
+            self.assertEqual(dap._health[NAME]['first_date'], self.start_ts + 3600)
+        # from the next full hour on
+        record = self.leading_gap(None, 2700)
+        self.assertEqual(record.first_date, self.start_ts + 3600)
+        self.assertEqual(record.prices, tuple(range(4, 192)))
+
+    def test_update_passes_known_record(self):
+        known = dap.make_record(self.start_ts, [1] * 96, self.start_ts)
+        with patch.object(dap, 'dap_records', {NAME: known}), \
+             patch.object(dap, 'ZONES', (self.zone,)), \
+             patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=None) as fetch, \
+             patch.object(dap, 'archive'), patch.object(dap, 'save_snapshot'):
+            dap.update()
+        fetch.assert_called_once_with(self.zone, NAME, known)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+from flask import Flask
+import services.day_ahead_prices as dap
+from services import price_archive
+from tests.entsoe_standin import EntsoeStandIn
+
+
+class TestZoneLoad(unittest.TestCase):
+    """Updates many zones against a local ENTSO-E stand-in."""
+
+    NUM_ZONES = 40
+    LATENCY = 0.2
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        saved_zones = dap.ZONES
+        self.addCleanup(dap.load_registry, saved_zones)
+        self.zones = [dap.Zone('z{0:02d}'.format(i), '10YTEST-{0:07d}'.format(i), ('z{0:02d}'.format(i),))
+                      for i in range(self.NUM_ZONES)]
+        dap.load_registry(self.zones)
+        for p in (patch.object(dap, 'dap_records', {}),
+                  patch.object(dap, 'ENTSOE_KEY', 'test-key'),
+                  patch.object(dap, 'SNAPSHOT_FILE', os.path.join(self.tmpdir.name, 'snapshot.json')),
+                  patch.object(dap, 'WARP_DB_FILE', os.path.join(self.tmpdir.name, 'warp.db'))):
+            p.start()
+            self.addCleanup(p.stop)
+        dap._health.clear()
+
+    def tearDown(self):
+        price_archive._local.conns = {}
+        self.tmpdir.cleanup()
+
+    def test_parallel_update(self):
+        """Test that all zones are fetched in parallel, bounded by UPDATE_CONCURRENCY."""
+        with EntsoeStandIn(latency=self.LATENCY) as standin, \
+             patch.object(dap, 'ENTSOE_API_URL', standin.url):
+            t0 = time.monotonic()
+            dap.update()
+            elapsed = time.monotonic() - t0
+
+        self.assertEqual(standin.requests, self.NUM_ZONES)
+        self.assertLessEqual(standin.max_in_flight, dap.UPDATE_CONCURRENCY)
+        self.assertGreater(standin.max_in_flight, 1)
+        # sequential would take NUM_ZONES * LATENCY = 8 s
+        self.assertLess(elapsed, self.NUM_ZONES * self.LATENCY / 2)
+
+        self.assertEqual(len(dap.dap_records), self.NUM_ZONES * 3)
+        for name, _, _ in dap.daps():
+            self.assertEqual(dap._health[name]['consecutive_failures'], 0, name)
+
+        app = Flask(__name__)
+        app.register_blueprint(dap.day_ahead_prices_api)
+        client = app.test_client()
+        for zone in self.zones:
+            for resolution, n in (('15min', 192), ('30min', 96), ('60min', 48)):
+                r = client.get('/v1/day_ahead_prices/{0}/{1}'.format(zone.countries[0], resolution))
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(len(json.loads(r.data)['prices']), n)
+
+        with open(dap.SNAPSHOT_FILE) as f:
+            self.assertEqual(len(json.load(f)['records']), self.NUM_ZONES * 3)
+
+    def test_failing_zone_does_not_block_others(self):
+        """Test that a zone that keeps failing does not hold back the others."""
+        broken = self.zones[0].eic
+        get = dap.get_dayahead_prices
+
+        def flaky(api_key, area_code, *args):
+            if area_code == broken:
+                raise OSError("simulated outage")
+            return get(api_key, area_code, *args)
+
+        with EntsoeStandIn() as standin, \
+             patch.object(dap, 'ENTSOE_API_URL', standin.url), \
+             patch.object(dap, 'get_dayahead_prices', side_effect=flaky), \
+             patch.object(dap.time, 'sleep'):
+            dap.update()
+
+        self.assertNotIn('z00_15min', dap.dap_records)
+        self.assertEqual(len(dap.dap_records), (self.NUM_ZONES - 1) * 3)
+        self.assertEqual(dap._health['z00_15min']['consecutive_failures'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
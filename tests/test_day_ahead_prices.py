@@ -18,7 +18,7 @@ class TestDayAheadPricesAPI(unittest.TestCase):
     """Unit tests for the day_ahead_prices API endpoint."""
 
     def setUp(self):
-        """Set up test client with mocked dap_list."""
+        """Set up test client with mocked dap_records."""
         # Import inside setUp to allow patching
         from services.day_ahead_prices import day_ahead_prices_api, DAY_AHEAD_PRICE_NOT_FOUND
 
@@ -47,7 +47,7 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_unsupported_resolution(self):
         """Test that unsupported resolution returns 400 error."""
-        response = self.client.get('/v1/day_ahead_prices/de/30min')
+        response = self.client.get('/v1/day_ahead_prices/de/5min')
         self.assertEqual(response.status_code, 400)
         data = json.loads(response.data)
         self.assertEqual(data['error'], 'Resolution not supported')
@@ -61,7 +61,7 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_country_case_insensitive(self):
         """Test that country parameter is case insensitive."""
-        with patch('services.day_ahead_prices.dap_list', self._mock_dap_list()):
+        with patch('services.day_ahead_prices.dap_records', self._mock_dap_records()):
             # Test uppercase
             response = self.client.get('/v1/day_ahead_prices/DE/15min')
             self.assertEqual(response.status_code, 200)
@@ -72,7 +72,7 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_resolution_case_insensitive(self):
         """Test that resolution parameter is case insensitive."""
-        with patch('services.day_ahead_prices.dap_list', self._mock_dap_list()):
+        with patch('services.day_ahead_prices.dap_records', self._mock_dap_records()):
             # Test uppercase
             response = self.client.get('/v1/day_ahead_prices/de/15MIN')
             self.assertEqual(response.status_code, 200)
@@ -87,8 +87,8 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_de_15min_returns_correct_data(self):
         """Test that DE 15min returns data from correct index."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/15min')
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data)
@@ -97,8 +97,8 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_lu_15min_returns_same_as_de(self):
         """Test that LU 15min returns same data as DE (same market)."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response_de = self.client.get('/v1/day_ahead_prices/de/15min')
             response_lu = self.client.get('/v1/day_ahead_prices/lu/15min')
 
@@ -108,8 +108,8 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_de_60min_returns_correct_data(self):
         """Test that DE 60min returns data from correct index."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/60min')
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data)
@@ -118,17 +118,29 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_at_15min_returns_correct_data(self):
         """Test that AT 15min returns data from correct index."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/at/15min')
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data)
             self.assertEqual(data['first_date'], 1700000000)
 
+    def test_30min_returns_correct_data(self):
+        """Test that the 30min views are served."""
+        from services.day_ahead_prices import make_record
+        mock_list = self._mock_dap_records()
+        mock_list['de_lu_30min'] = make_record(1700000000, [1050], 1700100000)
+        with patch('services.day_ahead_prices.dap_records', mock_list):
+            response = self.client.get('/v1/day_ahead_prices/de/30min')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['prices'], [1050])
+            response = self.client.get('/v1/day_ahead_prices/at/30min')
+            self.assertEqual(response.status_code, 200)
+
     def test_at_60min_returns_correct_data(self):
         """Test that AT 60min returns data from correct index."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/at/60min')
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data)
@@ -140,15 +152,15 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_response_content_type(self):
         """Test that response has correct content type."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/15min')
             self.assertEqual(response.content_type, 'application/json; charset=utf-8')
 
     def test_response_structure(self):
         """Test that successful response has correct structure."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/15min')
             data = json.loads(response.data)
 
@@ -162,8 +174,8 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_prices_are_integers(self):
         """Test that all prices in response are integers (centicents)."""
-        mock_list = self._mock_dap_list()
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = self._mock_dap_records()
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/15min')
             data = json.loads(response.data)
 
@@ -176,25 +188,51 @@ class TestDayAheadPricesAPI(unittest.TestCase):
 
     def test_data_not_found_returns_404(self):
         """Test that missing data returns 404 error."""
-        from services.day_ahead_prices import DAY_AHEAD_PRICE_NOT_FOUND
-        mock_list = [DAY_AHEAD_PRICE_NOT_FOUND] * 4
-        with patch('services.day_ahead_prices.dap_list', mock_list):
+        mock_list = {}
+        with patch('services.day_ahead_prices.dap_records', mock_list):
             response = self.client.get('/v1/day_ahead_prices/de/15min')
             self.assertEqual(response.status_code, 404)
             data = json.loads(response.data)
             self.assertEqual(data['error'], 'Data not found')
 
+    # -------------------------------------------------------------------------
+    # Conditional GET Tests
+    # -------------------------------------------------------------------------
+
+    def test_etag_not_modified(self):
+        """Test that a matching If-None-Match is answered with an empty 304."""
+        with patch('services.day_ahead_prices.dap_records', self._mock_dap_records()):
+            response = self.client.get('/v1/day_ahead_prices/de/15min')
+            etag = response.headers['ETag']
+            self.assertTrue(etag.startswith('"'))
+
+            for header in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+                response = self.client.get('/v1/day_ahead_prices/de/15min', headers={'If-None-Match': header})
+                self.assertEqual(response.status_code, 304, header)
+                self.assertEqual(response.data, b'')
+                self.assertEqual(response.headers['ETag'], etag)
+
+    def test_etag_changes_with_record(self):
+        """Test that new prices are sent despite the old ETag."""
+        from services.day_ahead_prices import make_record
+        with patch('services.day_ahead_prices.dap_records', self._mock_dap_records()):
+            etag = self.client.get('/v1/day_ahead_prices/de/15min').headers['ETag']
+        changed = make_record(1700000000, [1000, 1100, 1200, 1400], 1700100000)
+        with patch('services.day_ahead_prices.dap_records', {'de_lu_15min': changed}):
+            response = self.client.get('/v1/day_ahead_prices/de/15min', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertEqual(json.loads(response.data)['prices'][3], 1400)
+
     # -------------------------------------------------------------------------
     # Helper Methods
     # -------------------------------------------------------------------------
 
-    def _mock_dap_list(self):
-        """Create a mock dap_list with valid data for all indices."""
-        valid_response = (
-            '{"first_date":1700000000,"prices":[1000,1100,1200,1300],"next_date":1700100000}',
-            200
-        )
-        return [valid_response] * 4
+    def _mock_dap_records(self):
+        """Create mock dap_records with valid data for all served records."""
+        from services.day_ahead_prices import daps, make_record
+        valid = make_record(1700000000, [1000, 1100, 1200, 1300], 1700100000)
+        return {name: valid for name, _, _ in daps()}
 
 
 class TestParseTimeseries(unittest.TestCase):
@@ -211,13 +249,11 @@ class TestParseTimeseries(unittest.TestCase):
             ('4', '12.00'),
         ])
 
-        result = parse_timeseries(xml_text, 'PT15M')
+        first_ts, result = parse_timeseries(xml_text, 'PT15M')
 
+        self.assertEqual(first_ts, 1704067200)  # 2024-01-01T00:00Z
         self.assertEqual(len(result), 4)
-        self.assertAlmostEqual(result.iloc[0], 10.50)
-        self.assertAlmostEqual(result.iloc[1], 11.00)
-        self.assertAlmostEqual(result.iloc[2], 11.50)
-        self.assertAlmostEqual(result.iloc[3], 12.00)
+        self.assertEqual(list(result), [1050, 1100, 1150, 1200])
 
     def test_parse_60min_resolution(self):
         """Test parsing XML with 60-minute resolution."""
@@ -228,11 +264,20 @@ class TestParseTimeseries(unittest.TestCase):
             ('2', '55.00'),
         ])
 
-        result = parse_timeseries(xml_text, 'PT60M')
+        _, result = parse_timeseries(xml_text, 'PT60M')
+
+        self.assertEqual(list(result), [5000, 5500])
+
+    def test_parse_ignores_other_resolution(self):
+        """Test that periods with a different resolution are skipped."""
+        from services.day_ahead_prices import parse_timeseries
+
+        xml_text = self._create_mock_xml('PT60M', [('1', '50.00')])
+
+        first_ts, result = parse_timeseries(xml_text, 'PT15M')
 
-        self.assertEqual(len(result), 2)
-        self.assertAlmostEqual(result.iloc[0], 50.00)
-        self.assertAlmostEqual(result.iloc[1], 55.00)
+        self.assertIsNone(first_ts)
+        self.assertEqual(len(result), 0)
 
     def test_parse_empty_xml(self):
         """Test parsing XML with no data points."""
@@ -242,8 +287,9 @@ class TestParseTimeseries(unittest.TestCase):
         <Publication_MarketDocument>
         </Publication_MarketDocument>'''
 
-        result = parse_timeseries(xml_text, 'PT15M')
+        first_ts, result = parse_timeseries(xml_text, 'PT15M')
 
+        self.assertIsNone(first_ts)
         self.assertEqual(len(result), 0)
 
     def test_parse_removes_namespace(self):
@@ -266,7 +312,7 @@ class TestParseTimeseries(unittest.TestCase):
             </TimeSeries>
         </Publication_MarketDocument>'''
 
-        result = parse_timeseries(xml_text, 'PT15M')
+        _, result = parse_timeseries(xml_text, 'PT15M')
 
         self.assertEqual(len(result), 1)
 
@@ -303,11 +349,64 @@ class TestParseTimeseries(unittest.TestCase):
             </TimeSeries>
         </Publication_MarketDocument>'''
 
-        result = parse_timeseries(xml_text, 'PT15M')
+        _, result = parse_timeseries(xml_text, 'PT15M')
 
         # Should keep first occurrence
         self.assertEqual(len(result), 1)
-        self.assertAlmostEqual(result.iloc[0], 10.00)
+        self.assertEqual(result[0], 1000)
+
+    def test_parse_fills_gaps(self):
+        """Test that missing positions repeat the previous value."""
+        from services.day_ahead_prices import parse_timeseries
+
+        xml_text = self._create_mock_xml('PT15M', [
+            ('1', '10.00'),
+            ('4', '40.00'),
+        ])
+
+        _, result = parse_timeseries(xml_text, 'PT15M')
+
+        self.assertEqual(list(result), [1000, 1000, 1000, 4000])
+
+    def test_parse_a03_fills_to_period_end(self):
+        """Test that A03 compressed points are repeated up to the end of the period."""
+        from services.day_ahead_prices import parse_timeseries
+
+        xml_text = '''<?xml version="1.0" encoding="UTF-8"?>
+        <Publication_MarketDocument>
+            <TimeSeries>
+                <curveType>A03</curveType>
+                <Period>
+                    <timeInterval>
+                        <start>2024-01-01T00:00Z</start>
+                        <end>2024-01-01T02:00Z</end>
+                    </timeInterval>
+                    <resolution>PT15M</resolution>
+                    <Point>
+                        <position>1</position>
+                        <price.amount>10.00</price.amount>
+                    </Point>
+                    <Point>
+                        <position>3</position>
+                        <price.amount>-5.25</price.amount>
+                    </Point>
+                </Period>
+            </TimeSeries>
+        </Publication_MarketDocument>'''
+
+        first_ts, result = parse_timeseries(xml_text, 'PT15M')
+
+        self.assertEqual(first_ts, 1704067200)
+        self.assertEqual(list(result), [1000, 1000] + [-525] * 6)
+
+    def test_parse_accepts_bytes(self):
+        """Test that the raw response body can be passed without decoding."""
+        from services.day_ahead_prices import parse_timeseries
+
+        xml_text = self._create_mock_xml('PT15M', [('1', '10.50')])
+
+        self.assertEqual(parse_timeseries(xml_text.encode(), 'PT15M'),
+                         parse_timeseries(xml_text, 'PT15M'))
 
     def _create_mock_xml(self, resolution, points):
         """Create mock ENTSO-E XML response."""
@@ -333,93 +432,100 @@ class TestParseTimeseries(unittest.TestCase):
         </Publication_MarketDocument>'''
 
 
+class TestParseTimeseriesCorpus(unittest.TestCase):
+    """Compare parse_timeseries against the original pandas implementation
+    on the ENTSO-E documents in tests/data/entsoe."""
+
+    CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'entsoe')
+
+    def test_same_result_as_reference(self):
+        from services.day_ahead_prices import parse_timeseries
+        from tests.reference_parser import reference_parse_timeseries
+
+        files = sorted(f for f in os.listdir(self.CORPUS_DIR) if f.endswith('.xml'))
+        self.assertGreater(len(files), 0)
+        for name in files:
+            with open(os.path.join(self.CORPUS_DIR, name), encoding='utf-8') as f:
+                xml_text = f.read()
+            for resolution in ('PT15M', 'PT60M'):
+                with self.subTest(document=name, resolution=resolution):
+                    expected = reference_parse_timeseries(xml_text, resolution)
+                    first_ts, prices = parse_timeseries(xml_text, resolution)
+                    if len(expected) == 0:
+                        self.assertIsNone(first_ts)
+                        self.assertEqual(len(prices), 0)
+                        continue
+                    self.assertEqual(first_ts, int(expected.index[0].timestamp()))
+                    # The reference drops the compressed tail of A03 periods,
+                    # everything it does return has to match exactly.
+                    self.assertGreaterEqual(len(prices), len(expected))
+                    self.assertEqual(list(prices[:len(expected)]), [int(i*100) for i in expected.to_list()])
+
+
 class TestIsUpdateNecessary(unittest.TestCase):
     """Unit tests for the is_update_necessary function."""
 
     def test_update_necessary_when_none(self):
-        """Test that update is necessary when dap is None."""
+        """Test that update is necessary when there is no record."""
         from services.day_ahead_prices import is_update_necessary
 
         result = is_update_necessary(None, 26)
         self.assertTrue(result)
 
-    def test_update_necessary_when_not_tuple(self):
-        """Test that update is necessary when dap is not a tuple."""
+    def test_update_necessary_when_not_record(self):
+        """Test that update is necessary when the entry is not a PriceRecord."""
         from services.day_ahead_prices import is_update_necessary
 
-        result = is_update_necessary("not a tuple", 26)
+        result = is_update_necessary("not a record", 26)
         self.assertTrue(result)
 
     def test_update_necessary_when_not_found(self):
-        """Test that update is necessary when dap is NOT_FOUND."""
+        """Test that update is necessary when the entry is NOT_FOUND."""
         from services.day_ahead_prices import is_update_necessary, DAY_AHEAD_PRICE_NOT_FOUND
 
         result = is_update_necessary(DAY_AHEAD_PRICE_NOT_FOUND, 26)
         self.assertTrue(result)
 
-    def test_update_necessary_when_malformed_json(self):
-        """Test that update is necessary when JSON is malformed."""
-        from services.day_ahead_prices import is_update_necessary
-
-        malformed = ('{"invalid": "json"}', 200)
-        result = is_update_necessary(malformed, 26)
-        self.assertTrue(result)
-
     def test_update_necessary_when_price_list_too_small(self):
         """Test that update is necessary when price list is too small."""
-        from services.day_ahead_prices import is_update_necessary
+        from services.day_ahead_prices import is_update_necessary, make_record
 
         # Create data with only 10 prices, but require 26
         future_date = int((datetime.now() + timedelta(hours=2)).timestamp())
-        small_list = (
-            f'{{"first_date":1700000000,"prices":[1,2,3,4,5,6,7,8,9,10],"next_date":{future_date}}}',
-            200
-        )
+        small_list = make_record(1700000000, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10], future_date)
 
         result = is_update_necessary(small_list, 26)
         self.assertTrue(result)
 
     def test_update_necessary_when_next_date_passed(self):
         """Test that update is necessary when next_date has passed."""
-        from services.day_ahead_prices import is_update_necessary
+        from services.day_ahead_prices import is_update_necessary, make_record
 
         # Set next_date to the past
         past_date = int((datetime.now() - timedelta(hours=1)).timestamp())
-        prices = [100] * 30  # Enough prices
-        past_data = (
-            f'{{"first_date":1700000000,"prices":{json.dumps(prices)},"next_date":{past_date}}}',
-            200
-        )
+        past_data = make_record(1700000000, [100] * 30, past_date)  # Enough prices
 
         result = is_update_necessary(past_data, 26)
         self.assertTrue(result)
 
     def test_no_update_when_data_fresh(self):
         """Test that no update is needed when data is fresh."""
-        from services.day_ahead_prices import is_update_necessary
+        from services.day_ahead_prices import is_update_necessary, make_record
 
         # Set next_date to far future
         future_date = int((datetime.now() + timedelta(hours=5)).timestamp())
-        prices = [100] * 30  # Enough prices
-        fresh_data = (
-            f'{{"first_date":1700000000,"prices":{json.dumps(prices)},"next_date":{future_date}}}',
-            200
-        )
+        fresh_data = make_record(1700000000, [100] * 30, future_date)  # Enough prices
 
         result = is_update_necessary(fresh_data, 26)
         self.assertFalse(result)
 
     def test_update_checks_30_min_before_next_date(self):
         """Test that update triggers 30 minutes before next_date."""
-        from services.day_ahead_prices import is_update_necessary
+        from services.day_ahead_prices import is_update_necessary, make_record
 
         # Set next_date to 20 minutes from now (should trigger because of 30 min buffer)
         near_future = int((datetime.now() + timedelta(minutes=20)).timestamp())
-        prices = [100] * 30
-        data = (
-            f'{{"first_date":1700000000,"prices":{json.dumps(prices)},"next_date":{near_future}}}',
-            200
-        )
+        data = make_record(1700000000, [100] * 30, near_future)
 
         result = is_update_necessary(data, 26)
         self.assertTrue(result)
@@ -428,42 +534,44 @@ class TestIsUpdateNecessary(unittest.TestCase):
 class TestUpdateDayAheadPricesWithRetry(unittest.TestCase):
     """Unit tests for the update_day_ahead_prices_with_retry function."""
 
+    ZONE = ('TEST', 'PT15M')
+
     def test_returns_on_first_success(self):
         """Test that function returns immediately on success."""
-        from services.day_ahead_prices import update_day_ahead_prices_with_retry
+        from services.day_ahead_prices import update_day_ahead_prices_with_retry, make_record
 
-        mock_result = ('{"first_date":1700000000,"prices":[100],"next_date":1700100000}', 200)
+        mock_result = make_record(1700000000, [100], 1700100000)
 
         with patch('services.day_ahead_prices.update_day_ahead_prices', return_value=mock_result):
             with patch('services.day_ahead_prices.time.sleep') as mock_sleep:
-                result = update_day_ahead_prices_with_retry('TEST', 'PT15M', retries=5)
+                result = update_day_ahead_prices_with_retry(self.ZONE, retries=5)
 
                 self.assertEqual(result, mock_result)
                 mock_sleep.assert_not_called()
 
     def test_retries_on_failure(self):
         """Test that function retries on failure."""
-        from services.day_ahead_prices import update_day_ahead_prices_with_retry
+        from services.day_ahead_prices import update_day_ahead_prices_with_retry, make_record
 
-        mock_result = ('{"first_date":1700000000,"prices":[100],"next_date":1700100000}', 200)
+        mock_result = make_record(1700000000, [100], 1700100000)
 
         # Fail twice, then succeed
         with patch('services.day_ahead_prices.update_day_ahead_prices',
                    side_effect=[None, None, mock_result]):
             with patch('services.day_ahead_prices.time.sleep'):
-                result = update_day_ahead_prices_with_retry('TEST', 'PT15M', retries=5)
+                result = update_day_ahead_prices_with_retry(self.ZONE, retries=5)
 
                 self.assertEqual(result, mock_result)
 
-    def test_returns_not_found_after_max_retries(self):
-        """Test that function returns NOT_FOUND after max retries."""
-        from services.day_ahead_prices import update_day_ahead_prices_with_retry, DAY_AHEAD_PRICE_NOT_FOUND
+    def test_returns_none_after_max_retries(self):
+        """Test that function returns None after max retries."""
+        from services.day_ahead_prices import update_day_ahead_prices_with_retry
 
         with patch('services.day_ahead_prices.update_day_ahead_prices', return_value=None):
             with patch('services.day_ahead_prices.time.sleep'):
-                result = update_day_ahead_prices_with_retry('TEST', 'PT15M', retries=3)
+                result = update_day_ahead_prices_with_retry(self.ZONE, retries=3)
 
-                self.assertEqual(result, DAY_AHEAD_PRICE_NOT_FOUND)
+                self.assertIsNone(result)
 
     def test_sleep_increases_with_retries(self):
         """Test that sleep time increases with each retry."""
@@ -471,7 +579,7 @@ class TestUpdateDayAheadPricesWithRetry(unittest.TestCase):
 
         with patch('services.day_ahead_prices.update_day_ahead_prices', return_value=None):
             with patch('services.day_ahead_prices.time.sleep') as mock_sleep:
-                update_day_ahead_prices_with_retry('TEST', 'PT15M', retries=4)
+                update_day_ahead_prices_with_retry(self.ZONE, retries=4)
 
                 # Sleep should be called with 0, 60, 120, 180 (60*retry)
                 calls = [call[0][0] for call in mock_sleep.call_args_list]
@@ -479,30 +587,563 @@ class TestUpdateDayAheadPricesWithRetry(unittest.TestCase):
 
 
 class TestDaps(unittest.TestCase):
-    """Unit tests for the daps generator function."""
-
-    def test_daps_yields_expected_countries(self):
-        """Test that daps yields the expected country configurations."""
-        from services.day_ahead_prices import daps, DAY_AHEAD_PRICE_DE_LU_15MIN, DAY_AHEAD_PRICE_AT_15MIN
+    """Unit tests for the bidding zone registry."""
 
-        result = list(daps())
+    def test_daps_yields_expected_records(self):
+        """Test that daps yields the expected record names."""
+        from services.day_ahead_prices import daps
 
-        # Check that we have entries for DE_LU and AT
-        indices = [r[0] for r in result]
-        self.assertIn(DAY_AHEAD_PRICE_DE_LU_15MIN, indices)
-        self.assertIn(DAY_AHEAD_PRICE_AT_15MIN, indices)
+        names = [r[0] for r in daps()]
+        for name in ('de_lu_15min', 'de_lu_30min', 'de_lu_60min', 'at_15min', 'at_30min', 'at_60min',
+                     'nl_15min', 'be_15min', 'ch_60min', 'dk1_15min', 'se4_15min', 'no5_15min',
+                     'fi_15min', 'it_north_15min', 'it_sard_60min'):
+            self.assertIn(name, names)
+        self.assertEqual(len(names), len(set(names)))
 
     def test_daps_country_codes(self):
         """Test that daps uses correct ENTSO-E country codes."""
         from services.day_ahead_prices import daps
 
-        result = list(daps())
-        country_codes = [r[1] for r in result]
+        area_codes = [r[1].eic for r in daps()]
 
         # DE_LU area code
-        self.assertIn('10Y1001A1001A82H', country_codes)
+        self.assertIn('10Y1001A1001A82H', area_codes)
         # AT area code
-        self.assertIn('10YAT-APG------L', country_codes)
+        self.assertIn('10YAT-APG------L', area_codes)
+
+    def test_routes(self):
+        """Test that every country/resolution pair routes to its zone's record."""
+        import services.day_ahead_prices as dap
+        self.assertEqual(dap._routes[('de', '15min')], 'de_lu_15min')
+        self.assertEqual(dap._routes[('lu', '60min')], 'de_lu_60min')
+        self.assertEqual(dap._routes[('it-north', '30min')], 'it_north_30min')
+        self.assertEqual(dap._routes[('ch', '60min')], 'ch_60min')
+        # CH is only available hourly
+        self.assertNotIn(('ch', '15min'), dap._routes)
+        names = {name for name, _, _ in dap.daps()}
+        self.assertEqual(set(dap._routes.values()), names)
+
+    def test_only_de_lu_uses_fallback(self):
+        from services.day_ahead_prices import ZONES
+        self.assertEqual([z.name for z in ZONES if z.fallback], ['de_lu'])
+
+    def test_resolution_not_offered_by_zone(self):
+        from services.day_ahead_prices import day_ahead_prices_api
+        app = Flask(__name__)
+        app.register_blueprint(day_ahead_prices_api)
+        response = app.test_client().get('/v1/day_ahead_prices/ch/15min')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], 'Resolution not supported')
+
+
+class TestSnapshot(unittest.TestCase):
+    """Unit tests for persisting and restoring the served price data."""
+
+    VALID_BODY = '{"first_date":1700000000,"prices":[1000,1100],"next_date":1700100000}'
+
+    def setUp(self):
+        import tempfile
+        import services.day_ahead_prices as dap
+        self.dap = dap
+        self.VALID = dap.make_record(1700000000, [1000, 1100], 1700100000)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'snapshot.json')
+        for p in (patch.object(dap, 'dap_records', {}), patch.object(dap, '_snapshot_version', 0),
+                  patch.object(dap, '_snapshot_seen', None)):
+            p.start()
+            self.addCleanup(p.stop)
+        dap._health.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip(self):
+        """Test that saved data is served again after loading."""
+        dap = self.dap
+        dap.dap_records = {'de_lu_15min': self.VALID}
+        dap.save_snapshot(self.path)
+
+        dap.dap_records = {}
+        self.assertEqual(dap.load_snapshot(self.path), 1)
+        self.assertEqual(dap.dap_records['de_lu_15min'], self.VALID)
+        self.assertEqual(dap.dap_records['de_lu_15min'].body, self.VALID_BODY)
+        self.assertNotIn('at_15min', dap.dap_records)
+        h = dap._health['de_lu_15min']
+        self.assertEqual(h['source_used'], 'snapshot')
+        self.assertEqual(h['num_prices'], 2)
+
+    def test_missing_file(self):
+        """Test that a missing snapshot loads nothing."""
+        self.assertEqual(self.dap.load_snapshot(self.path), 0)
+
+    def test_malformed_entries_ignored(self):
+        """Test that broken entries are skipped and a broken file is tolerated."""
+        dap = self.dap
+        with open(self.path, 'w') as f:
+            json.dump({'de_lu_15min': '{"prices":[1]}', 'at_15min': self.VALID_BODY}, f)
+        self.assertEqual(dap.load_snapshot(self.path), 1)
+        self.assertNotIn('de_lu_15min', dap.dap_records)
+        self.assertEqual(dap.dap_records['at_15min'], self.VALID)
+
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(dap.load_snapshot(self.path), 0)
+
+    def test_update_saves_snapshot(self):
+        """Test that a successful update writes the snapshot."""
+        dap = self.dap
+        with patch.object(dap, 'SNAPSHOT_FILE', self.path), \
+             patch.object(dap, 'WARP_DB_FILE', os.path.join(self.tmpdir.name, 'warp.db')), \
+             patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=self.VALID):
+            dap.update()
+        with open(self.path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['version'], 1)
+        self.assertEqual(snapshot['records']['de_lu_15min'], self.VALID_BODY)
+        self.assertEqual(snapshot['records']['at_15min'], self.VALID_BODY)
+        self.assertEqual(snapshot['health']['de_lu_60min']['source_used'], 'derived')
+
+    def test_failed_update_keeps_old_data(self):
+        """Test that a failed update does not replace good data with a 404."""
+        dap = self.dap
+        dap.dap_records = {name: self.VALID for name, _, _ in dap.daps()}
+        with patch.object(dap, 'SNAPSHOT_FILE', self.path), \
+             patch.object(dap, 'WARP_DB_FILE', os.path.join(self.tmpdir.name, 'warp.db')), \
+             patch.object(dap, 'is_update_necessary', return_value=True), \
+             patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=None):
+            dap.update()
+        self.assertEqual(dap.dap_records['de_lu_15min'], self.VALID)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_reload_when_replaced(self):
+        """Test that another process's snapshot is loaded once it is replaced."""
+        dap = self.dap
+        self.assertEqual(dap.reload_snapshot(self.path), 0)
+        dap.dap_records = {'de_lu_15min': self.VALID}
+        dap.save_snapshot(self.path)  # version 1
+        dap.dap_records, dap._snapshot_version = {}, 0  # the other process
+        self.assertEqual(dap.reload_snapshot(self.path), 1)
+        self.assertEqual(dap.reload_snapshot(self.path), 0)
+
+        newer = dap.make_record(1700000000, [1000, 1200], 1700100000)
+        dap.dap_records = {'de_lu_15min': newer, 'at_15min': newer}
+        dap.save_snapshot(self.path)  # version 2
+        dap.dap_records, dap._snapshot_version = {'de_lu_15min': self.VALID}, 1
+        self.assertEqual(dap.reload_snapshot(self.path), 2)
+        self.assertEqual(dap.dap_records['at_15min'], newer)
+        self.assertEqual(dap.dap_records['de_lu_15min'], newer)
+
+    def test_older_version_ignored(self):
+        """Test that a follower does not go back to an older snapshot."""
+        dap = self.dap
+        newer = dap.make_record(1700000000, [1000, 1200], 1700100000)
+        dap.dap_records = {'de_lu_15min': self.VALID}
+        dap.save_snapshot(self.path)
+        os.replace(self.path, self.path + '.old')
+        dap.dap_records = {'de_lu_15min': newer}
+        dap.save_snapshot(self.path)
+        dap.dap_records, dap._snapshot_version = {}, 0  # the other process
+        self.assertEqual(dap.reload_snapshot(self.path), 1)
+        self.assertEqual(dap._snapshot_version, 2)
+
+        os.replace(self.path + '.old', self.path)
+        self.assertEqual(dap.reload_snapshot(self.path), 0)
+        self.assertEqual(dap.dap_records['de_lu_15min'], newer)
+
+    def test_follower_takes_health_keeps_records(self):
+        """Test that reloading takes over the writer's health and keeps unchanged records."""
+        dap = self.dap
+        dap.dap_records = {'de_lu_15min': self.VALID}
+        dap._health_for('de_lu_15min').update(source_used='entsoe', last_success=1700000000,
+                                              entsoe_latencies=(0.5,))
+        dap._health_for('at_15min').update(consecutive_failures=3, last_error='URLError: down')
+        dap.save_snapshot(self.path)
+
+        # Another process, serving the same de_lu record
+        served = dap.make_record(1700000000, [1000, 1100], 1700100000)
+        dap.dap_records = {'de_lu_15min': served}
+        dap._health.clear()
+        with patch.object(dap, '_snapshot_version', 0):
+            self.assertEqual(dap.reload_snapshot(self.path), 0)
+        self.assertIs(dap.dap_records['de_lu_15min'], served)
+        self.assertEqual(dap._health['de_lu_15min']['source_used'], 'entsoe')
+        self.assertEqual(dap._health['de_lu_15min']['last_success'], 1700000000)
+        self.assertEqual(dap._health['de_lu_15min']['entsoe_latencies'], ())
+        self.assertEqual(dap._health['at_15min']['consecutive_failures'], 3)
+
+    def test_one_updater(self):
+        """Test that only one holder of the updater lock is allowed."""
+        dap = self.dap
+        path = os.path.join(self.tmpdir.name, 'updater.lock')
+        with patch.object(dap, '_updater_lock', None):
+            self.assertTrue(dap.acquire_updater_lock(path))
+            self.assertTrue(dap.acquire_updater_lock(path))
+            lock = dap._updater_lock
+            # Another process opens the file on its own
+            with patch.object(dap, '_updater_lock', None):
+                self.assertFalse(dap.acquire_updater_lock(path))
+            lock.close()
+            with patch.object(dap, '_updater_lock', None):
+                self.assertTrue(dap.acquire_updater_lock(path))
+                dap._updater_lock.close()
+
+
+class TestDerivedResolutions(unittest.TestCase):
+    """60min and 30min prices are computed from the 15min series."""
+
+    CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'entsoe')
+
+    def test_aggregate_prices(self):
+        from services.day_ahead_prices import aggregate_prices
+        self.assertEqual(aggregate_prices([1, 2, 3, 4, 10, 10, 10, 11], 4), [2, 10])
+        self.assertEqual(aggregate_prices([1, 3, 5, 7], 2), [2, 6])
+        self.assertEqual(aggregate_prices([-4, -4, 0, 0], 4), [-2])
+        # incomplete trailing hour is dropped
+        self.assertEqual(aggregate_prices([1, 1, 1, 1, 5, 5], 4), [1])
+        self.assertEqual(aggregate_prices([], 4), [])
+
+    def test_matches_native_hourly_prices(self):
+        """Test that derived 60min prices match ENTSO-E's native hourly series."""
+        from services.day_ahead_prices import parse_timeseries, aggregate_prices
+        checked = 0
+        for name in sorted(os.listdir(self.CORPUS_DIR)):
+            if not name.endswith('.xml'):
+                continue
+            with open(os.path.join(self.CORPUS_DIR, name), 'rb') as f:
+                xml = f.read()
+            first60, native = parse_timeseries(xml, 'PT60M')
+            if first60 is None:
+                continue
+            first15, quarter_hours = parse_timeseries(xml, 'PT15M')
+            self.assertEqual(first15, first60)
+            derived = aggregate_prices(quarter_hours, 4)
+            self.assertEqual(len(derived), len(native))
+            for d, n in zip(derived, native):
+                # ENTSO-E rounds the hourly mean to 0.01 EUR/MWh (1 centicent)
+                self.assertLessEqual(abs(d - n), 2, name)
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_update_derives_without_extra_fetch(self):
+        """Test that one update serves 15, 30 and 60min from one fetch per zone."""
+        import tempfile
+        import services.day_ahead_prices as dap
+        record = dap.make_record(1700000000, list(range(0, 800, 10)), 1700100000)
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(dap, 'dap_records', {}), \
+             patch.object(dap, 'SNAPSHOT_FILE', os.path.join(tmp, 'snapshot.json')), \
+             patch.object(dap, 'WARP_DB_FILE', os.path.join(tmp, 'warp.db')), \
+             patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=record) as fetch:
+            dap.update()
+            self.assertEqual(fetch.call_count, len(dap.ZONES))  # one fetch per zone
+            self.assertEqual({c[0][0].resolution for c in fetch.call_args_list}, {'PT15M', 'PT60M'})
+            d60 = dap.dap_records['de_lu_60min']
+            d30 = dap.dap_records['at_30min']
+            self.assertNotIn('ch_30min', dap.dap_records)
+        self.assertEqual(d60.first_date, 1700000000)
+        self.assertEqual(d60.next_date, 1700100000)
+        self.assertEqual(list(d60.prices), [15 + 40 * i for i in range(20)])
+        self.assertEqual(list(d30.prices), [5 + 20 * i for i in range(40)])
+        self.assertEqual(json.loads(d30.body)['prices'], [5 + 20 * i for i in range(40)])
+
+
+class TestCheapestWindows(unittest.TestCase):
+    """The cheapest-window index and its endpoint."""
+
+    T0 = 1700000000 - 1700000000 % 3600
+
+    def setUp(self):
+        from services.day_ahead_prices import day_ahead_prices_api
+        self.app = Flask(__name__)
+        self.app.register_blueprint(day_ahead_prices_api)
+        self.client = self.app.test_client()
+
+    def brute_force(self, prices, width, start):
+        sums = [sum(prices[i:i + width]) for i in range(start, len(prices) - width + 1)]
+        return start + sums.index(min(sums))
+
+    def test_index_matches_brute_force(self):
+        import random
+        from services.day_ahead_prices import build_cheapest_index, CHEAPEST_HOURS
+        rng = random.Random(3)
+        prices = [rng.randint(-500, 30000) for _ in range(192)]
+        index = build_cheapest_index(prices, 900)
+        for hours in CHEAPEST_HOURS:
+            width = hours * 4
+            for start in (0, 1, 50, 100, 192 - width):
+                self.assertEqual(index.best[hours][start], self.brute_force(prices, width, start))
+
+    def test_percentiles(self):
+        from services.day_ahead_prices import build_cheapest_index
+        index = build_cheapest_index(list(range(1, 101)), 3600)
+        self.assertEqual(index.percentiles, (10, 25, 50, 75, 90))
+        self.assertEqual(build_cheapest_index([], 3600).percentiles, ())
+
+    def test_window_longer_than_series(self):
+        from services.day_ahead_prices import build_cheapest_index
+        index = build_cheapest_index([1] * 24, 3600)
+        self.assertIn(12, index.best)
+        index = build_cheapest_index([1] * 20, 900)
+        self.assertNotIn(6, index.best)
+        self.assertIn(5, index.best)
+
+    def get(self, url, record, now):
+        with patch('services.day_ahead_prices.dap_records', {'de_lu_15min': record}), \
+             patch('services.day_ahead_prices.time.time', return_value=now):
+            return self.client.get(url)
+
+    def test_endpoint(self):
+        from services.day_ahead_prices import make_record
+        prices = [1000] * 96
+        prices[8:12] = [100, 200, 300, 400]  # cheapest hour from 02:00
+        prices[40:44] = [50, 50, 50, 50]     # even cheaper at 10:00
+        record = make_record(self.T0, prices, self.T0 + 86400)
+
+        r = self.get('/v1/day_ahead_prices/de/15min/cheapest?hours=1', record, self.T0)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content_type, 'application/json; charset=utf-8')
+        d = json.loads(r.data)
+        self.assertEqual(d['first_date'], self.T0 + 10 * 3600)
+        self.assertEqual(d['last_date'], self.T0 + 11 * 3600)
+        self.assertEqual(d['average'], 50)
+        self.assertEqual(d['next_date'], self.T0 + 86400)
+        self.assertEqual(list(d['percentiles']), ['10', '25', '50', '75', '90'])
+        self.assertEqual(d['percentiles']['50'], 1000)
+
+        # Windows may start in the current slot, but not before
+        d = json.loads(self.get('/v1/day_ahead_prices/de/15min/cheapest?hours=1', record,
+                                self.T0 + 10 * 3600 + 60).data)
+        self.assertEqual(d['first_date'], self.T0 + 10 * 3600)
+        d = json.loads(self.get('/v1/day_ahead_prices/de/15min/cheapest?hours=1', record,
+                                self.T0 + 10 * 3600 + 900).data)
+        self.assertGreater(d['first_date'], self.T0 + 10 * 3600)
+
+    def test_endpoint_errors(self):
+        from services.day_ahead_prices import make_record
+        record = make_record(self.T0, [1000] * 96, self.T0 + 86400)
+        for hours in ('', '0', '13', 'x'):
+            r = self.get('/v1/day_ahead_prices/de/15min/cheapest?hours=' + hours, record, self.T0)
+            self.assertEqual(r.status_code, 400)
+        r = self.get('/v1/day_ahead_prices/de/15min/cheapest?hours=2', record, self.T0 + 23 * 3600)
+        self.assertEqual(r.status_code, 404)
+        r = self.get('/v1/day_ahead_prices/fr/15min/cheapest?hours=2', record, self.T0)
+        self.assertEqual(r.status_code, 400)
+        with patch('services.day_ahead_prices.dap_records', {}):
+            self.assertEqual(self.client.get('/v1/day_ahead_prices/de/15min/cheapest?hours=2').status_code, 404)
+
+
+class TestDeltaResponses(unittest.TestCase):
+    """Only the prices a client does not have yet are sent."""
+
+    T0 = 1700000000 - 1700000000 % 86400
+    URL = '/v1/day_ahead_prices/de/15min'
+
+    def setUp(self):
+        import services.day_ahead_prices as dap
+        self.dap = dap
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_X_POLL_BUCKET'] = '0'  # next_date as in the record
+        for p in (patch.object(dap, 'dap_records', {}), patch.object(dap, 'dap_history', {})):
+            p.start()
+            self.addCleanup(p.stop)
+        self.today = dap.make_record(self.T0, list(range(96)), self.T0 + 13 * 3600)
+        self.both = dap.make_record(self.T0, list(range(192)), self.T0 + 86400 + 13 * 3600)
+        self.tomorrow = dap.make_record(self.T0 + 86400, list(range(96, 192)), self.T0 + 86400 + 13 * 3600)
+
+    def publish(self, record):
+        self.dap._publish({'de_lu_15min': record})
+
+    def merge(self, held_first_date, held, delta):
+        """What a client does with a delta response."""
+        skip = (delta['first_date'] - held_first_date) // 900
+        return held[skip:skip + delta['keep']] + delta['prices']
+
+    def test_delta_keep(self):
+        from services.day_ahead_prices import delta_keep
+        self.assertEqual(delta_keep(self.both, 900, self.T0, 96), 96)
+        self.assertEqual(delta_keep(self.both, 900, self.T0, 192), 192)
+        self.assertEqual(delta_keep(self.tomorrow, 900, self.T0, 192), 96)
+        self.assertIsNone(delta_keep(self.both, 900, self.T0, 193))       # has more than served
+        self.assertIsNone(delta_keep(self.both, 900, self.T0 + 900, 10))   # starts later
+        self.assertIsNone(delta_keep(self.both, 900, self.T0 + 60, 10))    # not aligned
+        self.assertIsNone(delta_keep(self.tomorrow, 900, self.T0, 96))     # nothing left to keep
+
+    def test_tail_after_publication(self):
+        self.publish(self.today)
+        etag = self.client.get(self.URL).headers['ETag']
+        self.publish(self.both)
+        for query in ('?first_date={0}&count=96'.format(self.T0), '?known=' + etag):
+            r = self.client.get(self.URL + query)
+            self.assertEqual(r.status_code, 200)
+            d = json.loads(r.data)
+            self.assertEqual((d['first_date'], d['keep'], d['next_date']),
+                             (self.T0, 96, self.both.next_date))
+            self.assertEqual(d['prices'], list(range(96, 192)))
+            self.assertEqual(self.merge(self.T0, list(range(96)), d), list(self.both.prices))
+            self.assertLess(len(r.data), len(self.both.body) * 0.7)
+            # the client now holds the record, so it gets its ETag
+            self.assertEqual(r.headers['ETag'], '"' + self.both.etag + '"')
+
+    def test_day_rollover(self):
+        self.publish(self.both)
+        etag = self.client.get(self.URL).headers['ETag']
+        self.publish(self.tomorrow)
+        d = json.loads(self.client.get(self.URL + '?known=' + etag).data)
+        self.assertEqual((d['first_date'], d['keep'], d['prices']), (self.T0 + 86400, 96, []))
+        self.assertEqual(self.merge(self.T0, list(range(192)), d), list(self.tomorrow.prices))
+
+    def test_not_modified(self):
+        self.publish(self.both)
+        etag = self.client.get(self.URL).headers['ETag']
+        r = self.client.get(self.URL + '?known=' + etag, headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+
+    def test_compressed_etag_known(self):
+        self.publish(self.today)
+        etag = self.client.get(self.URL, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.publish(self.both)
+        d = json.loads(self.client.get(self.URL + '?known=' + etag).data)
+        self.assertEqual(d['keep'], 96)
+
+    def test_full_body_when_incompatible(self):
+        self.publish(self.both)
+        for query in ('?known=0123', '?first_date={0}&count=300'.format(self.T0),
+                      '?first_date={0}&count=5'.format(self.T0 + 86400 * 2)):
+            r = self.client.get(self.URL + query)
+            self.assertEqual(r.data.decode(), self.both.body, query)
+
+    def test_known_prices_changed(self):
+        self.publish(self.dap.make_record(self.T0, [5] * 96, self.T0 + 13 * 3600))
+        etag = self.client.get(self.URL).headers['ETag']
+        self.publish(self.both)
+        r = self.client.get(self.URL + '?known=' + etag)
+        self.assertEqual(r.data.decode(), self.both.body)
+
+    def test_history_is_bounded(self):
+        tags = []
+        for i in range(self.dap.DELTA_HISTORY + 1):
+            self.publish(self.dap.make_record(self.T0, list(range(96 + i)), self.T0 + 86400))
+            tags.append(self.client.get(self.URL).headers['ETag'])
+        self.assertEqual(len(self.dap.dap_history['de_lu_15min']), self.dap.DELTA_HISTORY)
+        self.assertNotIn('keep', json.loads(self.client.get(self.URL + '?known=' + tags[0]).data))
+        self.assertIn('keep', json.loads(self.client.get(self.URL + '?known=' + tags[1]).data))
+
+    def test_invalid_parameters(self):
+        self.publish(self.both)
+        for query in ('?first_date=x&count=1', '?count=1', '?first_date=1'):
+            r = self.client.get(self.URL + query)
+            self.assertEqual(r.status_code, 400, query)
+            self.assertIn('error', json.loads(r.data))
+
+
+class TestPollJitter(unittest.TestCase):
+    """Clients are told different, but stable, times to come back."""
+
+    T0 = 1700000000 - 1700000000 % 86400
+    URL = '/v1/day_ahead_prices/de/15min'
+
+    def setUp(self):
+        import services.day_ahead_prices as dap
+        self.dap = dap
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.client = self.app.test_client()
+        self.record = dap.make_record(self.T0, list(range(96)), self.T0 + 13 * 3600 + 1800)
+        for p in (patch.object(dap, 'dap_records', {}), patch.object(dap, 'dap_history', {})):
+            p.start()
+            self.addCleanup(p.stop)
+        dap._publish({'de_lu_15min': self.record})
+
+    def get(self, bucket=None, remote_addr='127.0.0.1', **kwargs):
+        headers = kwargs.pop('headers', {})
+        if bucket is not None:
+            headers['X-Poll-Bucket'] = str(bucket)
+        return self.client.get(self.URL, headers=headers, environ_base={'REMOTE_ADDR': remote_addr}, **kwargs)
+
+    def test_next_date_per_bucket(self):
+        from services import poll_jitter
+        next_dates = set()
+        for bucket in range(poll_jitter.JITTER_BUCKETS):
+            r = self.get(bucket)
+            next_date = json.loads(r.data)['next_date']
+            self.assertEqual(next_date, self.record.next_date + poll_jitter.offset(bucket))
+            next_dates.add(next_date)
+            # the proxy keeps them until the record's next_date
+            self.assertEqual(r.headers['Expires'], self.get(0).headers['Expires'])
+        self.assertEqual(len(next_dates), poll_jitter.JITTER_BUCKETS)
+        self.assertLess(max(next_dates) - min(next_dates), poll_jitter.JITTER_WINDOW)
+
+    def test_bucket_from_address(self):
+        from services import poll_jitter
+        buckets = set()
+        for i in range(64):
+            addr = '10.0.{0}.{1}'.format(i // 8, i)
+            first = json.loads(self.get(remote_addr=addr).data)['next_date']
+            self.assertEqual(json.loads(self.get(remote_addr=addr).data)['next_date'], first)
+            self.assertEqual(first, self.record.next_date + poll_jitter.offset(poll_jitter.bucket_of(addr)))
+            buckets.add(first)
+        self.assertGreater(len(buckets), poll_jitter.JITTER_BUCKETS // 2)
+        # a bucket set by the proxy wins, invalid ones are ignored
+        self.assertEqual(json.loads(self.get(3, remote_addr='10.0.0.1').data)['next_date'],
+                         self.record.next_date + poll_jitter.offset(3))
+        for header in ('x', '-1', str(poll_jitter.JITTER_BUCKETS)):
+            r = self.client.get(self.URL, headers={'X-Poll-Bucket': header}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            self.assertEqual(json.loads(r.data)['next_date'], json.loads(self.get(remote_addr='10.0.0.1').data)['next_date'])
+
+    def test_variants_prebuilt(self):
+        from services import http_cache
+        with patch('services.http_cache.compress', wraps=http_cache.compress) as compress:
+            etags = {self.get(5).headers['ETag'] for _ in range(3)}
+            for bucket in range(30):
+                self.get(bucket, headers={'Accept-Encoding': 'gzip'})
+        compress.assert_not_called()  # done when the record was made
+        self.assertEqual(len(etags), 1)
+        # the updater still sees the record's own next_date
+        self.assertIs(self.dap.dap_records['de_lu_15min'], self.record)
+        r = self.get(5, headers={'If-None-Match': etags.pop()})
+        self.assertEqual(r.status_code, 304)
+        r = self.get(5, query_string={'format': 'binary'})
+        from services import binary_format, poll_jitter
+        self.assertEqual(binary_format.decode_series(r.data)['next_date'], self.record.next_date + poll_jitter.offset(5))
+
+    def test_shared_caches(self):
+        r = self.get(5)
+        self.assertEqual(r.headers['Vary'], 'Accept, Accept-Encoding, X-Poll-Bucket')
+        self.assertTrue(r.headers['Cache-Control'].startswith('public, '))
+        # a bucket from the client address is unknown to a shared cache
+        r = self.get(remote_addr='10.0.0.1')
+        self.assertEqual(r.headers['Vary'], 'Accept, Accept-Encoding, X-Poll-Bucket')
+        self.assertTrue(r.headers['Cache-Control'].startswith('private, '))
+
+    def test_delta_from_jittered_etag(self):
+        etag = self.get(7).headers['ETag']
+        both = self.dap.make_record(self.T0, list(range(192)), self.T0 + 86400 + 13 * 3600)
+        self.dap._publish({'de_lu_15min': both})
+        r = self.get(7, query_string={'known': etag})
+        d = json.loads(r.data)
+        self.assertEqual(d['keep'], 96)
+        self.assertEqual(d['next_date'], json.loads(self.get(7).data)['next_date'])
+        self.assertEqual(r.headers['ETag'], self.get(7).headers['ETag'])
+
+
+class TestImportBudget(unittest.TestCase):
+    """The web process must start with only what request serving needs."""
+
+    def test_no_heavy_imports(self):
+        """Test that importing the services neither loads pandas/numpy nor needs entsoe.key."""
+        import subprocess
+        import tempfile
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ("import sys; sys.path.insert(0, %r)\n"
+                "import services.status\n"
+                "print(','.join(m for m in ('pandas', 'numpy') if m in sys.modules))" % project_dir)
+        with tempfile.TemporaryDirectory() as cwd:
+            p = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                               capture_output=True, text=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout.strip(), '')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import fast_path
+from tests.fixtures import T0
+
+PATHS = ('/v1/day_ahead_prices/de/15min', '/v1/day_ahead_prices/LU/60min', '/v1/temperatures/51.9/8.6',
+         '/v1/temperatures/51.901/8.6', '/v1/solar_forecast/51.9/8.6/30/0/5000', '/estimate/51.9/8.6/30/0/5')
+HEADERS = ({}, {'Accept-Encoding': 'gzip'}, {'Accept-Encoding': 'gzip;q=0, deflate'},
+           {'Accept': 'application/vnd.warp.series'}, {'Accept': 'application/*;q=0.5, application/json;q=0.1'},
+           {'X-Poll-Bucket': '5', 'Accept-Encoding': 'br, gzip'})
+
+
+class TestFastPath(unittest.TestCase):
+
+    def setUp(self):
+        records = {'de_lu_15min': dap.make_record(T0, list(range(96)), T0 + 13 * 3600),
+                   'de_lu_60min': dap.make_record(T0, list(range(24)), T0 + 13 * 3600, 'PT60M')}
+        for p in (patch.object(dap, 'dap_records', records), patch.object(dap, 'dap_history', {})):
+            p.start()
+            self.addCleanup(p.stop)
+        temps._cache.clear()
+        sf._cache.clear()
+        self.addCleanup(temps._cache.clear)
+        self.addCleanup(sf._cache.clear)
+        temps._store({(51.9, 8.6): temps._entry(T0, list(range(48)), time.time())}, shared=False)
+        sf._cache[sf._cache_key(51.9, 8.6, 30, 0)] = {
+            'first_date': T0, 'utc_offset': 7200, 'place': 'Europe/Berlin', 'gti': [float(h) for h in range(72)],
+            'etag': 'abc', 'responses': {}, 'fetched': time.time()}
+
+        self.app = Flask(__name__)
+        for blueprint in (dap.day_ahead_prices_api, temps.temperatures_api, sf.solar_forecast_api):
+            self.app.register_blueprint(blueprint)
+        self.flask_calls = 0
+        flask_app = self.app.wsgi_app
+
+        def counted(environ, start_response):
+            self.flask_calls += 1
+            return flask_app(environ, start_response)
+        self.fast = fast_path.FastPath(counted)
+
+    def call(self, wsgi, path, headers=None, **kwargs):
+        environ = EnvironBuilder(path=path, headers=headers, environ_base={'REMOTE_ADDR': '10.1.2.3'},
+                                 **kwargs).get_environ()
+        body, status, headers = run_wsgi_app(wsgi, environ)
+        return status, sorted(headers.items()), b''.join(body)
+
+    def test_same_as_flask(self):
+        for path in PATHS:
+            for headers in HEADERS:
+                with self.subTest(path=path, headers=headers):
+                    expected = self.call(self.app.wsgi_app, path, headers)
+                    self.assertEqual(self.call(self.fast, path, headers), expected)
+                    etag = dict(expected[1])['ETag']
+                    revalidate = dict(headers, **{'If-None-Match': etag})
+                    expected = self.call(self.app.wsgi_app, path, revalidate)
+                    self.assertEqual(expected[0], '304 NOT MODIFIED')
+                    self.assertEqual(self.call(self.fast, path, revalidate), expected)
+        self.assertEqual(self.flask_calls, 0)
+
+    def test_falls_through(self):
+        answered = (self.call(self.fast, '/v1/day_ahead_prices/de/15min', query_string='first_date=1&count=2'),
+                    self.call(self.fast, '/v1/day_ahead_prices/xx/15min'),
+                    self.call(self.fast, '/v1/day_ahead_prices/at/15min'),
+                    self.call(self.fast, '/v1/temperatures/abc/8.6'),
+                    self.call(self.fast, '/v1/solar_forecast/51.9/8.6/30/0/0'),
+                    self.call(self.fast, '/v1/day_ahead_prices/de/15min/'),
+                    self.call(self.fast, '/v1/day_ahead_prices/de/15min', method='HEAD'))
+        self.assertEqual([status[:3] for status, _, _ in answered], ['200', '400', '404', '400', '422', '404', '200'])
+        self.assertEqual(self.flask_calls, len(answered))
+
+    def test_miss_goes_to_flask(self):
+        data = {'hourly': {'time': [T0 + h * 3600 for h in range(48)], 'temperature_2m': [1.0] * 48}}
+        with patch.object(temps, 'fetch_temperature_forecast', return_value=data) as fetch:
+            first = self.call(self.fast, '/v1/temperatures/50.0/8.0')
+            self.assertEqual(self.flask_calls, 1)
+            self.assertEqual(self.call(self.fast, '/v1/temperatures/50.0/8.0'), first)
+        fetch.assert_called_once()
+        self.assertEqual(self.flask_calls, 1)
+
+    def test_error_goes_to_flask(self):
+        with patch.object(dap, 'cached_response', side_effect=RuntimeError('broken')), \
+             self.assertLogs(fast_path.logger, level='ERROR'):
+            status, _, _ = self.call(self.fast, '/v1/day_ahead_prices/de/15min')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(self.flask_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
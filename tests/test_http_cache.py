@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.serving import make_server
+import services.day_ahead_prices as dap
+import services.solar_forecast as sf
+from services import http_cache, temperatures
+from tests.caching_proxy_standin import CachingProxyStandIn
+from tests.test_solar_forecast import make_open_meteo_response
+
+NOW = 1760400000
+
+
+def temperature_data():
+    return {'hourly': {'time': [NOW + i * 3600 for i in range(48)],
+                       'temperature_2m': [10.0] * 48}}
+
+
+def max_age(response):
+    cache_control = response.headers['Cache-Control']
+    return int(cache_control.split('max-age=')[1])
+
+
+class TestCacheHeaders(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.app.register_blueprint(sf.solar_forecast_api)
+        self.app.register_blueprint(temperatures.temperatures_api)
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_X_POLL_BUCKET'] = '0'  # as the proxy sends it
+        sf._cache.clear()
+        temperatures._cache.clear()
+        clock = patch('services.http_cache.time.time', return_value=NOW)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_prices_valid_until_next_date(self):
+        record = dap.make_record(NOW - 3600, [1, 2, 3, 4], NOW + 5000)
+        with patch.object(dap, 'dap_records', {'de_lu_15min': record}):
+            r = self.client.get('/v1/day_ahead_prices/de/15min')
+            self.assertEqual(r.headers['Cache-Control'], 'public, max-age=5000')
+            self.assertEqual(r.headers['Expires'], http_cache.http_date(NOW + 5000))
+
+            # a 304 carries the same validity
+            r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'If-None-Match': r.headers['ETag']})
+            self.assertEqual(r.status_code, 304)
+            self.assertEqual(max_age(r), 5000)
+
+    def test_prices_past_next_date(self):
+        record = dap.make_record(NOW - 3600, [1, 2, 3, 4], NOW - 100)
+        with patch.object(dap, 'dap_records', {'de_lu_15min': record}):
+            r = self.client.get('/v1/day_ahead_prices/de/15min')
+        self.assertEqual(max_age(r), http_cache.MIN_MAX_AGE)
+
+    def test_solar_remaining_ttl(self):
+        with patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()), \
+             patch('services.solar_forecast.time.time', return_value=NOW - 1000):
+            self.client.get('/v1/solar_forecast/51.0/8.0/30/0/5000')
+        with patch('services.solar_forecast.time.time', return_value=NOW):
+            r = self.client.get('/v1/solar_forecast/51.0/8.0/30/0/5000')
+            self.assertEqual(max_age(r), sf.CACHE_TTL_SECONDS - 1000)
+            # until the ratelimit period changes
+            r = self.client.get('/estimate/51.0/8.0/30/0/5')
+            self.assertLessEqual(max_age(r), sf.RATELIMIT_STEP)
+
+    def test_temperatures(self):
+        with patch('services.temperatures.fetch_temperature_forecast', return_value=temperature_data()), \
+             patch('services.temperatures.time.time', return_value=NOW):
+            r = self.client.get('/v1/temperatures/52.52/13.41')
+        self.assertEqual(max_age(r), temperatures.CACHE_TTL_SECONDS)
+
+    def test_errors_not_cacheable(self):
+        with patch.object(dap, 'dap_records', {}):
+            r = self.client.get('/v1/day_ahead_prices/de/15min')
+        self.assertEqual(r.status_code, 404)
+        self.assertNotIn('Cache-Control', r.headers)
+        r = self.client.get('/v1/temperatures/100/0')
+        self.assertNotIn('Cache-Control', r.headers)
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.app.register_blueprint(sf.solar_forecast_api)
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_X_POLL_BUCKET'] = '0'  # next_date as in the record
+        sf._cache.clear()
+        temperatures._cache.clear()
+        self.record = dap.make_record(NOW, list(range(8000, 8192)), NOW + 86400)
+        records = patch.object(dap, 'dap_records', {'de_lu_15min': self.record})
+        records.start()
+        self.addCleanup(records.stop)
+
+    def test_prices_gzip(self):
+        with patch('services.http_cache.compress') as compress:
+            r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'Accept-Encoding': 'gzip, deflate'})
+        compress.assert_not_called()  # done when the record was made
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(r.headers['Vary'], 'Accept, Accept-Encoding, X-Poll-Bucket')
+        self.assertEqual(gzip.decompress(r.data).decode(), self.record.body)
+        self.assertLess(len(r.data), len(self.record.body) / 2)
+
+    def test_identity(self):
+        for accept in (None, 'identity', 'gzip;q=0', 'deflate'):
+            headers = {'Accept-Encoding': accept} if accept else {}
+            r = self.client.get('/v1/day_ahead_prices/de/15min', headers=headers)
+            self.assertNotIn('Content-Encoding', r.headers, accept)
+            self.assertEqual(r.data.decode(), self.record.body)
+
+    def test_etag_per_encoding(self):
+        plain = self.client.get('/v1/day_ahead_prices/de/15min').headers['ETag']
+        zipped = self.client.get('/v1/day_ahead_prices/de/15min', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.assertNotEqual(plain, zipped)
+        r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped})
+        self.assertEqual(r.status_code, 304)
+        self.assertNotIn('Content-Encoding', r.headers)
+        r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'If-None-Match': zipped})
+        self.assertEqual(r.status_code, 200)
+
+    @unittest.skipUnless(http_cache.brotli, 'brotli not installed')
+    def test_prices_brotli_preferred(self):
+        r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(r.headers['Content-Encoding'], 'br')
+        self.assertEqual(http_cache.brotli.decompress(r.data).decode(), self.record.body)
+
+    def test_solar_compressed_once(self):
+        with patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()):
+            plain = self.client.get('/estimate/51.0/8.0/30/0/5').data
+        with patch('services.http_cache.compress', wraps=http_cache.compress) as compress:
+            for _ in range(3):
+                r = self.client.get('/estimate/51.0/8.0/30/0/5', headers={'Accept-Encoding': 'gzip'})
+                self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(gzip.decompress(r.data), plain)
+        self.assertEqual(compress.call_count, 1)
+        self.assertLess(len(r.data), len(plain) / 3)
+
+
+class TestCachingProxy(unittest.TestCase):
+    """The app behind a caching reverse proxy, like nginx in production."""
+
+    def setUp(self):
+        sf._cache.clear()
+        temperatures._cache.clear()
+        app = Flask(__name__)
+        app.register_blueprint(dap.day_ahead_prices_api)
+        app.register_blueprint(sf.solar_forecast_api)
+        app.register_blueprint(temperatures.temperatures_api)
+        self.backend_requests = 0
+        wsgi_app = app.wsgi_app
+
+        def counting(environ, start_response):
+            self.backend_requests += 1
+            return wsgi_app(environ, start_response)
+        app.wsgi_app = counting
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.backend = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+        now = int(time.time())
+        record = dap.make_record(now - 3600, list(range(96)), now + 3600)
+        for p in (patch.object(dap, 'dap_records', {'de_lu_15min': record, 'at_15min': record}),
+                  patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()),
+                  patch('services.temperatures.fetch_temperature_forecast', return_value=temperature_data())):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def get(self, proxy, path):
+        try:
+            with urlopen(proxy.url + path, timeout=10) as r:
+                return r.status, r.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+    def test_hit_ratio(self):
+        paths = ['/v1/day_ahead_prices/de/15min',
+                 '/v1/day_ahead_prices/at/15min',
+                 '/v1/temperatures/52.52/13.41',
+                 '/v1/solar_forecast/51.0/8.0/30/0/5000',
+                 '/estimate/51.0/8.0/30/0/5']
+        with CachingProxyStandIn(self.backend) as proxy:
+            for _ in range(40):  # devices
+                for path in paths:
+                    status, body = self.get(proxy, path)
+                    self.assertEqual(status, 200)
+                    json.loads(body)
+        self.assertEqual(self.backend_requests, len(paths))
+        self.assertEqual(proxy.misses, len(paths))
+        self.assertGreaterEqual(proxy.hit_ratio, 0.97)
+
+    def test_expired_entries_refetched(self):
+        with CachingProxyStandIn(self.backend) as proxy:
+            self.get(proxy, '/v1/day_ahead_prices/de/15min')
+            self.get(proxy, '/v1/day_ahead_prices/de/15min')
+            proxy.clock = lambda: time.time() + 3601
+            self.get(proxy, '/v1/day_ahead_prices/de/15min')
+        self.assertEqual((proxy.hits, proxy.misses), (1, 2))
+
+    def test_errors_pass_through(self):
+        with CachingProxyStandIn(self.backend) as proxy:
+            for _ in range(3):
+                status, _ = self.get(proxy, '/v1/day_ahead_prices/xx/15min')
+                self.assertEqual(status, 400)
+        self.assertEqual(proxy.hits, 0)
+        self.assertEqual(self.backend_requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
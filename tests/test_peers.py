@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import http.client
+import json
+import sys
+import os
+import time
+from contextlib import ExitStack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import peers
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+from tests.fixtures import T0, fake_temperatures, fake_irradiance
+
+NODES = ['http://10.0.0.{0}:5002'.format(i) for i in range(1, 6)]
+
+
+class TestHashRing(unittest.TestCase):
+    KEYS = [(47 + i / 100, 6 + (i * 7 % 900) / 100) for i in range(10000)]
+
+    def test_even_share(self):
+        ring = peers.HashRing(NODES[:4])
+        owners = [ring.owner(key) for key in self.KEYS]
+        for node in NODES[:4]:
+            self.assertGreater(owners.count(node), len(self.KEYS) * 0.15, node)
+            self.assertLess(owners.count(node), len(self.KEYS) * 0.35, node)
+        self.assertEqual(owners, [peers.HashRing(list(reversed(NODES[:4]))).owner(key) for key in self.KEYS])
+
+    def test_adding_node_moves_its_share(self):
+        before = peers.HashRing(NODES[:4])
+        after = peers.HashRing(NODES)
+        moved = [key for key in self.KEYS if before.owner(key) != after.owner(key)]
+        self.assertTrue(all(after.owner(key) == NODES[4] for key in moved))
+        self.assertLess(len(moved), len(self.KEYS) * 0.35)
+
+
+class PeerTestBase(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(peers.configure, None, None)
+        sf._cache.clear()
+        temps._cache.clear()
+
+    def owned_by(self, kind_keys, node):
+        return next(key for key in kind_keys if peers._ring.owner(key) == node)
+
+
+class TestPeerEndpoint(PeerTestBase):
+    LOCATIONS = [(round(50 + i / 100, 2), 8.0) for i in range(100)]
+    PLANES = [(round(50 + i / 100, 2), 8.0, 30, 0) for i in range(100)]
+
+    def setUp(self):
+        super().setUp()
+        peers.configure(NODES[0], NODES[:2])
+        self.app = Flask(__name__)
+        self.app.register_blueprint(peers.peers_api)
+        self.client = self.app.test_client()
+        self.mine = [key for key in self.LOCATIONS if peers.owner(key) is None]
+        self.theirs = [key for key in self.LOCATIONS if peers.owner(key) is not None]
+
+    def post(self, kind, body, status=200):
+        r = self.client.post('/internal/v1/peer/' + kind, json=body)
+        self.assertEqual(r.status_code, status, r.data)
+        return r.get_json()
+
+    def test_temperatures(self):
+        with patch.object(temps, 'fetch_temperature_forecasts',
+                          side_effect=lambda locations: [fake_temperatures(*l) for l in locations]) as fetch:
+            d = self.post('temperatures', {'keys': [list(self.mine[0]), list(self.mine[1])]})
+        fetch.assert_called_once()
+        self.assertEqual(len(d['entries']), 2)
+        fetched, (first_date, values) = d['entries'][0]
+        self.assertEqual(first_date, T0)
+        self.assertEqual(values, [100 + h for h in range(48)])
+        self.assertEqual(fetched, temps._cache[self.mine[0]]['fetched'])
+
+    def test_solar(self):
+        key = self.owned_by(self.PLANES, NODES[0])
+        with patch.object(sf, 'fetch_irradiance', side_effect=fake_irradiance):
+            d = self.post('solar', {'keys': [list(key)]})
+        fetched, data = d['entries'][0]
+        self.assertEqual(data['gti'], fake_irradiance(*key)['gti'])
+        self.assertEqual(sorted(data), sorted(sf._SHARED_FIELDS))
+
+    def test_never_forwards(self):
+        with patch.object(temps, 'fetch_temperature_forecasts',
+                          side_effect=lambda locations: [fake_temperatures(*l) for l in locations]) as fetch, \
+             patch.object(peers, '_ask') as ask:
+            self.post('temperatures', {'keys': [list(self.mine[0])]})
+        fetch.assert_called_once()
+        ask.assert_not_called()
+
+    def test_only_owned_keys_once(self):
+        keys = [self.mine[0], self.theirs[0], self.mine[0]]
+        with patch.object(temps, 'fetch_temperature_forecasts',
+                          side_effect=lambda locations: [fake_temperatures(*l) for l in locations]) as fetch:
+            d = self.post('temperatures', {'keys': [list(key) for key in keys]})
+        fetch.assert_called_once_with([self.mine[0]])
+        self.assertIsNone(d['entries'][1])
+        self.assertEqual(d['entries'][0], d['entries'][2])
+
+    def test_upstream_error(self):
+        with patch.object(temps, 'fetch_temperature_forecasts', side_effect=OSError('down')):
+            d = self.post('temperatures', {'keys': [list(self.mine[0])]}, 502)
+        self.assertEqual(d['error'], 'Upstream unavailable')
+
+    def test_invalid(self):
+        self.post('wind', {'keys': []}, 404)
+        with patch.object(temps, 'fetch_temperature_forecasts') as fetch, \
+             patch.object(sf, 'fetch_irradiance') as fetch_irradiance:
+            for body in ({}, {'keys': 'x'}, {'keys': [['a', 1]]}, {'keys': [[True, 8.0]]},
+                         {'keys': [[1e9, -5e8]]}, {'keys': [[51.9, 8.6, 1]]}, {'keys': [[51.904, 8.6]]},
+                         {'keys': [[1, 2]] * (peers.MAX_PEER_KEYS + 1)}):
+                self.post('temperatures', body, 400)
+            for key in ([1e9, -5e8, 999, 12345], [51.9, 8.6, 95, 0], [51.9, 8.6], [51.9, 8.6, 30.5, 0]):
+                self.post('solar', {'keys': [key]}, 400)
+        fetch.assert_not_called()
+        fetch_irradiance.assert_not_called()
+
+    def test_disabled(self):
+        peers.configure(None, None)
+        with patch.object(temps, 'fetch_temperature_forecasts') as fetch:
+            self.post('temperatures', {'keys': [list(self.mine[0])]}, 404)
+        fetch.assert_not_called()
+
+
+class TestPeerClient(PeerTestBase):
+
+    def test_asks_owner(self):
+        peers.configure(NODES[0], NODES[:2])
+        key = self.owned_by(TestHashRing.KEYS, NODES[1])
+        answer = [[time.time(), [T0, list(range(48))]]]
+        with patch.object(peers, '_ask', return_value=answer) as ask, \
+             patch.object(temps, 'fetch_temperature_forecast') as fetch:
+            entry = temps.get_cached_temperatures(*key)
+            self.assertIs(temps.get_cached_temperatures(*key), entry)
+        ask.assert_called_once_with(NODES[1], 'temperatures', [key])
+        fetch.assert_not_called()
+        self.assertEqual(entry['temperatures'], list(range(48)))
+
+    def test_owned_here(self):
+        peers.configure(NODES[0], NODES[:2])
+        key = self.owned_by(TestHashRing.KEYS, NODES[0])
+        with patch.object(peers, '_ask') as ask, \
+             patch.object(temps, 'fetch_temperature_forecast', side_effect=fake_temperatures) as fetch:
+            temps.get_cached_temperatures(*key)
+        ask.assert_not_called()
+        fetch.assert_called_once()
+
+    def test_owner_down(self):
+        peers.configure('http://127.0.0.1:1', ['http://127.0.0.1:1', 'http://127.0.0.1:9'])
+        key = sf._cache_key(*self.owned_by([(51.9 + i / 100, 8.6, 30, 0) for i in range(100)], 'http://127.0.0.1:9'))
+        errors = peers.get_health()['errors']
+        with patch.object(sf, 'fetch_irradiance', side_effect=fake_irradiance) as fetch, \
+             self.assertLogs(peers.logger, level='WARNING'):
+            sf.get_cached_irradiance(*key)
+        fetch.assert_called_once()
+        self.assertEqual(peers.get_health()['errors'], errors + 1)
+
+    def test_disabled(self):
+        peers.configure(NODES[0], NODES[:1])
+        self.assertIsNone(peers.owner((51.9, 8.6)))
+        with self.assertRaises(ValueError):
+            peers.configure(NODES[0], NODES[1:3])
+
+
+class TestNodes(unittest.TestCase):
+    """Every node is asked for every location, Open-Meteo once per location."""
+    LOCATIONS = [(50 + i / 10, 8.0) for i in range(12)]
+
+    def get(self, server, url):
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+        conn.request('GET', url)
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        body = response.read()
+        conn.close()
+        return body
+
+    def post(self, server, locations):
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+        conn.request('POST', '/v1/temperatures', json.dumps({'locations': locations}),
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        results = json.loads(response.read())
+        conn.close()
+        self.assertFalse(any('error' in r for r in results))
+        return results
+
+    def test_upstream_calls_flat(self):
+        for n in (1, 2, 3):
+            with OpenMeteoStandIn() as standin, ExitStack() as stack:
+                servers = [GunicornServer('gthread', standin.url) for _ in range(n)]
+                for server in servers:
+                    server.peers = [s.url for s in servers]
+                    stack.enter_context(server)
+                bodies = set()
+                for server in servers:
+                    for lat, lon in self.LOCATIONS:
+                        bodies.add(self.get(server, '/v1/temperatures/{0}/{1}'.format(lat, lon)))
+                self.assertEqual(len(bodies), len(self.LOCATIONS), n)
+                self.assertEqual(standin.locations, len(self.LOCATIONS), n)
+
+                batch = [[51 + i / 10, 9.0] for i in range(30)]
+                for server in servers:
+                    self.post(server, batch)
+                self.assertEqual(standin.locations, len(self.LOCATIONS) + len(batch), n)
+
+
+if __name__ == '__main__':
+    unittest.main()
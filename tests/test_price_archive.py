@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from services import price_archive
+from tests.fixtures import T0
+
+DE_LU = '10Y1001A1001A82H'
+AT = '10YAT-APG------L'
+DAY = 24 * 3600
+
+
+class ArchiveTestBase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmpdir.name, 'warp.db')
+
+    def tearDown(self):
+        price_archive._local.conns = {}
+        self.tmpdir.cleanup()
+
+
+class TestPriceArchive(ArchiveTestBase):
+
+    def test_append_and_query_roundtrip(self):
+        prices = list(range(192))  # two days of 15min data, crosses a UTC day
+        price_archive.append(self.db, DE_LU, 900, T0, prices)
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0, T0 + 2 * DAY), prices)
+
+    def test_query_subrange(self):
+        prices = list(range(192))
+        price_archive.append(self.db, DE_LU, 900, T0, prices)
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0 + 3600, T0 + 7200), [4, 5, 6, 7])
+
+    def test_unknown_slots_are_none(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [1, 2])
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0 - 1800, T0 + 3600),
+                         [None, None, 1, 2, None, None])
+
+    def test_newer_values_replace_older(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [1, 2, 3, 4])
+        price_archive.append(self.db, DE_LU, 900, T0 + 1800, [30, 40, 50])
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0, T0 + 5 * 900), [1, 2, 30, 40, 50])
+
+    def test_zones_and_resolutions_are_separate(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [1] * 4)
+        price_archive.append(self.db, AT, 900, T0, [2] * 4)
+        price_archive.append(self.db, DE_LU, 3600, T0, [3])
+        self.assertEqual(price_archive.query(self.db, AT, 900, T0, T0 + 3600), [2] * 4)
+        self.assertEqual(price_archive.query(self.db, DE_LU, 3600, T0, T0 + 3600), [3])
+
+    def test_negative_prices(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [-12345, 0, 12345])
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0, T0 + 2700), [-12345, 0, 12345])
+
+    def test_range_query_uses_primary_key(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [1])
+        conn = price_archive._connect(self.db)
+        plan = ' '.join(str(r) for r in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT block_start, prices FROM day_ahead_price_blocks '
+            'WHERE zone=? AND resolution=? AND block_start>=? AND block_start<? ORDER BY block_start',
+            (DE_LU, 900, T0, T0 + DAY)))
+        self.assertIn('PRIMARY KEY', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class TestHistoryEndpoint(ArchiveTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.client = self.app.test_client()
+        patcher = patch.object(dap, 'WARP_DB_FILE', self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_history(self):
+        price_archive.append(self.db, DE_LU, 900, T0, [10, 20, 30, 40])
+        r = self.client.get(f'/v1/day_ahead_prices/lu/15min/history?from={T0 + 100}&to={T0 + 3600}')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content_type, 'application/json; charset=utf-8')
+        d = json.loads(r.data)
+        self.assertEqual(d['first_date'], T0)  # aligned to the resolution
+        self.assertEqual(d['resolution'], 15)
+        self.assertEqual(d['prices'], [10, 20, 30, 40])
+
+    def test_missing_parameters(self):
+        r = self.client.get('/v1/day_ahead_prices/de/15min/history?from=1')
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get('/v1/day_ahead_prices/de/15min/history?from=abc&to=2')
+        self.assertEqual(r.status_code, 400)
+
+    def test_invalid_range(self):
+        r = self.client.get(f'/v1/day_ahead_prices/de/15min/history?from={T0}&to={T0}')
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get(f'/v1/day_ahead_prices/de/15min/history?from={T0}&to={T0 + 400 * DAY}')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(json.loads(r.data)['error'], 'Range too large')
+
+    def test_unsupported_country(self):
+        r = self.client.get(f'/v1/day_ahead_prices/fr/15min/history?from={T0}&to={T0 + DAY}')
+        self.assertEqual(r.status_code, 400)
+
+    def test_unsupported_resolution(self):
+        for url in ('/v1/day_ahead_prices/ch/15min/history', '/v1/day_ahead_prices/de/5min/history'):
+            r = self.client.get(f'{url}?from={T0}&to={T0 + DAY}')
+            self.assertEqual(r.status_code, 400, url)
+            self.assertEqual(json.loads(r.data)['error'], 'Resolution not supported')
+        r = self.client.get(f'/v1/day_ahead_prices/ch/60min/history?from={T0}&to={T0 + DAY}')
+        self.assertEqual(r.status_code, 200)
+
+    def test_update_archives_fetched_prices(self):
+        value = dap.make_record(T0, [1, 2, 3, 4], T0 + DAY)
+        with patch.object(dap, 'dap_records', {}), \
+             patch.object(dap, 'SNAPSHOT_FILE', os.path.join(self.tmpdir.name, 'snapshot.json')), \
+             patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=value):
+            dap.update()
+        self.assertEqual(price_archive.query(self.db, AT, 900, T0, T0 + 3600), [1, 2, 3, 4])
+        self.assertEqual(price_archive.query(self.db, DE_LU, 900, T0, T0 + 3600), [1, 2, 3, 4])
+        # the derived resolutions are archived as well
+        self.assertEqual(price_archive.query(self.db, DE_LU, 3600, T0, T0 + 3600), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
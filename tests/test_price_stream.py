@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.day_ahead_prices as dap
+from services import price_stream
+from tests.fixtures import T0
+
+
+class StreamClient:
+    """Minimal SSE client on a plain socket."""
+
+    def __init__(self, port, path='/v1/day_ahead_prices/de/15min/stream', headers=None):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        request = 'GET {0} HTTP/1.1\r\nHost: localhost\r\n'.format(path)
+        for k, v in (headers or {}).items():
+            request += '{0}: {1}\r\n'.format(k, v)
+        self.sock.sendall((request + '\r\n').encode())
+        self.buf = b''
+
+    def _read(self, sep):
+        while sep not in self.buf:
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError(self.buf)
+            self.buf += data
+        chunk, self.buf = self.buf.split(sep, 1)
+        return chunk.decode()
+
+    def head(self):
+        lines = self._read(b'\r\n\r\n').split('\r\n')
+        return int(lines[0].split()[1]), dict(l.split(': ', 1) for l in lines[1:])
+
+    def event(self):
+        """Return the next event (dict of its fields), skipping comments and retry."""
+        while True:
+            fields = {}
+            for line in self._read(b'\n\n').split('\n'):
+                if line and not line.startswith(':'):
+                    key, _, value = line.partition(': ')
+                    fields[key] = value
+            if 'data' in fields:
+                return fields
+
+    def close(self):
+        self.sock.close()
+
+
+class TestPriceStream(unittest.TestCase):
+
+    def setUp(self):
+        self.record = dap.make_record(T0, list(range(96)), T0 + 13 * 3600)
+        for p in (patch.object(dap, 'dap_records', {'de_lu_15min': self.record}),
+                  patch.object(dap, 'dap_history', {}),
+                  patch.object(dap, 'publish_listeners', [])):
+            p.start()
+            self.addCleanup(p.stop)
+        self.stream = price_stream.PriceStream().start(port=0)
+        self.addCleanup(self.stream.stop)
+
+    def client(self, *args, **kwargs):
+        client = StreamClient(self.stream.port, *args, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def wait_for_subscribers(self, n):
+        deadline = time.time() + 5
+        while self.stream.connections < n:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_current_record_first(self):
+        client = self.client()
+        status, headers = client.head()
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'text/event-stream')
+        event = client.event()
+        self.assertEqual(event['event'], 'prices')
+        self.assertEqual(event['id'], self.record.etag)
+        self.assertEqual(event['data'], self.record.body)
+
+    def test_update_pushed_to_all(self):
+        clients = [self.client() for _ in range(20)]
+        for c in clients:
+            c.head()
+            c.event()
+        self.wait_for_subscribers(20)
+        new = dap.make_record(T0, list(range(192)), T0 + 86400 + 13 * 3600)
+        dap._publish({'de_lu_15min': new})
+        for c in clients:
+            event = c.event()
+            self.assertEqual(event['id'], new.etag)
+            self.assertEqual(json.loads(event['data'])['prices'], list(range(192)))
+
+    def test_only_subscribed_zone(self):
+        de = self.client()
+        de.head()
+        de.event()
+        at = self.client('/v1/day_ahead_prices/at/15min/stream')
+        at.head()
+        self.wait_for_subscribers(2)
+        at_record = dap.make_record(T0, [5] * 96, T0 + 13 * 3600)
+        dap._publish({'at_15min': at_record})
+        self.assertEqual(at.event()['id'], at_record.etag)
+        new = dap.make_record(T0, [7] * 96, T0 + 13 * 3600)
+        dap._publish({'de_lu_15min': new})
+        self.assertEqual(de.event()['id'], new.etag)  # not the AT record
+
+    def test_republished_record_not_sent_again(self):
+        client = self.client()
+        client.head()
+        client.event()
+        self.wait_for_subscribers(1)
+        dap._publish({'de_lu_15min': dap.make_record(T0, list(range(96)), T0 + 13 * 3600)})
+        new = dap.make_record(T0, list(range(192)), T0 + 86400)
+        dap._publish({'de_lu_15min': new})
+        self.assertEqual(client.event()['id'], new.etag)
+
+    def test_last_event_id(self):
+        client = self.client(headers={'Last-Event-ID': self.record.etag})
+        client.head()
+        self.wait_for_subscribers(1)
+        new = dap.make_record(T0, list(range(192)), T0 + 86400)
+        dap._publish({'de_lu_15min': new})
+        self.assertEqual(client.event()['id'], new.etag)
+
+    def test_waits_for_first_record(self):
+        with patch.object(dap, 'dap_records', {}):
+            client = self.client()
+            self.assertEqual(client.head()[0], 200)
+            self.wait_for_subscribers(1)
+            dap._publish({'de_lu_15min': self.record})
+            self.assertEqual(client.event()['id'], self.record.etag)
+
+    def test_keepalive(self):
+        with patch.object(price_stream, 'KEEPALIVE_SECONDS', 0.05):
+            stream = price_stream.PriceStream().start(port=0)
+            self.addCleanup(stream.stop)
+            client = StreamClient(stream.port)
+            self.addCleanup(client.close)
+            client.head()
+            client.event()
+            self.assertEqual(client._read(b'\n\n'), ':')
+
+    def test_disconnect_unsubscribes(self):
+        client = self.client()
+        client.head()
+        self.wait_for_subscribers(1)
+        client.close()
+        deadline = time.time() + 5
+        while self.stream.connections:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_errors(self):
+        for path, status, error in (('/v1/day_ahead_prices/xx/15min/stream', 400, 'Country not supported'),
+                                    ('/v1/day_ahead_prices/de/5min/stream', 400, 'Resolution not supported'),
+                                    ('/v1/day_ahead_prices/de/15min', 404, 'Not found')):
+            client = self.client(path)
+            code, headers = client.head()
+            self.assertEqual(code, status, path)
+            body = client.sock.recv(1000) if not client.buf else client.buf
+            self.assertEqual(json.loads(body)['error'], error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import http.client
+import sqlite3
+import sys
+import os
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.solar_forecast as sf
+import services.temperatures as temps
+from services import shared_cache
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+from tests.fixtures import T0, fake_temperatures, fake_irradiance
+
+
+class SharedCacheTestBase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'cache.db')
+        shared_cache.enable(self.path)
+        self.addCleanup(shared_cache.enable, None)
+        sf._cache.clear()
+        temps._cache.clear()
+
+
+class TestSharedCache(SharedCacheTestBase):
+
+    def test_roundtrip(self):
+        now = time.time()
+        shared_cache.put('solar', {(51.9, 8.6, 30, 0): (now, {'gti': [1.0, 2.0]})}, 3600)
+        self.assertEqual(shared_cache.get('solar', (51.9, 8.6, 30, 0), now, 3600), (now, {'gti': [1.0, 2.0]}))
+        self.assertIsNone(shared_cache.get('temperatures', (51.9, 8.6, 30, 0), now, 3600))
+        self.assertIsNone(shared_cache.get('solar', (51.9, 8.6, 30, 1), now, 3600))
+
+    def test_expired(self):
+        now = time.time()
+        shared_cache.put('temperatures', {(51.9, 8.6): (now - 100, [T0, [1]])}, 3600)
+        self.assertIsNotNone(shared_cache.get('temperatures', (51.9, 8.6), now, 101))
+        self.assertIsNone(shared_cache.get('temperatures', (51.9, 8.6), now, 99))
+
+    def test_get_many(self):
+        now = time.time()
+        keys = [(50 + i / 100, 8.0) for i in range(1200)]
+        shared_cache.put('temperatures', {key: (now, [T0, [i]]) for i, key in enumerate(keys) if i % 2}, 3600)
+        found = shared_cache.get_many('temperatures', keys, now, 3600)
+        self.assertEqual(sorted(found), sorted(keys[1::2]))
+        self.assertEqual(found[keys[7]], (now, [T0, [7]]))
+
+    def test_disabled(self):
+        shared_cache.enable(None)
+        shared_cache.put('solar', {(1, 2, 3, 4): (time.time(), {})}, 3600)
+        self.assertIsNone(shared_cache.get('solar', (1, 2, 3, 4), time.time(), 3600))
+
+    def test_broken_database_is_a_miss(self):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('DROP TABLE forecast_cache')
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(shared_cache.get_many('solar', [(1, 2, 3, 4)], time.time(), 3600), {})
+        with self.assertLogs(level='ERROR'):
+            shared_cache.put('solar', {(1, 2, 3, 4): (time.time(), {})}, 3600)
+
+
+class TestSharedForecasts(SharedCacheTestBase):
+    """A cleared in-memory cache is what another worker process starts with."""
+
+    def test_solar(self):
+        with patch.object(sf, 'fetch_irradiance', side_effect=fake_irradiance) as fetch:
+            entry = sf.get_cached_irradiance(51.9, 8.6, 30, 0)
+            sf._cache.clear()
+            shared = sf.get_cached_irradiance(51.9, 8.6, 30, 0)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertIsNot(shared, entry)
+        self.assertEqual(shared['gti'], entry['gti'])
+        self.assertEqual(shared['fetched'], entry['fetched'])
+        self.assertEqual(shared['responses'], {})
+        self.assertEqual(sf.compute_forecast(shared, 5000), sf.compute_forecast(entry, 5000))
+
+    def test_temperatures(self):
+        with patch.object(temps, 'fetch_temperature_forecast', side_effect=fake_temperatures) as fetch:
+            entry = temps.get_cached_temperatures(51.9, 8.6)
+            temps._cache.clear()
+            shared = temps.get_cached_temperatures(51.9, 8.6)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual({k: shared[k] for k in ('first_date', 'temperatures', 'body', 'etag', 'fetched')},
+                         {k: entry[k] for k in ('first_date', 'temperatures', 'body', 'etag', 'fetched')})
+
+    def test_temperature_batch(self):
+        keys = [(50.0, 8.0), (50.01, 8.0), (50.02, 8.0)]
+        with patch.object(temps, 'fetch_temperature_forecasts',
+                          side_effect=lambda locations: [fake_temperatures(*l) for l in locations]) as fetch:
+            temps.fetch_batch(keys[:2])
+            temps._cache.clear()
+            found = temps._cached(keys, time.time())
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(sorted(found), keys[:2])
+        self.assertEqual(len(temps._cache), 2)
+
+
+class TestWorkerProcesses(unittest.TestCase):
+
+    def test_one_upstream_call_per_location(self):
+        with tempfile.TemporaryDirectory() as tmpdir, OpenMeteoStandIn() as standin, \
+             GunicornServer('gthread', standin.url, workers=3, shared_cache=os.path.join(tmpdir, 'cache.db')) as server:
+            for _ in range(30):
+                conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+                conn.request('GET', '/v1/temperatures/50.1/8.0')
+                response = conn.getresponse()
+                self.assertEqual(response.status, 200)
+                response.read()
+                conn.close()
+        self.assertEqual(standin.requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
 import services.solar_forecast as sf
+from services import poll_jitter
 from services.solar_forecast import (
     solar_forecast_api,
     compute_forecast,
@@ -145,7 +146,9 @@ class TestEstimateEndpoint(SolarForecastTestBase):
             data = json.loads(r.data)
             # message block the firmware relies on
             self.assertEqual(data['message']['code'], 0)
-            self.assertEqual(data['message']['ratelimit']['period'], 3600)
+            # next poll just after the cache entry expired, see TestPollTiming
+            period = data['message']['ratelimit']['period']
+            self.assertGreaterEqual(2 * period, sf.CACHE_TTL_SECONDS)
             # firmware stores limit/remaining as int8 -> must fit -128..127
             rl = data['message']['ratelimit']
             self.assertTrue(-128 <= rl['limit'] <= 127)
@@ -212,6 +215,96 @@ class TestCaching(SolarForecastTestBase):
                 self.assertAlmostEqual(b, 2 * a, delta=1)
 
 
+class TestConditionalGet(SolarForecastTestBase):
+
+    def test_not_modified_without_building_body(self):
+        with patch('services.solar_forecast.urlopen') as mock_urlopen:
+            mock_urlopen.return_value = make_open_meteo_response()
+            for url in ('/estimate/51.0/8.0/30/0/5', '/v1/solar_forecast/51.0/8.0/30/0/5000'):
+                r = self.client.get(url)
+                etag = r.headers['ETag']
+                with patch('services.solar_forecast.compute_forecast') as compute:
+                    r = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(r.status_code, 304)
+                self.assertEqual(r.data, b'')
+                compute.assert_not_called()
+
+    def test_etag_depends_on_power_and_forecast(self):
+        with patch('services.solar_forecast.urlopen') as mock_urlopen:
+            mock_urlopen.return_value = make_open_meteo_response()
+            e5 = self.client.get('/v1/solar_forecast/51.0/8.0/30/0/5000').headers['ETag']
+            e10 = self.client.get('/v1/solar_forecast/51.0/8.0/30/0/10000').headers['ETag']
+            self.assertNotEqual(e5, e10)
+
+            # unchanged forecast after a refetch: still not modified
+            sf._cache.clear()
+            r = self.client.get('/v1/solar_forecast/51.0/8.0/30/0/5000', headers={'If-None-Match': e5})
+            self.assertEqual(r.status_code, 304)
+
+            sf._cache.clear()
+            mock_urlopen.return_value = make_open_meteo_response(gti=[float(i) + 1 for i in range(72)])
+            r = self.client.get('/v1/solar_forecast/51.0/8.0/30/0/5000', headers={'If-None-Match': e5})
+            self.assertEqual(r.status_code, 200)
+
+
+class TestPollTiming(SolarForecastTestBase):
+
+    ENTRY = {'fetched': 1700000000}
+    KEY = (51.0, 8.0, 30, 0)
+
+    def wait(self, now, key=KEY):
+        return 2 * sf.ratelimit_period(self.ENTRY, key, now)
+
+    def test_next_poll_after_expiry(self):
+        expires = self.ENTRY['fetched'] + sf.CACHE_TTL_SECONDS
+        for age in (0, 1, 3600, 7000, sf.CACHE_TTL_SECONDS - 1, sf.CACHE_TTL_SECONDS + 10):
+            now = self.ENTRY['fetched'] + age
+            poll = now + self.wait(now)
+            self.assertGreater(poll, expires, age)
+            self.assertLessEqual(poll, expires + poll_jitter.JITTER_WINDOW + sf.RATELIMIT_STEP, age)
+
+    def test_changes_in_steps(self):
+        now = self.ENTRY['fetched'] + 100
+        periods = {sf.ratelimit_period(self.ENTRY, self.KEY, now + t) for t in range(0, sf.RATELIMIT_STEP, 10)}
+        self.assertLessEqual(len(periods), 2)
+
+    def test_jitter_per_location(self):
+        now = self.ENTRY['fetched']
+        self.assertEqual(self.wait(now), self.wait(now))
+        waits = {self.wait(now, (51.0 + i * 0.01, 8.0, 30, 0)) for i in range(50)}
+        self.assertGreater(len(waits), 1)
+
+    def test_body_rebuilt_per_period(self):
+        url = '/estimate/51.0/8.0/30/0/5'
+        fetched = 1700000000
+        key = sf._cache_key(51.0, 8.0, 30, 0)
+        target = fetched + sf.CACHE_TTL_SECONDS + poll_jitter.offset(poll_jitter.bucket_of(key))
+        with patch('services.solar_forecast.urlopen', return_value=make_open_meteo_response()), \
+             patch('services.solar_forecast.time.time', return_value=fetched):
+            self.client.get(url)
+
+        def get(now, etag=None):
+            with patch('services.solar_forecast.time.time', return_value=now):
+                return self.client.get(url, headers={'If-None-Match': etag} if etag else {})
+
+        # the same period within a step
+        r = get(target - 3 * sf.RATELIMIT_STEP - 400)
+        self.assertEqual(get(target - 3 * sf.RATELIMIT_STEP - 100, r.headers['ETag']).status_code, 304)
+        r2 = get(target - 2 * sf.RATELIMIT_STEP, r.headers['ETag'])
+        self.assertEqual(r2.status_code, 200)
+        self.assertEqual(json.loads(r2.data)['message']['ratelimit']['period'], sf.RATELIMIT_STEP)
+        self.assertEqual(len(sf._cache[key]['responses']), 1)
+
+        # caches keep a body only until its period changes
+        for ahead in (3 * sf.RATELIMIT_STEP - 400, 2 * sf.RATELIMIT_STEP - 100):
+            now = target - ahead
+            r = get(now)
+            max_age = int(r.headers['Cache-Control'].rsplit('=', 1)[1])
+            self.assertEqual(max_age, ahead % sf.RATELIMIT_STEP)
+            self.assertNotEqual(sf.ratelimit_period(sf._cache[key], key, now + max_age),
+                                json.loads(r.data)['message']['ratelimit']['period'])
+
+
 class TestUpstreamErrors(SolarForecastTestBase):
 
     def test_upstream_failure_returns_503(self):
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import gzip
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import services.day_ahead_prices as dap
+from services import static_prices, poll_jitter
+from tests.fixtures import T0
+
+
+class TestStaticPrices(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dir = self.tmpdir.name
+        self.record = dap.make_record(T0, list(range(96)), T0 + 13 * 3600)
+        for p in (patch.object(dap, 'dap_records', {'de_lu_15min': self.record}), patch.object(dap, 'dap_history', {}),
+                  patch.object(dap, 'publish_listeners', [])):
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(static_prices.disable)
+        static_prices.enable(self.dir)
+        static_prices.flush()
+        self.app = Flask(__name__)
+        self.app.register_blueprint(dap.day_ahead_prices_api)
+        self.client = self.app.test_client()
+
+    def read(self, bucket, country='de', suffix='.json'):
+        with open(static_prices.path_of(self.dir, bucket, country, '15min', suffix), 'rb') as f:
+            return f.read()
+
+    def test_same_as_flask(self):
+        for bucket in (0, 7, poll_jitter.JITTER_BUCKETS - 1):
+            r = self.client.get('/v1/day_ahead_prices/de/15min', headers={'X-Poll-Bucket': str(bucket)})
+            for country in ('de', 'lu'):
+                self.assertEqual(self.read(bucket, country), r.data)
+                self.assertEqual(gzip.decompress(self.read(bucket, country, '.json.gz')), r.data)
+            r = self.client.get('/v1/day_ahead_prices/de/15min?format=binary', headers={'X-Poll-Bucket': str(bucket)})
+            self.assertEqual(self.read(bucket, suffix='.bin'), r.data)
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(str(b) for b in range(poll_jitter.JITTER_BUCKETS)))
+
+    def test_written_when_changed(self):
+        path = static_prices.path_of(self.dir, 0, 'de', '15min')
+        before = os.stat(path).st_ino
+        dap._publish({'de_lu_15min': self.record})
+        static_prices.flush()
+        self.assertEqual(os.stat(path).st_ino, before)
+
+        record = dap.make_record(T0, list(range(1, 97)), T0 + 13 * 3600)
+        dap._publish({'de_lu_15min': record})
+        static_prices.flush()
+        self.assertNotEqual(os.stat(path).st_ino, before)
+        self.assertEqual(self.read(0), record.body.encode())
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(path))))
+
+    def test_write_error_retried(self):
+        record = dap.make_record(T0, list(range(1, 97)), T0 + 13 * 3600)
+        with patch.object(static_prices, '_write', side_effect=OSError('disk full')), \
+             self.assertLogs(static_prices.logger, level='ERROR'):
+            dap._publish({'de_lu_15min': record})
+            static_prices.flush()
+        dap._publish({'de_lu_15min': record})
+        static_prices.flush()
+        self.assertEqual(self.read(0), record.body.encode())
+
+    def test_publish_does_not_block(self):
+        records = [dap.make_record(T0, list(range(i, 96 + i)), T0 + 13 * 3600) for i in range(1, 4)]
+        written = []
+        with patch.object(static_prices, '_write_records',
+                          side_effect=lambda directory, r: (time.sleep(0.2), written.append(dict(r)))):
+            start = time.monotonic()
+            for record in records:
+                dap._publish({'de_lu_15min': record})
+            self.assertLess(time.monotonic() - start, 0.1)
+            self.assertTrue(static_prices.flush(5))
+        # what was published while the writer was busy is written once, the latest
+        self.assertLessEqual(len(written), 2)
+        self.assertIs(written[-1]['de_lu_15min'], records[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
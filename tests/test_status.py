@@ -68,7 +68,9 @@ class TestStatusEndpoint(unittest.TestCase):
         for rec in dap.values():
             for field in ('serving_data', 'source_used', 'last_success',
                           'entsoe_entries', 'fallback_attempted',
-                          'consecutive_failures', 'last_error', 'last_error_at'):
+                          'consecutive_failures', 'last_error', 'last_error_at',
+                          'fetch_mode', 'bytes_downloaded', 'bytes_downloaded_total',
+                          'hedged', 'entsoe_latency_ms', 'entsoe_wins', 'fallback_wins'):
                 self.assertIn(field, rec)
         self.assertIn('now', d)
 
@@ -103,6 +105,22 @@ class TestStatusEndpoint(unittest.TestCase):
         rj = client.get('/v1/status')
         self.assertEqual(rj.headers['Content-Type'], 'application/json; charset=utf-8')
 
+    def test_status_page_shows_download(self):
+        import os
+        from unittest.mock import patch
+        from services import day_ahead_prices
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        app = Flask(__name__,
+                    template_folder=os.path.join(root, 'templates'),
+                    static_folder=os.path.join(root, 'static'))
+        app.register_blueprint(status_api)
+        from services.health import Health
+        h = Health(**dict(day_ahead_prices._health_for('at_15min'), bytes_downloaded=12345, fetch_mode='incremental'))
+        with patch.dict(day_ahead_prices._health, {'at_15min': h}):
+            body = app.test_client().get('/en/status').data.decode()
+        self.assertIn('12.3 kB', body)
+        self.assertIn('incremental', body)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
+from urllib.error import URLError
+import services.temperatures as temps
+from tests.open_meteo_standin import OpenMeteoStandIn
 from services.temperatures import temperatures_api, fetch_temperature_forecast, format_temperature_response
 
 
@@ -21,6 +24,7 @@ class TestTemperaturesAPI(unittest.TestCase):
         self.app = Flask(__name__)
         self.app.register_blueprint(temperatures_api)
         self.client = self.app.test_client()
+        temps._cache.clear()
 
     # -------------------------------------------------------------------------
     # Input Validation Tests
@@ -303,6 +307,48 @@ class TestTemperaturesAPI(unittest.TestCase):
             data = json.loads(response.data)
             self.assertEqual(data['error'], 'Invalid response from weather service')
 
+    # -------------------------------------------------------------------------
+    # Conditional GET Tests
+    # -------------------------------------------------------------------------
+
+    def test_etag_not_modified(self):
+        """Test that an unchanged forecast is answered with an empty 304."""
+        with patch('services.temperatures.fetch_temperature_forecast') as mock_fetch:
+            mock_fetch.return_value = self._mock_open_meteo_response()
+            response = self.client.get('/v1/temperatures/52.52/13.41')
+            etag = response.headers['ETag']
+
+            response = self.client.get('/v1/temperatures/52.52/13.41', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            # A changed forecast after the cache entry expired
+            temps._cache.clear()
+            mock_fetch.return_value = self._mock_open_meteo_response(hourly=[1.0] * 48)
+            response = self.client.get('/v1/temperatures/52.52/13.41', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_served_from_cache(self):
+        """Test that nearby coordinates share one cached upstream call."""
+        with patch('services.temperatures.fetch_temperature_forecast') as mock_fetch:
+            mock_fetch.return_value = self._mock_open_meteo_response()
+            first = self.client.get('/v1/temperatures/52.52/13.41')
+            second = self.client.get('/v1/temperatures/52.521/13.409')
+            self.assertEqual(mock_fetch.call_count, 1)
+            mock_fetch.assert_called_with(52.52, 13.41)
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_errors_not_cached(self):
+        """Test that a failed upstream call is retried by the next request."""
+        with patch('services.temperatures.fetch_temperature_forecast') as mock_fetch:
+            mock_fetch.side_effect = URLError('Connection refused')
+            self.assertEqual(self.client.get('/v1/temperatures/52.52/13.41').status_code, 503)
+            mock_fetch.side_effect = None
+            mock_fetch.return_value = self._mock_open_meteo_response()
+            self.assertEqual(self.client.get('/v1/temperatures/52.52/13.41').status_code, 200)
+
     # -------------------------------------------------------------------------
     # Helper Methods
     # -------------------------------------------------------------------------
@@ -460,5 +506,109 @@ class TestFetchTemperatureForecast(unittest.TestCase):
             self.assertNotIn('timezone=UTC', url)
 
 
+class TestBatch(unittest.TestCase):
+    """Tests for POST /v1/temperatures against the Open-Meteo stand-in."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(temperatures_api)
+        self.client = self.app.test_client()
+        temps._cache.clear()
+        self.standin = OpenMeteoStandIn(latency=0.05)
+        self.standin.__enter__()
+        self.addCleanup(self.standin.__exit__)
+        url = patch.object(temps, 'OPEN_METEO_BASE_URL', self.standin.url)
+        url.start()
+        self.addCleanup(url.stop)
+
+    def post(self, locations, status=200):
+        response = self.client.post('/v1/temperatures', json={'locations': locations})
+        self.assertEqual(response.status_code, status, response.data)
+        return json.loads(response.data)
+
+    def test_results_in_request_order(self):
+        locations = [[50 + i * 0.1, 8 + i * 0.1] for i in range(20)]
+        results = self.post(locations)
+        self.assertEqual([[r['lat'], r['lon']] for r in results], locations)
+        for (lat, lon), result in zip(locations, results):
+            single = json.loads(self.client.get('/v1/temperatures/{0}/{1}'.format(lat, lon)).data)
+            self.assertEqual(result['first_date'], single['first_date'])
+            self.assertEqual(result['temperatures'], single['temperatures'])
+        self.assertEqual(self.standin.requests, 1)
+
+    def test_duplicates_fetched_once(self):
+        locations = [[50 + (i % 10) * 0.1, 8.001 * (1 + i % 2 * 1e-5)] for i in range(300)]
+        results = self.post(locations)
+        self.assertEqual(len(results), 300)
+        self.assertEqual(self.standin.locations, 10)
+        self.assertEqual(self.standin.requests, 1)
+
+    def test_misses_grouped(self):
+        locations = [[40 + i * 0.01, 8] for i in range(temps.UPSTREAM_BATCH * 6 + 1)]
+        self.post(locations)
+        self.assertEqual(self.standin.requests, 7)
+        self.assertEqual(self.standin.locations, len(locations))
+        self.assertGreater(self.standin.max_in_flight, 1)
+        self.assertLessEqual(self.standin.max_in_flight, temps.UPSTREAM_CONCURRENCY)
+
+    def test_cached_locations_not_fetched(self):
+        self.post([[50, 8], [51, 9]])
+        results = self.post([[51, 9], [52, 10], [50, 8]])
+        self.assertEqual(self.standin.locations, 3)
+        self.assertEqual(len(results), 3)
+
+    def test_failed_group(self):
+        self.post([[50, 8]])
+        with patch.object(temps, 'OPEN_METEO_BASE_URL', 'http://127.0.0.1:1/v1/dwd-icon'):
+            results = self.post([[50, 8], [51, 9], [52, 10]])
+        self.assertIn('temperatures', results[0])
+        self.assertEqual(results[1], {'lat': 51.0, 'lon': 9.0, 'error': 'Weather service unavailable'})
+        self.assertEqual(results[2]['error'], 'Weather service unavailable')
+
+    def test_refused_location(self):
+        locations = [[40 + i * 0.01, 8] for i in range(temps.UPSTREAM_BATCH)]
+        self.standin.refused.add((40.37, 8.0))
+        results = self.post(locations)
+        self.assertEqual(results[37], {'lat': 40.37, 'lon': 8, 'error': 'Weather service unavailable'})
+        self.assertEqual(sum('temperatures' in result for result in results), temps.UPSTREAM_BATCH - 1)
+        self.assertEqual(self.standin.locations, temps.UPSTREAM_BATCH - 1)
+        self.assertLess(self.standin.requests, 20)
+        self.assertEqual(temps.get_health()['last_error'], 'HTTPError: 400 Bad Request')
+
+    def test_invalid_forecast(self):
+        real = temps.fetch_temperature_forecasts
+
+        def fetch(locations):
+            data = real(locations)
+            data[1]['hourly']['temperature_2m'] = []
+            return data
+
+        with patch.object(temps, 'fetch_temperature_forecasts', side_effect=fetch):
+            results = self.post([[50, 8], [51, 9], [52, 10]])
+        self.assertIn('temperatures', results[0])
+        self.assertEqual(results[1]['error'], 'Weather service unavailable')
+        self.assertIn('temperatures', results[2])
+        self.assertEqual(self.standin.requests, 1)
+
+    def test_streamed(self):
+        response = self.client.post('/v1/temperatures', json={'locations': [[50, 8]]}, buffered=False)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(len(json.loads(response.get_data())), 1)
+        response.close()
+
+    def test_invalid_requests(self):
+        for body, error in ((b'{', 'Invalid JSON body'),
+                            (b'[]', 'locations must be a list of [lat, lon]'),
+                            (b'{"locations":[[50,8],[50]]}', 'Invalid location at index 1'),
+                            (b'{"locations":[["a",8]]}', 'Invalid location at index 0'),
+                            (b'{"locations":[[91,8]]}', 'Location out of range at index 0')):
+            response = self.client.post('/v1/temperatures', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(json.loads(response.data)['error'], error)
+        with patch.object(temps, 'MAX_BATCH_LOCATIONS', 2):
+            self.assertEqual(self.post([[50, 8]] * 3, 400)['error'], 'At most 2 locations')
+        self.assertEqual(self.standin.requests, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
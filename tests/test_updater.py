@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+import json
+import multiprocessing
+import sys
+import os
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.day_ahead_prices as dap
+import updater
+
+
+def follow(path, results):
+    """A web worker with PRICE_UPDATER=external, in a process of its own."""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and 'de_lu_15min' not in dap.dap_records:
+        dap.reload_snapshot(path)
+        time.sleep(0.05)
+    results.put((sorted(dap.dap_records), dap._health_for('de_lu_60min')['source_used']))
+
+
+class TestUpdater(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'snapshot.json')
+        self.record = dap.make_record(1700000000, list(range(96)), 1700100000)
+        for p in (patch.object(dap, 'SNAPSHOT_FILE', self.path),
+                  patch.object(dap, 'WARP_DB_FILE', os.path.join(self.tmpdir.name, 'warp.db')),
+                  patch.object(dap, 'update_day_ahead_prices_with_retry', return_value=self.record),
+                  patch.object(dap, 'dap_records', {}), patch.object(dap, 'dap_history', {}),
+                  patch.object(dap, '_snapshot_version', 0), patch.object(dap, '_snapshot_seen', None)):
+            p.start()
+            self.addCleanup(p.stop)
+        dap._health.clear()
+
+    def read(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_snapshot_every_round(self):
+        updater.update_once()
+        self.assertEqual(self.read()['version'], 1)
+        # Nothing to update, written again for the health
+        with patch.object(dap, 'is_update_necessary', return_value=False):
+            updater.update_once()
+        snapshot = self.read()
+        self.assertEqual(snapshot['version'], 2)
+        self.assertEqual(snapshot['records']['de_lu_15min'], self.record.body)
+
+    def test_worker_process_follows(self):
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        worker = ctx.Process(target=follow, args=(self.path, results))
+        worker.start()
+        try:
+            time.sleep(0.2)
+            updater.update_once()
+            names, source = results.get(timeout=15)
+        finally:
+            worker.join(15)
+        self.assertEqual(names, sorted(dap.dap_records))
+        self.assertEqual(source, 'derived')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import http.client
+import importlib.util
+import json
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.health import Health
+from tests.open_meteo_standin import OpenMeteoStandIn
+from tests.gunicorn_server import GunicornServer
+
+UPSTREAM_LATENCY = 1.0
+
+
+class TestHealth(unittest.TestCase):
+
+    def test_no_lost_updates(self):
+        h = Health(count=0, total=0)
+
+        def work():
+            for _ in range(2000):
+                h.update(add={"count": 1, "total": 2})
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(dict(h), {"count": 16000, "total": 32000})
+
+    def test_snapshot_is_consistent(self):
+        h = Health(first=0, second=0)
+        done = threading.Event()
+
+        def write():
+            for i in range(20000):
+                h.update(first=i, second=i)
+            done.set()
+
+        t = threading.Thread(target=write)
+        t.start()
+        while not done.is_set():
+            s = h.snapshot()
+            self.assertEqual(s["first"], s["second"])
+        t.join()
+
+    def test_snapshot_is_read_only(self):
+        h = Health(count=0)
+        s = h.snapshot()
+        with self.assertRaises(TypeError):
+            s["count"] = 1
+        h.update(add={"count": 1})
+        self.assertEqual(s["count"], 0)
+        self.assertEqual(h["count"], 1)
+
+
+class WorkerTestBase:
+    """Cheap price requests while temperature requests wait for the upstream."""
+    worker_class = None
+    threads = 16
+
+    def setUp(self):
+        self.standin = OpenMeteoStandIn(latency=UPSTREAM_LATENCY)
+        self.standin.__enter__()
+        self.addCleanup(self.standin.__exit__, None, None, None)
+        self.server = GunicornServer(self.worker_class, self.standin.url, self.threads)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def get(self, url):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=30)
+        try:
+            conn.request('GET', url)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def slow_requests(self, n):
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(self.get('/v1/temperatures/50.{0}/8.0'.format(i))))
+                   for i in range(n)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)  # let them reach the upstream
+        return threads, results
+
+    def test_price_not_blocked(self):
+        threads, results = self.slow_requests(4)
+        start = time.monotonic()
+        status, body = self.get('/v1/day_ahead_prices/de/15min')
+        elapsed = time.monotonic() - start
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['prices'], list(range(96)))
+        self.assertLess(elapsed, UPSTREAM_LATENCY / 2)
+        for t in threads:
+            t.join()
+        self.assertEqual([status for status, _ in results], [200] * 4)
+
+    def test_upstream_waits_overlap(self):
+        start = time.monotonic()
+        threads, results = self.slow_requests(8)
+        for t in threads:
+            t.join()
+        self.assertEqual([status for status, _ in results], [200] * 8)
+        self.assertLess(time.monotonic() - start, 3 * UPSTREAM_LATENCY)
+
+
+class TestSyncWorker(WorkerTestBase, unittest.TestCase):
+    # The sync worker handles one request at a time. Shows that the tests
+    # above measure what they claim to.
+    worker_class = 'sync'
+    threads = 1  # more would make gunicorn use gthread
+    test_price_not_blocked = test_upstream_waits_overlap = None
+
+    def test_price_blocked(self):
+        threads, _ = self.slow_requests(1)
+        start = time.monotonic()
+        self.assertEqual(self.get('/v1/day_ahead_prices/de/15min')[0], 200)
+        self.assertGreater(time.monotonic() - start, UPSTREAM_LATENCY / 2)
+        threads[0].join()
+
+
+class TestGthreadWorker(WorkerTestBase, unittest.TestCase):
+    worker_class = 'gthread'
+
+
+@unittest.skipUnless(importlib.util.find_spec('gevent'), 'gevent not installed')
+class TestGeventWorker(WorkerTestBase, unittest.TestCase):
+    worker_class = 'gevent'
+
+
+if __name__ == '__main__':
+    unittest.main()
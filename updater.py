@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Day-ahead price updater as a process of its own.
+#
+# Fetches the prices from ENTSO-E and writes them, with the health of the
+# updates, to the versioned snapshot file (day_ahead_prices.json). The web
+# workers, started with PRICE_UPDATER=external (see start.sh), only load
+# that file when it was replaced. So the ENTSO-E traffic does not grow with
+# the number of workers or hosts sharing the directory, and the updater does
+# not compete with request handling for a worker's GIL.
+#
+# The records are also written to static_prices/ for the reverse proxy to
+# serve, see services/static_prices.py.
+#
+# Usage: ./updater.py (see start_updater.sh)
+
+import logging
+import time
+
+from services import day_ahead_prices, static_prices
+
+UPDATE_INTERVAL = 5*60
+LOCK_RETRY_INTERVAL = 10
+
+
+def update_once():
+    # Written every time: the workers show the health of the last attempt
+    # in /v1/status, also if no price changed.
+    if not day_ahead_prices.update():
+        day_ahead_prices.save_snapshot()
+
+
+def main():
+    logging.basicConfig(filename='updater.log', level=logging.DEBUG, format="[%(asctime)s %(levelname)-8s%(filename)s:%(lineno)s] %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+
+    # A web worker started without PRICE_UPDATER=external may be updating.
+    while not day_ahead_prices.acquire_updater_lock():
+        logging.warning("Another process is updating the prices, waiting")
+        time.sleep(LOCK_RETRY_INTERVAL)
+
+    static_prices.enable()
+    day_ahead_prices.load_snapshot()
+    while True:
+        try:
+            update_once()
+        except Exception:
+            logging.error("Exception during day ahead price update", exc_info=True)
+        time.sleep(UPDATE_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()